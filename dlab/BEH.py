@@ -1,11 +1,17 @@
 import os
 import pickle
+import logging
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter, MaxNLocator, FixedLocator
 
+from dlab import profiling
+
+logger = logging.getLogger(__name__)
+
 pd.options.mode.chained_assignment = None
 
 class Project:
@@ -61,12 +67,12 @@ class Project:
                 recommended_columns_not_found.append(column)
 
         if recommended_columns_not_found:
-            print("The following recommended columns columns were not found in **kwargs: %s" % ", ".join(recommended_columns_not_found))
-            print("Note that these recommended columns may not be required depending on the design. However:")
+            logger.warning("The following recommended columns columns were not found in **kwargs: %s" % ", ".join(recommended_columns_not_found))
+            logger.warning("Note that these recommended columns may not be required depending on the design. However:")
             if 'CompQAcc' in recommended_columns_not_found or 'CompQRT' in recommended_columns_not_found:
-                print('\tBecause CompQ columns were not provided, get_CompQdata(), plot_CompQAcc() and plot_CompQRT() will not work.')
+                logger.warning('\tBecause CompQ columns were not provided, get_CompQdata(), plot_CompQAcc() and plot_CompQRT() will not work.')
             if 'WordPos' in recommended_columns_not_found or 'RT' in recommended_columns_not_found:
-                print('\tBecause WordPos and RT columns were not provided, get_RTdata() and plot_reading_times() will not work.')
+                logger.warning('\tBecause WordPos and RT columns were not provided, get_RTdata() and plot_reading_times() will not work.')
 
         df_columns_not_found = []
         for k,v in kwargs.items():
@@ -81,18 +87,19 @@ class Project:
     def __str__(self):
         return "A __str__ method has not yet been implemented"
 
-    def compute_avgs(self, inputs, outputs, groupby = []):
+    @profiling.instrument
+    def compute_avgs(self, inputs, outputs = None, groupby = []):
         """
-        Compute an average of certain conditions for each participant
+        Compute averages of conditions (derived conditions) for each participant. Many derived conditions can be declared at once; all of them are computed in a single grouped reduction and appended to self.data in one step.
         
         Required Arguments:
-        inputs (list of str) -- A list of conditions that are in the data to be average for each ppt
-        outputs (list of str) -- Condition names for the output averages
+        inputs (dict, list of str) -- the derived conditions. Either a dict of output name: list of conditions (i.e. {'Ambiguous':['AP','AS'], 'Plural':['AP','CP']}), a list of definitions as str (i.e. ['Ambiguous = AP+AS', 'Plural = AP+CP']) or a list of conditions to be averaged into a single output named by outputs.
 
         Optional Arguments:
+        outputs (str or list of str) -- Condition name for the output average if inputs is a list of conditions. Default = None
         groupby (list of str) -- Data column names to organize output means by. Default = ['PPT','Item']
         """
-        if self.data == None:
+        if not isinstance(self.data, pd.DataFrame):
             raise ValueError("No data loaded in self.data")
 
         if isinstance(groupby, list):
@@ -105,10 +112,47 @@ class Project:
                     groupby.append('WordPos')
         else:
             raise TypeError("Provided groupby must be a list. Not of type: %s" % type(groupby))
-        output_df = self.get_conditions(inputs).groupby(groupby).mean()
-        self.data = pd.concat([self.data, output_df], sort = False).reset_index()
-        
-    def get_RTdata(self, critical_conditions = [], summarize = True, remove_extremes = [200,5000], identify_missing_data = True, filter_outliers = 2):
+
+        derived = _parse_derived_conditions(inputs, outputs)
+        sources = list(dict.fromkeys(source for conditions in derived.values() for source in conditions))
+        if any(source not in self.conditions for source in sources):
+            raise ValueError('One of the provided conditions is invalid.')
+        for output in derived:
+            if output in self.conditions:
+                logger.warning("Note that a condition named %s already exists in this project." % output)
+
+        df = self.data[self.data['Condition'].isin(sources)]
+        columns = [column for column in df.select_dtypes('number').columns if column not in groupby and column != 'Condition']
+
+        #expand every record into one record per derived condition it contributes to
+        condition_codes = pd.Categorical(df['Condition'], categories = sources).codes
+        rows_by_source = np.split(np.argsort(condition_codes, kind = 'stable'), np.cumsum(np.bincount(condition_codes, minlength = len(sources)))[:-1])
+        pairs = [(sources.index(source), code) for code, conditions in enumerate(derived.values()) for source in conditions]
+        rows = np.concatenate([rows_by_source[source] for source, code in pairs])
+        output_codes = np.concatenate([np.full(len(rows_by_source[source]), code) for source, code in pairs])
+
+        group_codes = df.groupby(groupby, sort = False, dropna = False).ngroup().to_numpy()
+        groups = df[groupby].iloc[np.unique(group_codes, return_index = True)[1]]
+        key = group_codes[rows] * len(derived) + output_codes
+        size = len(groups.index) * len(derived)
+        present = np.flatnonzero(np.bincount(key, minlength = size))
+
+        output_df = groups.iloc[present // len(derived)].reset_index(drop = True)
+        output_df['Condition'] = np.array(list(derived), dtype = object)[present % len(derived)]
+        values = df[columns].to_numpy(dtype = float)[rows]
+        valid = ~np.isnan(values)
+        values[~valid] = 0
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            for j, column in enumerate(columns):
+                output_df[column] = (np.bincount(key, weights = values[:,j], minlength = size) / np.bincount(key, weights = valid[:,j], minlength = size))[present]
+
+        self.data = pd.concat([self.data, output_df], ignore_index = True, sort = False)
+        for output, conditions in derived.items():
+            logger.info("Successfully computed average named %s from the following conditions: %s" % (output, ", ".join(conditions)))
+        logger.info("This has been saved back to data.  Note that you will need to rerun get_RTdata and get_CompQdata.")
+
+    @profiling.instrument
+    def get_RTdata(self, critical_conditions = [], summarize = True, remove_extremes = [200,5000], identify_missing_data = True, filter_outliers = 2, residualize = None, robust = False):
         """
         Pulls the RT data from the Project.data Dataframe, removes extreme response times between specified window, finds missing data, and removes outliers by specified number of St. Devs.
         
@@ -118,102 +162,56 @@ class Project:
         remove_extremes (list of int) -- *Removes* extreme trials that are not between the specified range. You may provide an empty list or False to not remove any data (not recommended). Default = [200,5000]
         identify_missing_data (bool) -- Identifies if any data points are missing after remove_extremes by PPT & by items. Recommended to leave as True. Default = True
         filter_outliers (int) -- *Filters* outlier data points where data points above/below 2 SDs of group mean are replaced with group mean. Group is PPT X Condition X WordPos or Item X Condition X WordPos. Default = 2
+        residualize (str or None) -- name of a column with word lengths. If provided, RT is regressed on word length for each ppt and the residuals are added to self.RTdata as 'RTresidual'. Residuals are filtered like RTs into 'RTresidual_filtered_by_ppt_values' and 'RTresidual_filtered_by_item_values'. Default = None
+        robust (bool) -- if True, the length regressions are fit with Huber weights (iteratively reweighted least squares) so that long RTs have less influence on the fit. Only used with residualize. Default = False
         
         Note:
         required_columns = ['PPT', 'WordPos', 'Condition', 'Item', 'RT']
         """
         def _remove_extremes(df, low = 200, high = 5000, summarize = True):
-            df['RTremove'] = pd.cut(df['RT'], [0, low, high, np.inf], labels=['Below','Ok','Above'])
-            removeExtremes = (df['RT'] < high)&(df['RT'] > low)
-            df['RTremoveVal'] = np.nan
-            df['RTremoveVal'][removeExtremes] = df['RT'][removeExtremes]
+            df['RTremove'], df['RTremoveVal'] = _extreme_values(df['RT'], low, high)
 
             if summarize:
-                total = len(df.index)
-                removed = df['RTremove'].value_counts()
-                below = removed.get("Below", 0)
-                above = removed.get("Above", 0)
-                print("\nThe summary for removal of extreme values:")
-                print(">>%s or %.3f%% items were below the specified cutoff of %s ms." % (below, below*100/total, low))
-                print(">>%s or %.3f%% items were above the specified cutoff of %s ms." % (above, above*100/total, high))
+                _summarize_labels(df['RTremove'].value_counts(), len(df.index), "removal of extreme values", "%s ms" % low, "%s ms" % high)
 
             return df
 
         def _identify_missing_data(df, remove = True):
-            by_ppt = df.groupby(['PPT','Condition','WordPos'])
-            missing_by_ppt = by_ppt.mean()[by_ppt.mean().isnull().any(axis=1)]['RTremoveVal']
-            if len(missing_by_ppt) != 0:
-                print('\nMissing data if filtered by ppt:\n%s\n' % missing_by_ppt)
-                
-
-                if critical_conditions:
-                    critical_conditions_in_data = []
-                    for condition in critical_conditions:
-                        if condition in missing_by_ppt.index.get_level_values('Condition').unique():
-                            critical_conditions_in_data.append(condition)
-
-                    if critical_conditions_in_data:
-                        missing_by_ppt = missing_by_ppt.reset_index()
-                        missing_by_ppt_crit = missing_by_ppt[missing_by_ppt['Condition'].isin(critical_conditions_in_data)].set_index(['PPT','Condition','WordPos'])
-                        missing_by_ppt_filler = list(missing_by_ppt[~missing_by_ppt['Condition'].isin(critical_conditions_in_data)]['Condition'].unique())
-                        inelig_ppts = missing_by_ppt_crit.index.get_level_values('PPT').unique()
-                        print("The following ppts are missing data in critical conditions: %s" % (", ".join([str(x) for x in inelig_ppts])))
-                        print("These ppts are being removed...")
-                        df = df[~df['PPT'].isin(inelig_ppts)]
-                        print('Removed!')
-                        print('\nIf these ppts should be dropped, you should mark this on the run sheet & questionnaire data document and move the raw data to an inelig subfolder to prevent these ppts from being loaded again.')
-                        if missing_by_ppt_filler:
-                            print("\nThere is missing data in filler conditions.")
-                            print("To avoid removing ppts with valid data in critical conditions, the following conditions will not be filtered: %s" % ", ".join(missing_by_ppt_filler))
-                            df = df[~df['Condition'].isin(missing_by_ppt_filler)]
-                    else:
-                        print("Didn't need to drop any ppts as none of the above missing data affects provided critical_conditions")
-                else:
-                    print("No critical_conditions were provided so no ppts were dropped")
-            else:
-                print("No data missing by ppts.")
-
-            by_item = df.groupby(['Item','Condition','WordPos'])
-            missing_by_item = by_item.mean()[by_item.mean().isnull().any(axis=1)]['RTremoveVal']
+            by_ppt = df.groupby(['PPT','Condition','WordPos'])['RTremoveVal'].mean()
+            inelig_ppts, missing_by_ppt_filler = _missing_data_exclusions(by_ppt[by_ppt.isnull()], critical_conditions)
+            if len(inelig_ppts) != 0:
+                df = df[~df['PPT'].isin(inelig_ppts)]
+                logger.warning('Removed!')
+                logger.warning('If these ppts should be dropped, you should mark this on the run sheet & questionnaire data document and move the raw data to an inelig subfolder to prevent these ppts from being loaded again.')
+            if missing_by_ppt_filler:
+                df = df[~df['Condition'].isin(missing_by_ppt_filler)]
+
+            by_item = df.groupby(['Item','Condition','WordPos'])['RTremoveVal'].mean()
+            missing_by_item = by_item[by_item.isnull()]
             if len(missing_by_item) != 0:
-                print('\nMissing data if filtered by item:\n%s' % missing_by_item)
-                print("This should never happen - not sure what to do :(")
+                logger.warning('Missing data if filtered by item:\n%s' % missing_by_item)
+                logger.warning("This should never happen - not sure what to do :(")
 
             return df
         
         def _filter_outliers(df, ppt = True, items = True, SD = 2, summarize = True):
             total = len(df.index)
-            def outliers(group, labels_name, trimmed_name):
-                mean, std = group.mean(), group.std()
-                if np.isnan(std):
-                    std = 0.1
-                lower, upper = mean - SD*std, mean + SD*std
-                trimmed = group.mask(group < lower, lower).mask(group > upper, upper)
-                labels = pd.cut(group, [np.NINF, lower, upper, np.inf], labels=['Below','Ok','Above'])
-                return pd.DataFrame({labels_name:labels, trimmed_name:trimmed})
-
             #filter out outliers by ppt then by items
-            if ppt:
-                df[['RTfiltered_by_ppt_labels','RTfiltered_by_ppt_values']] = df.groupby(['PPT','Condition','WordPos'])['RTremoveVal'].apply(outliers,'RTfiltered_by_ppt_labels','RTfiltered_by_ppt_values')
-
-                if summarize:
-                    by_ppt_filtered = df['RTfiltered_by_ppt_labels'].value_counts()
-                    below = by_ppt_filtered.get("Below", 0)
-                    above = by_ppt_filtered.get("Above", 0)
-                    print("\nThe summary for filtering by ppt:")
-                    print(">>%s or %.3f%% items were below the specified cutoff of -%s SD." % (below, below*100/total, SD))
-                    print(">>%s or %.3f%% items were above the specified cutoff of +%s SD." % (above, above*100/total, SD))
-                            
-            if items:
-                df[['RTfiltered_by_item_labels','RTfiltered_by_item_values']] = df.groupby(['Item','Condition','WordPos'])['RTremoveVal'].apply(outliers,'RTfiltered_by_item_labels','RTfiltered_by_item_values')
-
-                if summarize:
-                    by_item_filtered = df['RTfiltered_by_item_labels'].value_counts()
-                    below = by_item_filtered.get("Below", 0)
-                    above = by_item_filtered.get("Above", 0)
-                    print("\nThe summary for filtering by items:")
-                    print(">>%s or %.3f%% items were below the specified cutoff of -%s SD." % (below, below*100/total, SD))
-                    print(">>%s or %.3f%% items were above the specified cutoff of +%s SD." % (above, above*100/total, SD))
+            for by, name, keys in [(ppt, 'ppt', ['PPT','Condition','WordPos']), (items, 'item', ['Item','Condition','WordPos'])]:
+                if by:
+                    with profiling.stage('BEH.Project.get_RTdata.filter_outliers.by_%s' % name) as record:
+                        bounds = _outlier_bounds(_group_stats(df, keys, 'RTremoveVal'), SD)
+                        labels, trimmed = _trim_outliers(df, keys, 'RTremoveVal', bounds)
+                        df['RTfiltered_by_%s_labels' % name], df['RTfiltered_by_%s_values' % name] = labels, trimmed
+
+                        if residualize:
+                            bounds = _outlier_bounds(_group_stats(df, keys, 'RTresidual'), SD)
+                            labels, trimmed = _trim_outliers(df, keys, 'RTresidual', bounds)
+                            df['RTresidual_filtered_by_%s_labels' % name], df['RTresidual_filtered_by_%s_values' % name] = labels, trimmed
+                        record['rows'] = total
+
+                    if summarize:
+                        _summarize_labels(df['RTfiltered_by_%s_labels' % name].value_counts(), total, "filtering by %s%s" % (name, "s" if name == "item" else ""), "-%s SD" % SD, "+%s SD" % SD)
 
             return df
         
@@ -221,16 +219,21 @@ class Project:
             raise ValueError("There is no data loaded. Load data from a valid source before proceeding.")
             
         required_columns = ['PPT', 'WordPos', 'Condition', 'Item', 'RT']       
+        if residualize:
+            if not isinstance(residualize, str):
+                raise TypeError("Provided residualize of type: %s is invalid. Provide the name of the word length column or None." % type(residualize))
+            required_columns.append(residualize)
 
         missing = []
         for column in required_columns:
             if column not in self.data.columns:
-                missing.append(col)
+                missing.append(column)
                 
         if missing:
-            raise ValueError('The following columns are missing in loaded data: %s' % (", ",join(missing)))
+            raise ValueError('The following columns are missing in loaded data: %s' % (", ".join(missing)))
 
         df = self.data[pd.to_numeric(self.data['RT'], errors='coerce').notnull()].loc[:,required_columns]
+        df['RT'] = pd.to_numeric(df['RT'])
 
         if isinstance(critical_conditions, list):
             if any(not isinstance(condition, str) for condition in critical_conditions):
@@ -241,47 +244,144 @@ class Project:
             raise TypeError("Provided critical_conditions object must be of type list.")
 
         if summarize:
-            print("\nThere are %s ppts in this file." % len(df['PPT'].unique()))
+            logger.info("There are %s ppts in this file." % len(df['PPT'].unique()))
             
             conds = df['Condition'].unique()
 
             if len(conds) > 1:
-                print("\nThe following conditions are in this file: %s" % ", ".join(conds))
+                logger.info("The following conditions are in this file: %s" % ", ".join(conds))
             elif len(conds) == 1:
-                print("\nThere is only one condition in this file: %s" % conds)
+                logger.info("There is only one condition in this file: %s" % conds)
             else:
                 raise ValueError("no conds loaded")
 
-            print("\nThere are %s records." % len(df.index))
+            logger.info("There are %s records." % len(df.index))
 
         if remove_extremes:
             if isinstance(remove_extremes, list):
                 if len(remove_extremes) == 2:
                     low, high = remove_extremes[0], remove_extremes[1]
                     if low < high:
-                        df = _remove_extremes(df, low, high)
+                        with profiling.stage('BEH.Project.get_RTdata.remove_extremes') as record:
+                            df = _remove_extremes(df, low, high)
+                            record['rows'] = len(df.index)
                     else:
                         raise ValueError("Ensure the provided low value (%s) is lower than the provided high value (%s)." % (low, high))
             elif remove_extremes != None:
                 raise TypeError("Provide a list [lower, upper] or None.  Provided remove_extremes of type: %s is invalid." % type(remove_extremes))
         else:
-            print("remove_extremes evaluated as False. Not removing any extreme values.")
+            logger.warning("remove_extremes evaluated as False. Not removing any extreme values.")
 
         if identify_missing_data:
-            df = _identify_missing_data(df)
+            with profiling.stage('BEH.Project.get_RTdata.identify_missing_data') as record:
+                df = _identify_missing_data(df)
+                record['rows'] = len(df.index)
+
+        if residualize:
+            with profiling.stage('BEH.Project.get_RTdata.residualize') as record:
+                df['RTresidual'] = _residual_RTs(df, residualize, 'RTremoveVal' if 'RTremoveVal' in df.columns else 'RT', robust = robust)
+                record['rows'] = len(df.index)
+            if summarize:
+                logger.info("Computed length-corrected residual RTs for %s ppts%s." % (len(df['PPT'].unique()), " with robust (Huber) fits" if robust else ""))
 
         if isinstance(filter_outliers, int) or isinstance(filter_outliers, float):
             if filter_outliers < 0:
                  raise ValueError("SD provided to filter_outliers must be a positive int or float")
             elif filter_outliers < 1 or filter_outliers > 3:
-                 print("NOTE: The provided SD: %s seems strange. Ensure you are providing the number of SD within which you wish to retain data." % filter_outliers)
-            df = _filter_outliers(df, SD = filter_outliers)
+                 logger.warning("NOTE: The provided SD: %s seems strange. Ensure you are providing the number of SD within which you wish to retain data." % filter_outliers)
+            with profiling.stage('BEH.Project.get_RTdata.filter_outliers') as record:
+                df = _filter_outliers(df, SD = filter_outliers)
+                record['rows'] = len(df.index)
         elif filter_outliers != None:
             raise TypeError("Provide an int or float specifying the standard deviations used for cutoff of outliers or use None to skip this step. Provided filter_outliers of type: %s is invalid." % type(filter_outliers))
         
         self.RTdata = df.reset_index()
-        print("\n\nSuccessfully filtered RT data. Find the filtered data in self.RTdata")
+        profiling.set_rows(len(df.index))
+        logger.info("Successfully filtered RT data. Find the filtered data in self.RTdata")
+
+    def _RTcolumn(self, by, residual = False):
+        RTcolumn = {"PPT":"RTfiltered_by_ppt_values", "Item":"RTfiltered_by_item_values"}[by]
+        if residual:
+            RTcolumn = RTcolumn.replace("RTfiltered", "RTresidual_filtered")
+            if RTcolumn not in self.RTdata.columns:
+                raise ValueError("No residual RTs found in self.RTdata. Run get_RTdata with residualize set to the word length column first.")
+        return RTcolumn
+
+    @profiling.instrument
+    def permutation_test(self, conditions, by, words = None, paired = True, residual = False, n_permutations = 10000, seed = None, chunk_size = 1000, n_jobs = 1):
+        """
+        Permutation test of the difference between two conditions at each WordPos on the by PPT or by Item means of self.RTdata (F1/F2 style). p values are given uncorrected and corrected for multiple comparisons across word positions with the max-statistic method.
+
+        Permutations are generated as a matrix (sign flips of the paired differences or relabelings of the units) and all t values of a chunk of permutations are computed with one matrix product.
+
+        Required arguments:
+        conditions (list of str) -- the two conditions being compared as [condition1, condition2]. Differences are condition1 - condition2.
+        by (str, either: 'PPT' or 'Item') -- Sets how the averages are done, either by 'PPT', or by 'Item'.
+
+        Optional arguments:
+        words (None, list of int or dict of int:str) -- the word positions to be tested. A dict such as BEH.QBehQ_S1 may be provided. If None, all word positions are tested. Default = None
+        paired (bool) -- if True, each PPT/Item contributes to both conditions and signs of the differences are flipped (PPTs/Items missing a condition are dropped). If False, the conditions are treated as independent groups and condition labels are permuted. Default = True
+        residual (bool) -- if True, tests the length-corrected residual RTs from get_RTdata(residualize = ...). Default = False
+        n_permutations (int) -- number of permutations. Default = 10000
+        seed (int or None) -- seed for the random number generator. Default = None
+        chunk_size (int) -- number of permutations computed at once. Default = 1000
+        n_jobs (int) -- number of processes the chunks are spread across. Default = 1
+
+        Returns a pd.DataFrame indexed by WordPos with the mean difference, t value, uncorrected p and corrected p.
+        """
+        if not isinstance(self.RTdata, pd.DataFrame):
+            raise ValueError("Ensure that data has been loaded and filtered.")
+
+        if by != "PPT" and by != "Item":
+            raise ValueError("Provided by: %s is invalid. Please provide 'PPT' or 'Item'" % by)
+
+        if not isinstance(conditions, list) or len(conditions) != 2:
+            raise TypeError("Provide conditions as a list of two conditions: [condition1, condition2].")
+        for cond in conditions:
+            if cond not in self.RTdata["Condition"].unique():
+                raise ValueError('Could not find the provided condition: %s' % cond)
+
+        df = self.RTdata[self.RTdata["Condition"].isin(conditions)]
+        if words is not None:
+            df = df[df["WordPos"].isin(list(words))]
+
+        means = df.groupby([by, "Condition", "WordPos"])[self._RTcolumn(by, residual)].mean().unstack("WordPos")
+        first, second = means.xs(conditions[0], level = "Condition"), means.xs(conditions[1], level = "Condition")
+
+        if paired:
+            diffs = (first - second).dropna()
+            if len(diffs.index) < len(first.index.union(second.index)):
+                logger.info("Dropped %s %s(s) missing data in one of the conditions." % (len(first.index.union(second.index)) - len(diffs.index), by))
+            values, n_first, word_positions = diffs.to_numpy(), None, diffs.columns
+            observed = diffs.mean()
+        else:
+            first, second = first.dropna(), second.dropna()
+            values, n_first, word_positions = np.vstack([first.to_numpy(), second.to_numpy()]), len(first.index), first.columns
+            observed = first.mean() - second.mean()
+
+        t_obs = _permutation_t(values, np.ones((1, len(values))) if paired else np.arange(len(values))[None,:] < n_first, paired)[0]
+
+        sizes = [min(chunk_size, n_permutations - start) for start in range(0, n_permutations, chunk_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        args = ([values] * len(sizes), sizes, seeds, [t_obs] * len(sizes), [paired] * len(sizes), [n_first] * len(sizes))
+        if n_jobs > 1 and len(sizes) > 1:
+            with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+                results = list(executor.map(_permutation_chunk, *args))
+        else:
+            results = [_permutation_chunk(*chunk_args) for chunk_args in zip(*args)]
 
+        exceed = sum(result[0] for result in results)
+        max_t = np.concatenate([result[1] for result in results])
+
+        output = pd.DataFrame({"Mean Difference":observed.to_numpy(),
+                               "t":t_obs,
+                               "p":(exceed + 1) / (n_permutations + 1),
+                               "p_corrected":((max_t[:,None] >= np.abs(t_obs)[None,:]).sum(axis = 0) + 1) / (n_permutations + 1)},
+                              index = pd.Index(word_positions, name = "WordPos"))
+        logger.info("Permutation test (%s permutations, %s) by %s for %s - %s with %s %ss." % (n_permutations, "sign flips" if paired else "label permutations", by, conditions[0], conditions[1], len(values), by))
+        return output
+
+    @profiling.instrument
     def get_CompQdata(self):
         """
         Pulls CompQdata from Project.data Dataframe
@@ -308,8 +408,9 @@ class Project:
         if missing:
             raise ValueError('The following columns are missing in loaded data: %s' % (", ".join(missing)))
   
-        self.CompQdata = self.data.groupby(['PPT','Condition','Item']).mean().loc[:,['CompQAcc','CompQRT']]
+        self.CompQdata = self.data.groupby(['PPT','Condition','Item'])[['CompQAcc','CompQRT']].mean()
 
+    @profiling.instrument
     def plot_reading_times(self, title, by, config, **kwargs):
         """
         Plotting function that plots staggered line graphs based on Response Time (RT) by condition. Uses preset config information stored in an instance of BEH.plot_configs class.
@@ -330,7 +431,7 @@ class Project:
         else:
             raise ValueError("Config could not be loaded. Ensure the config is in self.plot_configs or is a valid BEH.plot_configs object")
             
-    def _plot_reading_times(self, by, conds, words, title, c = [], fmt = [], ppts = [], items = [], adj_factor = .05, e_cap = 2, e_width = 1, e_c = 'black', lw = 1, mk = 5, X = 14, Y = 7):
+    def _plot_reading_times(self, by, conds, words, title, c = [], fmt = [], ppts = [], items = [], residual = False, error = 'sem', n_boot = 10000, ci = 95, seed = None, n_jobs = 1, adj_factor = .05, e_cap = 2, e_width = 1, e_c = 'black', lw = 1, mk = 5, X = 14, Y = 7):
         """
         Private method: Plotting function that plots staggered line graphs based on Response Time (RT) by condition. 
 
@@ -347,6 +448,9 @@ class Project:
         fmt (list of str) -- a list of formatting styles such as '-^' and '-s'. See matplotlib docs for more examples. If insufficient formatting styles are provided, all remaining linestyles will be '.' Default = []
         ppts (list of int) -- may be used to plot only a subset of participants from self.RTdata. If empty, all are included. Default = []
         items (list of str) -- may be used to plot only a subset of items from self.RTdata. If empty, all are included. Default = []
+        residual (bool) -- if True, plots the length-corrected residual RTs computed by get_RTdata(residualize = ...) instead of RTs. Default = False
+        error (str, either: 'sem' or 'ci') -- error bars show the standard error of the mean or a bootstrap confidence interval across PPTs or Items. Default = 'sem'
+        n_boot, ci, seed, n_jobs -- number of resamples, confidence level (%), random seed and number of processes for error = 'ci'. See help(BEH.bootstrap_ci). Default = 10000, 95, None & 1
         adj_factor (float) -- used to determine offset between points. Default = 0.05
         e_cap (int or float) -- size of error bar caps. Default = 2
         e_width (int or float) -- error bar thickness. Default = 1
@@ -359,7 +463,7 @@ class Project:
             raise ValueError("Ensure that data has been loaded and filtered.")
 
         if by == "PPT" or by == "Item":
-            print("Plotting data by %s..." % by)
+            logger.info("Plotting data by %s..." % by)
         else:
             raise ValueError("Provided by: %s is invalid. Please provide 'PPT' or 'item'" % by)
         
@@ -403,8 +507,7 @@ class Project:
         wordpos_mask = self.RTdata["WordPos"].isin(words.keys())
 
         mask = conds_mask & ppts_mask & items_mask & wordpos_mask
-        RTcolumn = {"PPT":"RTfiltered_by_ppt_values", "Item":"RTfiltered_by_item_values"}
-        df = self.RTdata[mask].groupby([by, "Condition", "WordPos"])[RTcolumn[by]].mean()
+        df = self.RTdata[mask].groupby([by, "Condition", "WordPos"])[self._RTcolumn(by, residual)].mean()
                 
         x = {}
         for i in range(len(conds)):
@@ -413,14 +516,14 @@ class Project:
             for j in words.keys():
                 x[conds[i]].append(j + adj)
                 
-        y = df.groupby(["Condition", "WordPos"]).mean().unstack()
-        yerr = df.groupby(["Condition", "WordPos"]).sem().unstack()
+        y, yerr_low, yerr_high = _error_bars(df, error, n_boot, ci, seed, n_jobs)
+        y, yerr_low, yerr_high = y.unstack(), yerr_low.unstack(), yerr_high.unstack()
         
         fig, ax = plt.subplots(figsize = (X,Y))
         for i in range(len(conds)):
             cond = conds[i]
             ax.errorbar(x[cond], y.loc[cond],
-                yerr = yerr.loc[cond],
+                yerr = [yerr_low.loc[cond], yerr_high.loc[cond]],
                 c = c[i], fmt = fmt[i],
                 label = cond,
                 ecolor = e_c,
@@ -439,7 +542,7 @@ class Project:
 
         plt.subplots_adjust(bottom = 0.2)
         plt.xlabel('Region', weight = 'bold', size = 'x-large')
-        plt.ylabel('Reading Time (ms)', weight = 'bold', size = 'x-large')
+        plt.ylabel('Residual Reading Time (ms)' if residual else 'Reading Time (ms)', weight = 'bold', size = 'x-large')
 
         ax.legend()
 
@@ -453,7 +556,8 @@ class Project:
         fig.savefig(os.path.join(path, title), format = "pdf")
         fig.patch.set_facecolor("white")
 
-    def plot_CompQAcc(self, title, by, conds = [], ppts = [], items = [], c = 'blue', X = 5, Y = 5, capsize = 10, x_tick_rotation = False):
+    @profiling.instrument
+    def plot_CompQAcc(self, title, by, conds = [], ppts = [], items = [], c = 'blue', X = 5, Y = 5, capsize = 10, x_tick_rotation = False, error = 'sem', n_boot = 10000, ci = 95, seed = None, n_jobs = 1):
         """
         Plotting function that makes a bar graph based on Comprehension Question Accuracy by condition. Can set the name of the outputted file, or to do a by participant or a by item analysis. Plots can be customized with optional arguments.
         
@@ -470,13 +574,14 @@ class Project:
         Y (int) -- Sets the size of the plot by the y-axis. Default = 5
         capsize (int) -- Sets the size of the error bar caps. Default = 10
         x_tick_rotation (bool) -- Sets if the x-axis labels are straight or rotated (useful if condition names are long). Default = False
+        error (str, either: 'sem' or 'ci') -- Error bars show the standard error of the mean or a bootstrap confidence interval. Default = 'sem'
+        n_boot, ci, seed, n_jobs -- Number of resamples, confidence level (%), random seed and number of processes for error = 'ci'. See help(BEH.bootstrap_ci). Default = 10000, 95, None & 1
         """
-        df = self._plot_CompQdata(by, conds, ppts, items)['CompQAcc']
+        y, yerr_low, yerr_high = _error_bars(self._plot_CompQdata(by, conds, ppts, items)['CompQAcc'], error, n_boot, ci, seed, n_jobs)
 
-        y, yerr = df.mean(), df.sem() 
-        print(y)
+        logger.info(y)
         fig, ax = plt.subplots(figsize=(X,Y))
-        ax.bar(y.index, y, yerr = yerr, color = c, capsize = capsize)
+        ax.bar(y.index, y, yerr = [yerr_low, yerr_high], color = c, capsize = capsize)
         ax.set_ylim([0,1])
 
         if x_tick_rotation:
@@ -493,7 +598,8 @@ class Project:
 
         fig.patch.set_facecolor('white')
 
-    def plot_CompQRT(self, title, by, conds = [], ppts = [], items = [], c = 'blue', y_axis_range = None, X = 5, Y = 5, capsize = 10, x_tick_rotation = False):
+    @profiling.instrument
+    def plot_CompQRT(self, title, by, conds = [], ppts = [], items = [], c = 'blue', y_axis_range = None, X = 5, Y = 5, capsize = 10, x_tick_rotation = False, error = 'sem', n_boot = 10000, ci = 95, seed = None, n_jobs = 1):
         """
         Plotting function that makes a bar graph based on Response Time (RT) by condition. Can set the name of the outputted file, or set it to do a by participant or a by items analysis. Plots can be customized with optional arguments.
         
@@ -511,13 +617,14 @@ class Project:
         Y (int) -- Sets the size of the plot by the y-axis. Default = 5
         capsize (int) -- Sets the size of the Confidence Interval caps. Default = 10
         x_tick_rotation (bool) -- Sets if the x-axis labels are straight or rotated (useful if condition names are long). Default = False
+        error (str, either: 'sem' or 'ci') -- Error bars show the standard error of the mean or a bootstrap confidence interval. Default = 'sem'
+        n_boot, ci, seed, n_jobs -- Number of resamples, confidence level (%), random seed and number of processes for error = 'ci'. See help(BEH.bootstrap_ci). Default = 10000, 95, None & 1
         """
-        df = self._plot_CompQdata(by, conds, ppts, items)['CompQRT']
+        y, yerr_low, yerr_high = _error_bars(self._plot_CompQdata(by, conds, ppts, items)['CompQRT'], error, n_boot, ci, seed, n_jobs)
 
-        y, yerr = df.mean(), df.sem()
-        print(y)
+        logger.info(y)
         fig, ax = plt.subplots(figsize=(X,Y))
-        ax.bar(y.index, y, yerr = yerr, color = c, capsize = capsize) 
+        ax.bar(y.index, y, yerr = [yerr_low, yerr_high], color = c, capsize = capsize) 
         if isinstance(y_axis_range, list):
             if len(y_axis_range) == 2:
                 if y_axis_range[0] < y_axis_range[1]:
@@ -542,8 +649,9 @@ class Project:
             raise ValueError("No data has been loaded in self.CompQdata.  Please load the CompQdata using self.get_CompQdata")
 
         idx = eval("pd.IndexSlice[%s,%s,%s]" % (ppts if ppts else ':', conds if conds else ':', items if items else ':'))
-        return self.CompQdata.loc[idx, :].groupby([by,'Condition']).mean().groupby(['Condition'])
+        return self.CompQdata.loc[idx, :].groupby([by,'Condition']).mean()
         
+    @profiling.instrument
     def load_pickle(name):
         """
         If the Project has been generated and saved before, the pickle file can be loaded using this function returning a Project object. Loading from the pickle is faster than loading from the EMSE files each time.
@@ -557,11 +665,12 @@ class Project:
             raise ValueError("Invalid file extension.  Name the file with extension: *.p")
         
         if os.path.isfile(name):
-            print("Loading: %s" % name)
+            logger.info("Loading: %s" % name)
             return pickle.load(open(name,'rb'))
         else:
             raise ValueError("File with name: %s could not be found." % name)
     
+    @profiling.instrument
     def save_pickle(self, name):
         """
         Saves the active project data as a pickle file in the current working directory. This file can be loaded using load_pickle instead of using load.
@@ -575,9 +684,9 @@ class Project:
             raise ValueError("Invalid file extension.  Name the file with extension: *.p")
         
         if os.path.isfile(name):
-            print("Overwriting existing pickle named: %s" % name)
+            logger.warning("Overwriting existing pickle named: %s" % name)
         else:
-            print("Creating new pickle named: %s" % name)
+            logger.info("Creating new pickle named: %s" % name)
             
         pickle.dump(self, open(name, 'wb'))
 
@@ -649,6 +758,393 @@ class Project:
 
         
 
+def _parse_derived_conditions(inputs, outputs = None):
+    """
+    Private function: converts the inputs of BEH.Project.compute_avgs into a dict of output name: list of source conditions.
+    """
+    if isinstance(inputs, dict):
+        derived = {output:list(conditions) for output, conditions in inputs.items()}
+    elif isinstance(inputs, list) and inputs and all(isinstance(definition, str) and "=" in definition for definition in inputs):
+        derived = {}
+        for definition in inputs:
+            output, conditions = definition.split("=", 1)
+            derived[output.strip()] = [condition.strip() for condition in conditions.split("+")]
+    elif isinstance(inputs, list):
+        if isinstance(outputs, list) and len(outputs) == 1:
+            outputs = outputs[0]
+        if not isinstance(outputs, str):
+            raise TypeError("If inputs is a list of conditions, provide a single output name as outputs. Provided outputs: %s is invalid." % outputs)
+        derived = {outputs:inputs}
+    else:
+        raise TypeError("Provided inputs object of type: %s is invalid. Provide a dict or a list." % type(inputs))
+
+    for output, conditions in derived.items():
+        if not output or not conditions or any(not isinstance(condition, str) or not condition for condition in conditions):
+            raise ValueError("Derived condition %s must be named and averaged from a list of conditions." % output)
+    return derived
+
+def _extreme_values(rt, low, high):
+    """
+    Private function: labels each RT as 'Below', 'Ok' or 'Above' the [low, high] window and returns the labels with a copy of the RTs where extreme values are replaced by NaN.
+    """
+    labels = pd.cut(rt, [0, low, high, np.inf], labels=['Below','Ok','Above'])
+    return labels, rt.where((rt < high) & (rt > low))
+
+def _summarize_labels(counts, total, step, lower, upper):
+    below = int(counts.get("Below", 0))
+    above = int(counts.get("Above", 0))
+    logger.info("The summary for %s:" % step)
+    logger.info(">>%s or %.3f%% items were below the specified cutoff of %s." % (below, below*100/total if total else 0, lower))
+    logger.info(">>%s or %.3f%% items were above the specified cutoff of %s." % (above, above*100/total if total else 0, upper))
+
+def _missing_data_exclusions(missing_by_ppt, critical_conditions):
+    """
+    Private function: decides which ppts and filler conditions are dropped because of missing data.
+
+    Required arguments:
+    missing_by_ppt (pd.Series) -- means indexed by PPT x Condition x WordPos that are missing (NaN) after removing extreme values
+    critical_conditions (list of str) -- conditions in which missing data makes a ppt ineligible
+
+    Returns the ineligible ppts and the filler conditions that should not be filtered.
+    """
+    inelig_ppts, missing_by_ppt_filler = [], []
+    if len(missing_by_ppt) != 0:
+        logger.warning('Missing data if filtered by ppt:\n%s' % missing_by_ppt)
+
+        if critical_conditions:
+            missing_conditions = missing_by_ppt.index.get_level_values('Condition')
+            critical_conditions_in_data = [condition for condition in critical_conditions if condition in missing_conditions.unique()]
+
+            if critical_conditions_in_data:
+                critical = missing_conditions.isin(critical_conditions_in_data)
+                inelig_ppts = list(missing_by_ppt[critical].index.get_level_values('PPT').unique())
+                missing_by_ppt_filler = list(missing_conditions[~critical].unique())
+                logger.warning("The following ppts are missing data in critical conditions: %s" % (", ".join([str(x) for x in inelig_ppts])))
+                logger.warning("These ppts are being removed...")
+                if missing_by_ppt_filler:
+                    logger.warning("There is missing data in filler conditions.")
+                    logger.warning("To avoid removing ppts with valid data in critical conditions, the following conditions will not be filtered: %s" % ", ".join(missing_by_ppt_filler))
+            else:
+                logger.info("Didn't need to drop any ppts as none of the above missing data affects provided critical_conditions")
+        else:
+            logger.info("No critical_conditions were provided so no ppts were dropped")
+    else:
+        logger.info("No data missing by ppts.")
+
+    return inelig_ppts, missing_by_ppt_filler
+
+def _group_stats(df, keys, column):
+    """
+    Private function: computes the number of records, the number of valid values, the mean and the sum of squared deviations (M2) of a column for each group.
+    """
+    g = df.groupby(keys, observed = True)[column]
+    stats = pd.DataFrame({'size':g.size(), 'n':g.count(), 'mean':g.mean()})
+    stats['M2'] = (g.var(ddof = 0) * stats['n']).fillna(0)
+    return stats
+
+def _merge_group_stats(a, b):
+    """
+    Private function: merges two tables from _group_stats computed on disjoint sets of records using the parallel form of Welford's algorithm.
+    """
+    if a is None:
+        return b
+    a, b = a.align(b, join = 'outer')
+    a[['size','n','M2']] = a[['size','n','M2']].fillna(0)
+    b[['size','n','M2']] = b[['size','n','M2']].fillna(0)
+
+    n = a['n'] + b['n']
+    delta = b['mean'] - a['mean']
+    stats = pd.DataFrame({'size':a['size'] + b['size'], 'n':n})
+    stats['mean'] = (a['mean'] + delta * b['n'] / n).fillna(a['mean']).fillna(b['mean'])
+    stats['M2'] = (a['M2'] + b['M2'] + delta ** 2 * a['n'] * b['n'] / n).fillna(a['M2'] + b['M2'])
+    return stats
+
+def _outlier_bounds(stats, SD):
+    """
+    Private function: converts a table from _group_stats into the lower and upper cutoffs mean -/+ SD * std for each group. Groups with a single value use a std of 0.1.
+    """
+    std = np.sqrt(stats['M2'] / (stats['n'] - 1)).where(stats['n'] > 1, 0.1)
+    return pd.DataFrame({'lower':stats['mean'] - SD * std, 'upper':stats['mean'] + SD * std})
+
+def _trim_outliers(df, keys, column, bounds):
+    """
+    Private function: replaces values of a column outside of the group cutoffs in bounds with the cutoffs and labels them as 'Below', 'Ok' or 'Above'.
+    """
+    bounds = df[keys].join(bounds, on = keys)
+    lower, upper = bounds['lower'].to_numpy(), bounds['upper'].to_numpy()
+    values = df[column].to_numpy(dtype = float)
+
+    codes = np.where(values < lower, 0, np.where(values > upper, 2, 1))
+    codes[np.isnan(values)] = -1
+    labels = pd.Categorical.from_codes(codes, categories = ['Below','Ok','Above'])
+    return pd.Series(labels, index = df.index), pd.Series(np.clip(values, lower, upper), index = df.index)
+
+def _bootstrap_chunk(values, n_boot, seed):
+    """
+    Private function: draws n_boot resamples of the rows of values as one index matrix and returns the column means of every resample (n_boot x columns).
+    """
+    n = values.shape[0]
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, n, size = (n_boot, n))
+    counts = np.bincount((idx + n * np.arange(n_boot)[:,None]).ravel(), minlength = n_boot * n).reshape(n_boot, n).astype(float)
+    valid = ~np.isnan(values)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return (counts @ np.where(valid, values, 0)) / (counts @ valid)
+
+@profiling.instrument
+def bootstrap_ci(values, n_boot = 10000, ci = 95, seed = None, chunk_size = 1000, n_jobs = 1):
+    """
+    Computes percentile bootstrap confidence intervals of the mean for every column of values by resampling rows (i.e. PPTs or Items) with replacement. Missing values (NaN) are ignored.
+
+    Resamples are drawn as an index matrix and the means are computed as a matrix product, chunk_size resamples at a time. Every chunk has its own seed derived from seed, so results are the same for any n_jobs.
+
+    Required Arguments:
+    values (np.ndarray or pd.DataFrame) -- 2D data where rows are PPTs or Items and columns are cells (i.e. Condition X WordPos)
+
+    Optional Arguments:
+    n_boot (int) -- number of bootstrap resamples. Default = 10000
+    ci (int or float) -- confidence level in %. Default = 95
+    seed (int or None) -- seed for the random number generator. Default = None
+    chunk_size (int) -- number of resamples computed at once. Lower this to reduce memory use. Default = 1000
+    n_jobs (int) -- number of processes the chunks are spread across. Default = 1
+
+    Returns the lower and upper bounds as np.ndarrays with one value per column.
+    """
+    values = np.asarray(values, dtype = float)
+    if values.ndim != 2:
+        raise ValueError("Provided values must be 2 dimensional (rows x cells). Provided values have %s dimensions." % values.ndim)
+    if not 0 < ci < 100:
+        raise ValueError("Provided ci: %s must be between 0 and 100." % ci)
+    if not isinstance(n_boot, int) or n_boot < 1:
+        raise ValueError("Provided n_boot: %s must be a positive int." % n_boot)
+
+    sizes = [min(chunk_size, n_boot - start) for start in range(0, n_boot, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if n_jobs > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            means = list(executor.map(_bootstrap_chunk, [values] * len(sizes), sizes, seeds))
+    else:
+        means = [_bootstrap_chunk(values, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+
+    means = np.concatenate(means)
+    alpha = (100 - ci) / 2
+    return np.nanpercentile(means, alpha, axis = 0), np.nanpercentile(means, 100 - alpha, axis = 0)
+
+def _permutation_t(values, permutations, paired):
+    """
+    Private function: computes t values for every row of a permutation matrix at once. For paired tests, permutations are sign flips (+1/-1) of the rows of values (differences). Otherwise, permutations are booleans marking which rows of values belong to the first group and a Welch t is computed.
+    """
+    permutations = np.asarray(permutations, dtype = float)
+    if paired:
+        n = values.shape[0]
+        mean = permutations @ values / n
+        var = ((values ** 2).sum(axis = 0) - n * mean ** 2) / (n - 1)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return mean / np.sqrt(var / n)
+
+    n1 = permutations.sum(axis = 1)[:,None]
+    n2 = values.shape[0] - n1
+    sum1, sumsq1 = permutations @ values, permutations @ values ** 2
+    sum2, sumsq2 = values.sum(axis = 0) - sum1, (values ** 2).sum(axis = 0) - sumsq1
+    mean1, mean2 = sum1 / n1, sum2 / n2
+    var1, var2 = (sumsq1 - n1 * mean1 ** 2) / (n1 - 1), (sumsq2 - n2 * mean2 ** 2) / (n2 - 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return (mean1 - mean2) / np.sqrt(var1 / n1 + var2 / n2)
+
+def _permutation_chunk(values, n_permutations, seed, t_obs, paired, n_first):
+    """
+    Private function: generates n_permutations sign flips or relabelings as a matrix and returns how often each |t| reaches |t_obs| and the max |t| of every permutation.
+    """
+    rng = np.random.default_rng(seed)
+    n = values.shape[0]
+    if paired:
+        permutations = rng.choice([-1.0, 1.0], size = (n_permutations, n))
+    else:
+        permutations = np.argsort(rng.random((n_permutations, n)), axis = 1) < n_first
+    t = np.abs(_permutation_t(values, permutations, paired))
+    return (t >= np.abs(t_obs)).sum(axis = 0), np.nanmax(t, axis = 1)
+
+def _error_bars(df, error = 'sem', n_boot = 10000, ci = 95, seed = None, n_jobs = 1):
+    """
+    Private function: computes the mean and the lower and upper error bar lengths of every cell across the units in the first index level of df (PPT or Item).
+    """
+    matrix = df.unstack(list(range(1, df.index.nlevels)))
+    y = matrix.mean()
+    if error == 'sem':
+        yerr = matrix.sem()
+        return y, yerr, yerr
+    elif error == 'ci':
+        lower, upper = bootstrap_ci(matrix.to_numpy(), n_boot = n_boot, ci = ci, seed = seed, n_jobs = n_jobs)
+        return y, y - lower, upper - y
+    else:
+        raise ValueError("Provided error: %s is invalid. Please provide 'sem' or 'ci'" % error)
+
+def _residual_RTs(df, x, y, by = 'PPT', robust = False, n_iter = 20, c = 1.345):
+    """
+    Private function: fits y = a + b * x by least squares for every group in one batched computation from grouped sums and returns the residuals. Rows with a missing x or y get a NaN residual.
+
+    Optional arguments:
+    by (str) -- column defining the groups that get their own fit. Default = 'PPT'
+    robust (bool) -- if True, refits with Huber weights (tuning constant c, scale from the median absolute residual of each group) for up to n_iter iterations. Default = False
+    """
+    codes, uniques = pd.factorize(df[by])
+    X, Y = df[x].to_numpy(dtype = float), df[y].to_numpy(dtype = float)
+    valid = ~np.isnan(X) & ~np.isnan(Y) & (codes >= 0)
+    codes, X, Y = np.where(valid, codes, 0), np.where(valid, X, 0), np.where(valid, Y, 0)
+    w = valid.astype(float)
+
+    def _fit(w):
+        sums = [np.bincount(codes, weights = v, minlength = len(uniques)) for v in [w, w*X, w*Y, w*X*X, w*X*Y]]
+        sw, sx, sy, sxx, sxy = sums
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            denominator = sw*sxx - sx*sx
+            slope = np.where(denominator > 0, (sw*sxy - sx*sy) / np.where(denominator > 0, denominator, 1), 0)
+            intercept = (sy - slope*sx) / sw
+        return Y - (intercept[codes] + slope[codes] * X)
+
+    residuals = _fit(w)
+    if robust:
+        for iteration in range(n_iter):
+            mad = pd.Series(np.abs(residuals[valid])).groupby(codes[valid]).median().reindex(range(len(uniques))).to_numpy()
+            scale = np.maximum(1.4826 * mad, 1e-8)[codes]
+            u = np.abs(residuals) / (c * scale)
+            new_w = np.where(valid, np.minimum(1, 1 / np.maximum(u, 1e-12)), 0)
+            if np.allclose(new_w, w, atol = 1e-6):
+                break
+            w = new_w
+            residuals = _fit(w)
+
+    return pd.Series(np.where(valid, residuals, np.nan), index = df.index)
+
+@profiling.instrument
+def get_RTdata_chunked(filename, output_filename, chunksize = 100000, critical_conditions = [], summarize = True, remove_extremes = [200,5000], identify_missing_data = True, filter_outliers = 2, sep = '\t', **kwargs):
+    """
+    Streaming version of BEH.Project.get_RTdata for merged E-Prime outputs that do not fit in memory. The file is read in chunks: a first pass accumulates counts, means and variances for every PPT X Condition X WordPos and Item X Condition X WordPos group, and a second pass applies the same filtering as get_RTdata and writes the filtered data to output_filename. If ppts are dropped for missing data, an extra pass recomputes the by item statistics without them.
+
+    Required Arguments:
+    filename (str) -- file name of the merged output (.txt) written by io.import_from_eprime
+    output_filename (str) -- file name of the filtered output. It has the same columns as Project.RTdata and can be loaded with pd.read_csv(output_filename, sep = sep)
+
+    Optional Arguments:
+    chunksize (int) -- number of records read at a time. Default = 100000
+    critical_conditions, summarize, remove_extremes, identify_missing_data, filter_outliers -- see help(BEH.Project.get_RTdata)
+    sep (str) -- delimiter of both files. Default = '\t'
+    **kwargs (str) -- keyword arguments are used to rename columns as in BEH.Project. i.e. PPT = 'Subject' means the column 'Subject' in filename will be used as 'PPT'.
+
+    Note:
+    required_columns = ['PPT', 'WordPos', 'Condition', 'Item', 'RT']
+    """
+    required_columns = ['PPT', 'WordPos', 'Condition', 'Item', 'RT']
+    columns = {kwargs.get(column, column):column for column in required_columns}
+
+    if not os.path.isfile(filename):
+        raise ValueError('Provided file "%s" cannot be found' % filename)
+
+    if not isinstance(critical_conditions, list):
+        raise TypeError("Provided critical_conditions object must be of type list.")
+    if any(not isinstance(condition, str) for condition in critical_conditions):
+        raise TypeError("All conditions in provided critical conditions must be of type string.")
+
+    if remove_extremes:
+        if not isinstance(remove_extremes, list) or len(remove_extremes) != 2:
+            raise TypeError("Provide a list [lower, upper] or None.  Provided remove_extremes of type: %s is invalid." % type(remove_extremes))
+        low, high = remove_extremes
+        if low >= high:
+            raise ValueError("Ensure the provided low value (%s) is lower than the provided high value (%s)." % (low, high))
+    else:
+        logger.warning("remove_extremes evaluated as False. Not removing any extreme values.")
+
+    if isinstance(filter_outliers, int) or isinstance(filter_outliers, float):
+        if filter_outliers < 0:
+            raise ValueError("SD provided to filter_outliers must be a positive int or float")
+        elif filter_outliers < 1 or filter_outliers > 3:
+            logger.warning("NOTE: The provided SD: %s seems strange. Ensure you are providing the number of SD within which you wish to retain data." % filter_outliers)
+    elif filter_outliers != None:
+        raise TypeError("Provide an int or float specifying the standard deviations used for cutoff of outliers or use None to skip this step. Provided filter_outliers of type: %s is invalid." % type(filter_outliers))
+
+    by_ppt, by_item = ['PPT','Condition','WordPos'], ['Item','Condition','WordPos']
+
+    missing = [column for column in columns if column not in pd.read_csv(filename, sep = sep, nrows = 0).columns]
+    if missing:
+        raise ValueError('The following columns are missing in %s: %s' % (filename, ", ".join(missing)))
+
+    def _chunks(exclude_ppts = [], exclude_conditions = []):
+        for df in pd.read_csv(filename, sep = sep, usecols = list(columns), chunksize = chunksize):
+            df = df.rename(columns = columns)
+            df['RT'] = pd.to_numeric(df['RT'], errors = 'coerce')
+            df = df[df['RT'].notnull()].loc[:,required_columns]
+            if exclude_ppts or exclude_conditions:
+                df = df[~df['PPT'].isin(exclude_ppts) & ~df['Condition'].isin(exclude_conditions)]
+            if remove_extremes:
+                df['RTremove'], df['RTremoveVal'] = _extreme_values(df['RT'], low, high)
+            else:
+                df['RTremove'], df['RTremoveVal'] = 'Ok', df['RT']
+            yield df
+
+    #first pass: group statistics
+    ppt_stats, item_stats = None, None
+    total, removed, ppts, conditions = 0, pd.Series(dtype = int), set(), set()
+    with profiling.stage('BEH.get_RTdata_chunked.statistics') as record:
+        for df in _chunks():
+            total += len(df.index)
+            removed = removed.add(df['RTremove'].value_counts(), fill_value = 0)
+            ppts.update(df['PPT'].unique())
+            conditions.update(df['Condition'].unique())
+            ppt_stats = _merge_group_stats(ppt_stats, _group_stats(df, by_ppt, 'RTremoveVal'))
+            item_stats = _merge_group_stats(item_stats, _group_stats(df, by_item, 'RTremoveVal'))
+        record['rows'] = total
+
+    if ppt_stats is None:
+        raise ValueError("No RT data could be loaded from %s" % filename)
+
+    if any(condition not in conditions for condition in critical_conditions):
+        raise ValueError("All conditions provided in critical_conditions must be in supplied file")
+
+    if summarize:
+        logger.info("There are %s ppts in this file." % len(ppts))
+        logger.info("The following conditions are in this file: %s" % ", ".join(str(condition) for condition in conditions))
+        logger.info("There are %s records." % total)
+        if remove_extremes:
+            _summarize_labels(removed, total, "removal of extreme values", "%s ms" % low, "%s ms" % high)
+
+    inelig_ppts, missing_by_ppt_filler = [], []
+    if identify_missing_data:
+        missing_by_ppt = ppt_stats.loc[ppt_stats['n'] == 0, 'mean'].rename('RTremoveVal')
+        inelig_ppts, missing_by_ppt_filler = _missing_data_exclusions(missing_by_ppt, critical_conditions)
+        if inelig_ppts or missing_by_ppt_filler:
+            #by item statistics have to be recomputed without the dropped records
+            logger.info("Recomputing by item statistics without the removed data...")
+            item_stats = None
+            with profiling.stage('BEH.get_RTdata_chunked.item_statistics'):
+                for df in _chunks(inelig_ppts, missing_by_ppt_filler):
+                    item_stats = _merge_group_stats(item_stats, _group_stats(df, by_item, 'RTremoveVal'))
+
+        missing_by_item = item_stats.loc[item_stats['n'] == 0, 'mean']
+        if len(missing_by_item) != 0:
+            logger.warning('Missing data if filtered by item:\n%s' % missing_by_item)
+            logger.warning("This should never happen - not sure what to do :(")
+
+    #second pass: filter and write
+    written = {'ppt':pd.Series(dtype = int), 'item':pd.Series(dtype = int)}
+    retained, header = 0, True
+    with profiling.stage('BEH.get_RTdata_chunked.filter_and_write') as record:
+        for df in _chunks(inelig_ppts, missing_by_ppt_filler):
+            if filter_outliers != None:
+                for name, keys, stats in [('ppt', by_ppt, ppt_stats), ('item', by_item, item_stats)]:
+                    labels, trimmed = _trim_outliers(df, keys, 'RTremoveVal', _outlier_bounds(stats, filter_outliers))
+                    df['RTfiltered_by_%s_labels' % name], df['RTfiltered_by_%s_values' % name] = labels, trimmed
+                    written[name] = written[name].add(labels.value_counts(), fill_value = 0)
+            retained += len(df.index)
+            df.to_csv(output_filename, sep = sep, index = False, mode = 'w' if header else 'a', header = header)
+            header = False
+        record['rows'] = retained
+
+    if summarize and filter_outliers != None:
+        _summarize_labels(written['ppt'], retained, "filtering by ppt", "-%s SD" % filter_outliers, "+%s SD" % filter_outliers)
+        _summarize_labels(written['item'], retained, "filtering by items", "-%s SD" % filter_outliers, "+%s SD" % filter_outliers)
+
+    logger.info("Successfully filtered RT data. Find the filtered data in %s" % output_filename)
+
 class plot_config:
     """
     A class for storing formatting details for reading time plots.
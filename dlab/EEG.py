@@ -1,9 +1,12 @@
 import os
 import re
 import pickle
+import warnings
+import logging
 from math import ceil
 import numpy as np
 import pandas as pd
+from scipy import sparse
 # matplotlib import statements - this is the plotting library
 import matplotlib as mpl
 import matplotlib.pyplot as plt  # plotting
@@ -11,6 +14,84 @@ import matplotlib.tri as tri  # tri interpolation for the topomaps
 import matplotlib.patches as patches  # used for drawing mask and the ears
 import matplotlib.lines as lines  # used for drawing ears
 
+from dlab import profiling
+
+logger = logging.getLogger(__name__)
+
+#spatial indexes of the montages used in this session, keyed by coordinates and neighbour distance
+_spatial_indexes = {}
+
+class spatial_index:
+    """
+    Spatial index of a montage: distances between electrodes, the neighbour graph and sparse weight matrices. Use settings.spatial_index to get the (cached) index of a montage.
+
+    Public Attributes:
+    electrodes -- electrodes of the montage in the order of the coordinates file (list of str)
+    distances -- distances between electrodes, NaN for electrodes without a position (pandas df: electrodes x electrodes)
+    distance -- electrodes closer than distance are neighbours (float)
+    adjacency -- the neighbour graph (scipy.sparse.csr_matrix of bool: electrodes x electrodes)
+    neighbours -- the neighbours of every electrode (dict of str: list of str)
+
+    Public Methods:
+    roi_weights -- returns the sparse weight matrix (electrodes x ROIs) that averages electrodes into ROIs
+    interpolation_weights -- returns the sparse matrix (electrodes x electrodes) that replaces bad electrodes by their neighbours
+    """
+    def __init__(self, coordinates, distance = None):
+        self.electrodes = list(coordinates.index)
+        positions = coordinates.to_numpy(dtype = float)
+        distances = np.sqrt(((positions[:,None,:] - positions[None,:,:]) ** 2).sum(axis = 2))
+        self.distances = pd.DataFrame(distances.copy(), index = coordinates.index, columns = coordinates.index)
+        np.fill_diagonal(distances, np.inf)
+        distances[np.isnan(distances)] = np.inf
+        if distance is None:
+            #1.5 times the median distance between an electrode and its nearest electrode
+            nearest = distances.min(axis = 1)
+            distance = 1.5 * np.median(nearest[np.isfinite(nearest)])
+        self.distance = distance
+        self.adjacency = sparse.csr_matrix(distances < distance)
+        self.neighbours = {electrode:[self.electrodes[j] for j in self.adjacency[i].indices] for i, electrode in enumerate(self.electrodes)}
+        self._roi_weights = {}
+
+    def roi_weights(self, rois):
+        """
+        Returns the sparse weight matrix (electrodes x ROIs, each column sums to 1) so that data (rows x electrodes) @ weights averages the electrodes of every ROI. Matrices are cached per ROI definition.
+
+        Required Arguments:
+        rois (dict of str: list of str) -- names of the ROIs and their electrodes
+        """
+        key = tuple((name, tuple(electrodes)) for name, electrodes in rois.items())
+        if key not in self._roi_weights:
+            rows, cols, weights = [], [], []
+            for j, (name, electrodes) in enumerate(rois.items()):
+                if not electrodes or any(electrode not in self.electrodes for electrode in electrodes):
+                    raise ValueError("ROI %s contains an electrode that is not in the montage: %s" % (name, electrodes))
+                rows += [self.electrodes.index(electrode) for electrode in electrodes]
+                cols += [j] * len(electrodes)
+                weights += [1 / len(electrodes)] * len(electrodes)
+            self._roi_weights[key] = sparse.csr_matrix((weights, (rows, cols)), shape = (len(self.electrodes), len(rois)))
+        return self._roi_weights[key]
+
+    def interpolation_weights(self, bads):
+        """
+        Returns the sparse matrix (electrodes x electrodes) so that data (rows x electrodes) @ weights replaces every bad electrode by the inverse distance weighted average of its neighbours that are not bad, and leaves the other electrodes unchanged.
+
+        Required Arguments:
+        bads (list of str) -- the bad electrodes
+        """
+        if any(bad not in self.electrodes for bad in bads):
+            raise ValueError("One of the provided bad electrodes is not in the montage.")
+        weights = sparse.lil_matrix((len(self.electrodes), len(self.electrodes)))
+        for i, electrode in enumerate(self.electrodes):
+            if electrode not in bads:
+                weights[i, i] = 1
+                continue
+            good = [self.electrodes.index(neighbour) for neighbour in self.neighbours[electrode] if neighbour not in bads]
+            if not good:
+                raise ValueError("Electrode %s has no neighbours that are not bad and cannot be interpolated." % electrode)
+            inverse = 1 / self.distances.iloc[i, good].to_numpy()
+            weights[good, i] = inverse / inverse.sum()
+        return weights.tocsr()
+
 class settings:
     electrode_layouts = {"midlines":[['Fz'],
                                      ['FCz'],
@@ -35,6 +116,14 @@ class settings:
                         }
     
     time_windows = {"default":[(100,300),(300,500),(500,700),(700,900),(900,1100)]}
+
+    rois = {"frontal_medial":['F3','FC1','Fz','FC2','F4'],
+            "central_medial":['C3','C1','Cz','C2','C4'],
+            "parietal_medial":['P3','PO3','Pz','PO4','P4'],
+            "left_anterior":['FT7','F5','F7','T7'],
+            "right_anterior":['F6','FT8','T8','F8'],
+            "left_posterior":['CP5','P7','PO7','O1'],
+            "right_posterior":['P8','CP6','O2','PO8']}
     
     def __init__(self, 
                  sampling_interval = 1.953125, 
@@ -43,14 +132,25 @@ class settings:
                  default_colours = ['black','red','blue','purple'],
                  default_linestyles = ['-','-','-','-'],
                  F_size = 44,
-                 F_weight = 'bold'
+                 F_weight = 'bold',
+                 dtype = 'float32',
+                 accum_dtype = 'float64'
                 ):            
+        """
+        Settings of an EEG.Project.
+
+        Optional arguments (data types):
+        dtype (str) -- data type of the samples in Project.data and Project.grands. EMSE bins are float32, which keeps ~7 significant digits (errors below 1e-5 uV at the usual microvolt scale), so the default halves memory compared to float64 without a loss of precision. default: 'float32'
+        accum_dtype (str) -- data type used to accumulate reductions (averages of conditions, grands and mean amplitudes) so that summing many float32 samples does not lose precision. Mean amplitudes are stored in this type. Results differ from a float64 pipeline by less than 1e-6 (relative). default: 'float64'
+        """
         self.sampling_interval = sampling_interval
         self.epoch = epoch
         self.default_colours = default_colours
         self.default_linestyles = default_linestyles
         self.F_size = F_size
         self.F_weight = F_weight
+        self.dtype = dtype
+        self.accum_dtype = accum_dtype
         
         if electrodes_path == None:
             self._electrodes_path = os.path.join(
@@ -63,6 +163,8 @@ class settings:
         
     def import_electrodes(self, fpath):
         df = pd.read_csv(fpath, index_col=False, names = ["electrodes","_x","_y","_z"])
+        #3D positions (NaN for electrodes off the scalp, e.g. EOG), used for electrode neighbours
+        self.coordinates = pd.DataFrame(df[["_x","_y","_z"]].to_numpy(), index = pd.Index(df["electrodes"], name = "electrode"), columns = ["x","y","z"])
         f = (1/(df['_z']+1))
         self.x = np.array(df["_x"]*f)
         self.y = np.array(df["_y"]*f)
@@ -71,12 +173,61 @@ class settings:
         self.X, self.Y = np.meshgrid(np.linspace(self.x.min(), self.x.max(), 100),
                                      np.linspace(self.y.min(), self.y.max(), 100))
         self.electrodes = list(df['electrodes'])
+
+    def spatial_index(self, distance = None):
+        """
+        Returns the spatial_index (distances, neighbour graph and weight matrices) of the montage. It is built once per montage (coordinates) and neighbour distance, and cached for the session.
+
+        Optional arguments:
+        distance (float or None) -- electrodes closer than distance are neighbours (in the units of coordinates.xyz). default: None (1.5 times the median distance between an electrode and its nearest electrode)
+        """
+        key = (tuple(self.coordinates.index), self.coordinates.to_numpy().tobytes(), distance)
+        if key not in _spatial_indexes:
+            _spatial_indexes[key] = spatial_index(self.coordinates, distance)
+        return _spatial_indexes[key]
     
     @property
     def t(self):
-        return np.arange(self.epoch['start'],
-                         self.epoch['end'],
-                         self.sampling_interval)
+        """
+        The time points of an epoch in ms (read-only numpy array). It is built once and rebuilt only when sampling_interval or epoch changes.
+        """
+        key = (self.sampling_interval, self.epoch['start'], self.epoch['end'])
+        cache = getattr(self, '_t', None)
+        if cache is None or cache[0] != key:
+            t = np.arange(self.epoch['start'],
+                          self.epoch['end'],
+                          self.sampling_interval)
+            t.flags.writeable = False
+            self._t = cache = (key, t)
+        return cache[1]
+
+    def _positions(self, times, method):
+        """
+        Returns the sample positions of times (any shape) in t without checking the range. Times within 1e-6 samples of a time point are matched to it exactly.
+        """
+        x = (np.asarray(times, dtype = float) - self.epoch['start']) / self.sampling_interval
+        exact = np.rint(x)
+        x = np.where(np.abs(x - exact) < 1e-6, exact, x)
+        return {'nearest':np.rint, 'floor':np.floor, 'ceil':np.ceil}[method](x).astype(int)
+
+    def time_index(self, times, method = 'nearest'):
+        """
+        Returns the sample index (position in t) of one or many times, computed arithmetically from epoch['start'] and sampling_interval instead of searching t.
+
+        Required arguments:
+        times (int, float, list or numpy array) -- time(s) in ms
+
+        Optional arguments:
+        method (str) -- 'nearest' (the closest time point), 'floor' (the last time point at or before the time) or 'ceil' (the first time point at or after the time). default: 'nearest'
+
+        Returns an int for a single time, otherwise a numpy array of int.
+        """
+        if method not in ['nearest', 'floor', 'ceil']:
+            raise ValueError("Provided method: %s is invalid. Please provide 'nearest', 'floor' or 'ceil'." % method)
+        positions = self._positions(times, method)
+        if (positions < 0).any() or (positions >= len(self.t)).any():
+            raise ValueError("Provided time(s): %s are outside of the epoch (%sms to %sms)." % (times, self.t[0], self.t[-1]))
+        return int(positions) if positions.ndim == 0 else positions
     
 class Project:
     """
@@ -87,10 +238,18 @@ class Project:
     load -- load EMSE bin files into the Project by providing the EMSE > Original path
     load_pickle -- load a pickle file to re-initialize a Project object
     save_pickle -- save a pickle file for later re-initializing
+    baseline_correct -- subtract the mean of a pre-stimulus interval from every epoch
+    rereference -- re-reference the data to the average, linked mastoids or any electrodes
+    interpolate_bads -- replace bad electrodes by the weighted average of their neighbours
+    compute_rois -- average the electrodes of ROIs (settings.rois) for any data
+    compute_gfp -- compute the global field power of data or grands
+    compute_dissimilarity -- compute the global dissimilarity and topographic correlation between two conditions
     compute_diffs -- compute differences between conditions across ppts
     compute_avgs -- compute averages between conditions across ppts
     compute_grands -- compute grand averages and save to the self.grands dict
     compute_mean_amps -- compute mean amplitudes and save to the self.mean_amps dict
+    scan_mean_amps -- compute mean amplitudes of sliding windows across the epoch and save to the self.mean_amps dict
+    compute_jackknife_latencies -- compute jackknifed latencies from leave-one-out grands and save to the self.mean_amps dict
     plot_EEG -- plot ERP waveforms for a single electrode or a row/column/grid of electrodes and save as pdf
     plot_electrodes -- plot ERP waveforms for a single electrode (use for custom plotting, does not save)
     plot_topomap -- plot topographic maps
@@ -136,6 +295,7 @@ class Project:
         if "Electrode" in sections:
             out.append(box("Electrode"))
             out.append("There are %s electrodes loaded: %s\n" % (len(self.settings.electrodes), ", ".join(self.settings.electrodes)))
+            out.append("There are %s ROIs: %s\n" % (len(self.settings.rois), ", ".join(self.settings.rois)))
             out.append("There are %s electrode layouts:" % len(self.settings.electrode_layouts))
             for electrodes in self.settings.electrode_layouts:
                 out.append("\tLayout name: %s\n%s" % (electrodes, "".join(["\t>\t" + str(i) + "\n" for i in self.settings.electrode_layouts[electrodes]])))
@@ -189,14 +349,18 @@ class Project:
         self.data = pd.DataFrame()
         self.grands = {}
         self.mean_amps = {}
+        self.jackknives = {}
         if isinstance(my_settings, settings):
             self.settings = my_settings
         else:
             raise TypeError("Please provide a valid settings object")
 
+    @profiling.instrument
     def load(self, path):
         """
         The load function allows all bin files in an EMSE workspace to be loaded into self.data. Note that this function uses the loaded settings.t and settings.electrodes to label the imported data.  The file name is used to define the PPT # and the Condition ID. For this to work, the ppt ID must follow the last underscore in the project name.
+
+        self.data is indexed by PPT, Condition and t with one column per electrode (in uV, of type settings.dtype).
         
         Required arguments:
         path (str) -- provide a path to where the bins are saved as a string. Ex: r'FULLPATHHERE'
@@ -207,32 +371,303 @@ class Project:
             CID = fname[:-1 - len(SID)]
             return SID[:-4], CID
         
-        df = pd.DataFrame()
+        t = self.settings.t
+        arrays, ppts, conditions = [], [], []
         for root, dirs, files in os.walk(path):
             for file in files:
                 if file.endswith(".bin"):
                     fpath = os.path.join(root, file)
-                    with open(fpath, 'rb') as fid:
+                    with open(fpath, 'rb') as fid, profiling.stage('EEG.Project.load.file') as record:
                         SID, CID = split(file)
                         try:
-                            _df = pd.DataFrame(np.fromfile(fid, np.float32).reshape((-1, len(self.settings.electrodes))), columns = self.settings.electrodes)
-                            _df *= 1000000
-                            _df['t'],  _df['Condition'] = self.settings.t, CID
-                            _df['PPT'] = int(re.findall(r'\d+', SID)[0])
-                            df = df.append(_df.set_index(['PPT','Condition']))
+                            array = np.fromfile(fid, np.float32).reshape((len(t), len(self.settings.electrodes)))
+                            ppt = int(re.findall(r'\d+', SID)[0])
+                            #scale to uV without leaving float32
+                            arrays.append(np.multiply(array, 1000000, dtype = self.settings.dtype))
+                            ppts.append(ppt)
+                            conditions.append(CID)
+                            record['rows'] = len(t)
                         except:
-                            print('Failed to load %s for ppt %s (file name = %s)' % (CID, SID, file))
-        self.data = df
+                            logger.warning('Failed to load %s for ppt %s (file name = %s)' % (CID, SID, file))
+        with profiling.stage('EEG.Project.load.concat'):
+            if arrays:
+                #concatenate in sorted order so that the data does not have to be sorted (copied) again
+                order = sorted(range(len(arrays)), key = lambda i: (ppts[i], conditions[i]))
+                index = pd.MultiIndex.from_arrays([np.repeat([ppts[i] for i in order], len(t)), np.repeat([conditions[i] for i in order], len(t)), np.tile(t, len(arrays))], names = ['PPT','Condition','t'])
+                self.data = pd.DataFrame(np.concatenate([arrays[i] for i in order]), index = index, columns = self.settings.electrodes, copy = False)
+            else:
+                self.data = pd.DataFrame()
+        profiling.set_rows(len(self.data))
         # double check to make sure everything is right!
-        print('\n%s condition(s) for %s ppt(s) with %s time slices were loaded' % (len(self.conditions), self.N, len(self.settings.t)))
+        logger.info('%s condition(s) for %s ppt(s) with %s time slices were loaded' % (len(self.conditions), self.N, len(self.settings.t)))
         expected_records = len(self.conditions) * self.N * len(self.settings.t)
-        print('So we expect to see %s records.' % (expected_records))
-        print('%s records were actually loaded.' % len(self.data))
+        logger.info('So we expect to see %s records.' % (expected_records))
+        logger.info('%s records were actually loaded.' % len(self.data))
         if expected_records == len(self.data):
-            print('Everything looks in order!\n')
+            logger.info('Everything looks in order!')
         else:
-            print("Something doesn't look right - double check to make sure.\n")
-        
+            logger.warning("Something doesn't look right - double check to make sure.")
+
+    def _as_array(self, data = None):
+        """
+        Returns the data as a 4 dimensional numpy array (ppt x condition x t x electrode) with the labels of each axis: (array, ppts, conditions, t, complete). When every ppt has every condition (complete = True), the array is a view of the data. Otherwise, it is a copy where missing ppts/conditions are NaN.
+
+        Optional arguments:
+        data (pandas df) -- data indexed by PPT, Condition and t. default: None (self.data)
+        """
+        if data is None:
+            data = self.data
+        index = data.index.remove_unused_levels()
+        ppts, conditions, t = index.levels
+        full = pd.MultiIndex.from_product([ppts, conditions, t], names = ['PPT','Condition','t'])
+        complete = index.equals(full)
+        if not complete:
+            data = data.reindex(full)
+        return data.to_numpy().reshape(len(ppts), len(conditions), len(t), -1), ppts, conditions, t, complete
+
+    def _mean(self, array, axis, complete = True):
+        """
+        Averages array along axis, accumulating in settings.accum_dtype. If the data is not complete, missing values (NaN) are ignored.
+        """
+        if complete:
+            return array.mean(axis = axis, dtype = self.settings.accum_dtype)
+        with warnings.catch_warnings():
+            #ppts missing a condition average to NaN
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.nanmean(array.astype(self.settings.accum_dtype), axis = axis)
+
+    def _from_array(self, array, index_names, levels, columns = None):
+        """
+        Returns a pandas df of settings.dtype from an array whose last axis is electrodes and whose other axes are labelled by levels (a list of pandas.Index named by index_names).
+        """
+        index = pd.MultiIndex.from_product(levels, names = index_names)
+        return pd.DataFrame(array.reshape(len(index), -1).astype(self.settings.dtype, copy = False), index = index, columns = columns if columns is not None else self.data.columns)
+
+    def _epochs(self):
+        """
+        Returns a writable copy of the data as a 3 dimensional array (epoch x t x electrode) of settings.dtype, where an epoch is a ppt x condition of self.data (which always holds every t of an epoch, in order). The values of self.data itself are never written in place: with pandas copy-on-write they may be shared with frames derived from it.
+        """
+        n_t = len(self.data.index.levels[2])
+        if len(self.data) == 0 or len(self.data) % n_t:
+            raise ValueError("Ensure that data has been loaded and every epoch has all %s time points." % n_t)
+        return self.data.to_numpy(dtype = self.settings.dtype, copy = True).reshape(-1, n_t, len(self.data.columns))
+
+    def _set_epochs(self, epochs):
+        """
+        Replaces the values of self.data with epochs (see _epochs), without copying them.
+        """
+        self.data = pd.DataFrame(epochs.reshape(len(self.data), -1), index = self.data.index, columns = self.data.columns, copy = False)
+
+    @profiling.instrument
+    def baseline_correct(self, interval = [-200, 0]):
+        """
+        Subtracts the mean of a (pre-stimulus) interval from every ppt x condition x electrode epoch of self.data. The means are accumulated in settings.accum_dtype and subtracted in place from a single copy of the data in settings.dtype, so the peak memory is about twice the size of self.data.
+
+        Optional arguments:
+        interval (list) -- [lower, upper] in ms (inclusive) of the baseline. default: [-200, 0]
+        """
+        if not isinstance(interval, (list, tuple)) or len(interval) != 2 or interval[0] >= interval[1]:
+            raise ValueError("Provided interval: %s should be provided as [lower, upper]" % (interval,))
+        t = self.data.index.levels[2]
+        start, stop = self._time_slice(t, interval[0], interval[1], include_lower = True)
+        if start >= stop:
+            raise ValueError("Provided interval: %s contains no time points. Epochs are %sms to %sms" % (interval, t.min(), t.max()))
+
+        epochs = self._epochs()
+        epochs -= epochs[:, start:stop].mean(axis = 1, dtype = self.settings.accum_dtype, keepdims = True).astype(self.settings.dtype)
+        self._set_epochs(epochs)
+        profiling.set_rows(len(self.data))
+        logger.info("Baseline corrected %s epochs with the mean of %sms to %sms (%s time points)." % (len(epochs), interval[0], interval[1], stop - start))
+        logger.info("Note that you will need to update any mean_amps or grands that have already computed.")
+
+    @profiling.instrument
+    def rereference(self, reference = 'average'):
+        """
+        Re-references every sample of self.data to the mean of a set of reference electrodes. The reference is accumulated in settings.accum_dtype one electrode at a time and subtracted in place from a single copy of the data in settings.dtype, so the peak memory is about twice the size of self.data.
+
+        Optional arguments:
+        reference (str or list of str) -- 'average' (the mean of all electrodes with a position in the montage, i.e. without mastoids and EOG channels), 'mastoids' (linked mastoids: the mean of M1 and M2) or a list of electrodes. default: 'average'
+        """
+        if isinstance(reference, str):
+            if reference == 'average':
+                reference = self._scalp_electrodes(self.data.columns)
+            elif reference == 'mastoids':
+                reference = ['M1', 'M2']
+            elif reference in self.data.columns:
+                reference = [reference]
+            else:
+                raise ValueError("Provided reference: %s is invalid. Please provide 'average', 'mastoids', an electrode or a list of electrodes." % reference)
+        if not isinstance(reference, list) or not reference:
+            raise TypeError("Provided reference is of invalid type: %s. Provide 'average', 'mastoids' or a list of electrodes." % type(reference))
+        if any(electrode not in self.data.columns for electrode in reference):
+            raise ValueError("One of the provided reference electrodes is not in loaded data.")
+
+        epochs = self._epochs()
+        mean = np.zeros(epochs.shape[:2] + (1,), dtype = self.settings.accum_dtype)
+        for i in self.data.columns.get_indexer(reference):
+            mean += epochs[:, :, i:i + 1]
+        epochs -= (mean / len(reference)).astype(self.settings.dtype)
+        self._set_epochs(epochs)
+        profiling.set_rows(len(self.data))
+        logger.info("Re-referenced %s epochs to the mean of: %s" % (len(epochs), ", ".join(reference)))
+        logger.info("Note that you will need to update any mean_amps or grands that have already computed.")
+
+    @profiling.instrument
+    def interpolate_bads(self, bads, distance = None):
+        """
+        Replaces bad electrodes in self.data by the inverse distance weighted average of their neighbours that are not bad (see settings.spatial_index). The data of a ppt is interpolated with one matrix multiply.
+
+        Required arguments:
+        bads (list of str or dict) -- a list of bad electrodes for all ppts OR a dict of ppt: list of bad electrodes
+
+        Optional arguments:
+        distance (float or None) -- neighbour distance of the electrodes. See settings.spatial_index. default: None
+        """
+        if isinstance(bads, list):
+            bads = {None:bads}
+        elif not isinstance(bads, dict):
+            raise TypeError("Provided bads is of invalid type: %s. Provide a list of electrodes or a dict of ppt: list of electrodes." % type(bads))
+        if any(ppt is not None and ppt not in self.ppts for ppt in bads):
+            raise ValueError("Ensure all provided ppts are in self.data")
+        if list(self.data.columns) != self.settings.electrodes:
+            raise ValueError("Ensure the columns of self.data are the electrodes of the montage.")
+
+        index = self.settings.spatial_index(distance)
+        values = self.data.to_numpy(dtype = self.settings.accum_dtype, copy = True)
+        ppts = self.data.index.get_level_values('PPT')
+        for ppt, electrodes in bads.items():
+            if not electrodes:
+                continue
+            rows = slice(None) if ppt is None else ppts == ppt
+            values[rows] = values[rows] @ index.interpolation_weights(electrodes)
+            logger.info("Interpolated %s for %s." % (", ".join(electrodes), "all ppts" if ppt is None else "ppt %s" % ppt))
+        self.data = pd.DataFrame(values.astype(self.settings.dtype), index = self.data.index, columns = self.data.columns, copy = False)
+        profiling.set_rows(len(self.data))
+        logger.info("Note that you will need to update any mean_amps or grands that have already computed.")
+
+    def _time_slice(self, t, lower, upper, include_lower = False):
+        """
+        Returns the (start, stop) positions in t of the time points between lower and upper (upper included, lower only if include_lower), clipped to t. lower and upper may be numpy arrays. On the time axis of the settings (settings.t), positions are computed with settings.time_index arithmetic, otherwise t is searched.
+        """
+        n = len(t)
+        if n == len(self.settings.t) and n and t[0] == self.settings.t[0] and t[-1] == self.settings.t[-1]:
+            start = self.settings._positions(lower, 'ceil') if include_lower else self.settings._positions(lower, 'floor') + 1
+            stop = self.settings._positions(upper, 'floor') + 1
+        else:
+            start = np.searchsorted(t, lower, side = 'left' if include_lower else 'right')
+            stop = np.searchsorted(t, upper, side = 'right')
+        return np.clip(start, 0, n), np.clip(stop, 0, n)
+
+    def _scalp_electrodes(self, columns):
+        """
+        Returns the electrodes of columns that have a position in the montage (i.e. without mastoids and EOG channels).
+        """
+        coordinates = self.settings.coordinates
+        return [electrode for electrode in columns if electrode in coordinates.index and not coordinates.loc[electrode].isna().any()]
+
+    def _source(self, source):
+        """
+        Returns the dataframe of source: None (self.data), a key of self.grands or a dataframe.
+        """
+        if source is None:
+            return self.data
+        if isinstance(source, str):
+            if source not in self.grands:
+                raise ValueError("Provided source: %s is not a key of self.grands." % source)
+            return self.grands[source]
+        if isinstance(source, pd.DataFrame):
+            return source
+        raise TypeError("Provided source is of invalid type: %s. Provide None, a key of self.grands or a pandas df." % type(source))
+
+    def _spatial_values(self, source, electrodes):
+        """
+        Returns the values of the electrodes of source (rows x electrodes, settings.accum_dtype) minus their mean across electrodes (i.e. average referenced) and their global field power.
+        """
+        if electrodes is None:
+            electrodes = self._scalp_electrodes(source.columns)
+        if not electrodes or any(electrode not in source.columns for electrode in electrodes):
+            raise ValueError("One of the provided electrodes is not in the source.")
+        values = source[electrodes].to_numpy(dtype = self.settings.accum_dtype)
+        values = values - values.mean(axis = 1, keepdims = True)
+        return values, np.sqrt((values ** 2).mean(axis = 1))
+
+    @profiling.instrument
+    def compute_gfp(self, source = None, electrodes = None):
+        """
+        Computes the global field power (the standard deviation across electrodes) of every row (ppt x condition x t or condition x t) of source at once.
+
+        Optional arguments:
+        source (str, pandas df or None) -- None for self.data, a key of self.grands for the grand level, or any dataframe with electrodes as columns. default: None
+        electrodes (list of str or None) -- electrodes included. default: None (all electrodes with a position in the montage, i.e. without mastoids and EOG channels)
+
+        Returns a pandas df with the index of source and a 'GFP' column, so it can be plotted with plot_EEG(..., electrodes = ['GFP']).
+        """
+        source = self._source(source)
+        gfp = self._spatial_values(source, electrodes)[1]
+        profiling.set_rows(len(source))
+        return pd.DataFrame({"GFP":gfp.astype(self.settings.dtype)}, index = source.index)
+
+    @profiling.instrument
+    def compute_dissimilarity(self, conditions, source = None, electrodes = None):
+        """
+        Computes the global dissimilarity (DISS: the global field power of the difference of the GFP-normalized, average referenced maps) and the topographic correlation (the spatial correlation of the maps, 1 - DISS^2 / 2) between two conditions at every t (and ppt) at once.
+
+        Required arguments:
+        conditions (list of str) -- the two conditions being compared as [condition1, condition2]
+
+        Optional arguments:
+        source (str, pandas df or None) -- None for self.data, a key of self.grands for the grand level, or any dataframe indexed by condition (and ppt) and t with electrodes as columns. default: None
+        electrodes (list of str or None) -- electrodes included. default: None (all electrodes with a position in the montage, i.e. without mastoids and EOG channels)
+
+        Returns a pandas df indexed like source with the condition 'condition1 vs condition2', with 'DISS' and 'Topographic Correlation' columns, so it can be plotted with plot_EEG(..., electrodes = ['DISS', 'Topographic Correlation']).
+        """
+        source = self._source(source)
+        if not isinstance(conditions, list) or len(conditions) != 2:
+            raise TypeError("Provide conditions as a list of two conditions: [condition1, condition2].")
+        if any(condition not in source.index.get_level_values('Condition') for condition in conditions):
+            raise ValueError("One of the provided conditions is not in the provided source.")
+
+        first, second = source.xs(conditions[0], level = 'Condition'), source.xs(conditions[1], level = 'Condition')
+        common = first.index.intersection(second.index, sort = False)
+        first, first_gfp = self._spatial_values(first.loc[common], electrodes)
+        second, second_gfp = self._spatial_values(second.loc[common], electrodes)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            diss = np.sqrt(((first / first_gfp[:,None] - second / second_gfp[:,None]) ** 2).mean(axis = 1))
+        output = pd.DataFrame({"DISS":diss, "Topographic Correlation":1 - diss ** 2 / 2}, index = common).astype(self.settings.dtype)
+        output = pd.concat({"%s vs %s" % (conditions[0], conditions[1]):output}, names = ['Condition'])
+        profiling.set_rows(len(common))
+        return output.reorder_levels(source.index.names)
+
+    @profiling.instrument
+    def compute_rois(self, source = None, rois = None):
+        """
+        Averages the electrodes of every ROI with one matrix multiply of the data by the ROI weight matrix of settings.spatial_index.
+
+        Optional arguments:
+        source (str, pandas df or None) -- None for self.data, a key of self.grands, or any dataframe with electrodes as columns (e.g. the output of scan_mean_amps). default: None
+        rois (dict, list of str or None) -- a dict of ROI name: list of electrodes OR a list of names of ROIs in self.settings.rois. default: None (all of self.settings.rois)
+
+        Returns a pandas df with the index of source and one column per ROI, so it can be used as a source of plot_EEG (with the ROI names as electrodes).
+        """
+        source = self._source(source)
+        if rois is None:
+            rois = self.settings.rois
+        elif isinstance(rois, list):
+            if any(roi not in self.settings.rois for roi in rois):
+                raise ValueError("One of the provided ROIs is not in self.settings.rois.")
+            rois = {roi:self.settings.rois[roi] for roi in rois}
+        elif not isinstance(rois, dict):
+            raise TypeError("Provided rois is of invalid type: %s. Provide a dict, a list of names in self.settings.rois or None." % type(rois))
+        if any(electrode not in source.columns for electrodes in rois.values() for electrode in electrodes):
+            raise ValueError("One of the electrodes of the provided ROIs is not in the source.")
+
+        index = self.settings.spatial_index()
+        weights = index.roi_weights(rois)[[index.electrodes.index(electrode) for electrode in source.columns]]
+        values = source.to_numpy(dtype = self.settings.accum_dtype) @ weights
+        profiling.set_rows(len(source))
+        return pd.DataFrame(np.asarray(values).astype(self.settings.dtype), index = source.index, columns = pd.Index(list(rois), name = 'ROI'))
+
+    @profiling.instrument
     def load_pickle(name):
         """
         If the Project has been generated and saved before, the pickle file can be loaded using this function returning a Project object. Loading from the pickle is faster than loading from the EMSE files each time.
@@ -247,11 +682,18 @@ class Project:
             raise ValueError("Invalid file extension.  Name the file with extension: *.p")
         
         if os.path.isfile(name):
-            print("Loading: %s" % name)
-            return pickle.load(open(name,'rb'))
+            logger.info("Loading: %s" % name)
+            project = pickle.load(open(name,'rb'))
+            #projects saved before t became an index level of data
+            if isinstance(project, Project) and 't' in project.data.columns:
+                project.data = project.data.set_index('t', append = True).drop(columns = ['time_windows'], errors = 'ignore').sort_index()
+            if isinstance(project, Project) and not hasattr(project, 'jackknives'):
+                project.jackknives = {}
+            return project
         else:
             raise ValueError("File with name: %s could not be found." % name)
     
+    @profiling.instrument
     def save_pickle(self, name):
         """
         Saves the active project data as a pickle file in the current working directory. This file can be loaded using load_pickle instead of using load.
@@ -265,12 +707,13 @@ class Project:
             raise ValueError("Invalid file extension.  Name the file with extension: *.p")
         
         if os.path.isfile(name):
-            print("Overwriting existing pickle named: %s" % name)
+            logger.warning("Overwriting existing pickle named: %s" % name)
         else:
-            print("Creating new pickle named: %s" % name)
+            logger.info("Creating new pickle named: %s" % name)
             
         pickle.dump(self, open(name, 'wb'))
         
+    @profiling.instrument
     def compute_diffs(self, minuend, subtrahend, difference):
         """
         Compute difference scores between conditions for each ppt and store it back into data: minuend - subtrahend = difference
@@ -280,21 +723,20 @@ class Project:
         subtrahend (str) -- the condition id for the subtrahend
         difference (str) -- the condition id that the difference will be named
         """
-        minuend_df, subtrahend_df = self.get_conditions(minuend).reset_index(), self.get_conditions(subtrahend).reset_index()
+        minuend_df, subtrahend_df = self.get_conditions(minuend).droplevel('Condition'), self.get_conditions(subtrahend).droplevel('Condition')
         if difference in self.conditions:
-            print("Note that a condition named %s already exists in this project." % difference)
+            logger.warning("Note that a condition named %s already exists in this project." % difference)
         
-        first_electrode, second_electrode = self.settings.electrodes[0], self.settings.electrodes[-1]
+        difference_df = minuend_df - subtrahend_df
+        #ppts missing either condition have no difference
+        difference_df = pd.concat({difference:difference_df}, names = ['Condition']).reorder_levels(['PPT','Condition','t']).dropna(how = 'all')
         
-        difference_df =  minuend_df.loc[:,first_electrode:second_electrode] - subtrahend_df.loc[:,first_electrode:second_electrode] 
-        difference_df['PPT'], difference_df['t'] = minuend_df['PPT'], minuend_df['t']
-        difference_df['Condition'] = difference
+        self.data = pd.concat([self.data, difference_df.astype(self.settings.dtype)], sort = False).sort_index()
         
-        self.data = pd.concat([self.data, difference_df.set_index(['PPT','Condition'])], sort = False)
-        
-        print("Successfully computed difference named %s from: %s = %s - %s" % (difference, difference, minuend, subtrahend))
-        print("This has been saved back to data.  Note that you will need to update any mean_amps or grands that have already computed.")
+        logger.info("Successfully computed difference named %s from: %s = %s - %s" % (difference, difference, minuend, subtrahend))
+        logger.info("This has been saved back to data.  Note that you will need to update any mean_amps or grands that have already computed.")
     
+    @profiling.instrument
     def compute_avgs(self, inputs, output):
         """
         Compute an average of certain conditions for each participant
@@ -309,40 +751,82 @@ class Project:
         if any(input not in self.conditions for input in inputs):
             raise ValueError("One of the provided conditions was not found.")
 			
-        idx = pd.IndexSlice
-        output_df = self.data.loc[idx[:,inputs],:].reset_index().groupby(['PPT','t']).mean().reset_index()
-        output_df['Condition'] = output
+        array, ppts, conditions, t, complete = self._as_array()
+        selected = array[:, conditions.get_indexer(inputs)]
+        average = self._mean(selected, 1, complete)
+        output_df = self._from_array(average, ['PPT','t'], [ppts, t])
+        output_df = pd.concat({output:output_df}, names = ['Condition']).reorder_levels(['PPT','Condition','t']).dropna(how = 'all')
         
-        self.data = pd.concat([self.data.reset_index(), output_df], sort = False).set_index(['PPT','Condition'])
-        print("Successfully computed average named %s from the following conditions: %s" % (output, ", ".join(inputs)))
-        print("This has been saved back to data.  Note that you will need to update any mean_amps or grands that have already computed.")
+        self.data = pd.concat([self.data, output_df], sort = False).sort_index()
+        logger.info("Successfully computed average named %s from the following conditions: %s" % (output, ", ".join(inputs)))
+        logger.info("This has been saved back to data.  Note that you will need to update any mean_amps or grands that have already computed.")
     
-    def compute_grands(self, name, ppts = []):
+    @profiling.instrument
+    def compute_grands(self, name, ppts = [], jackknife = False):
         """
-        Compute grand averages for all participants or for a subset of participants
+        Compute grand averages for all participants or for a subset of participants. The grands are indexed by Condition and t, and accumulated in settings.accum_dtype.
 
         Required arguments:
         name (str) -- the key under which this grands DataFrame will be saved in the dict self.grands
 
         Optional arguments:
         ppts (list of int) -- the ppts that will be included in these grands. default: [] which includes all ppts 
+        jackknife (bool) -- if True, the leave-one-out grands (the grands without each ppt) are also saved to the dict self.jackknives as one DataFrame indexed by PPT (the ppt left out), Condition and t. They are derived from the total sum minus each ppt's data, so all of them take one pass over the data. See compute_jackknife_latencies. default: False
         """
+        array, all_ppts, conditions, t, complete = self._as_array()
         if ppts:
-            df = self.data.loc[ppts]
-        else:
-            df = self.data
+            if any(ppt not in all_ppts for ppt in ppts):
+                raise ValueError("Ensure all provided ppts are in self.data")
+            array, all_ppts = array[all_ppts.get_indexer(ppts)], all_ppts[all_ppts.get_indexer(ppts)]
             
-        self.grands[name] = df.groupby(['Condition','t']).mean()
+        self.grands[name] = self._from_array(self._mean(array, 0, complete), ['Condition','t'], [conditions, t])
+        if jackknife:
+            if len(all_ppts) < 2:
+                raise ValueError("At least 2 ppts are needed for jackknife grands.")
+            values = array.astype(self.settings.accum_dtype)
+            #ppts missing a condition have no leave-one-out grand for it (NaN)
+            present = ~np.isnan(values[:, :, :1, :1])
+            values[np.isnan(values)] = 0
+            total, counts = values.sum(axis = 0), present.sum(axis = 0)
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                leave_one_out = np.where(present, (total - values) / (counts - 1), np.nan)
+            self.jackknives[name] = self._from_array(leave_one_out, ['PPT','Condition','t'], [all_ppts, conditions, t])
+        profiling.set_rows(array.shape[0] * array.shape[1] * array.shape[2])
     
-    def compute_mean_amps(self, name, time_windows = 'default'):
+    @profiling.instrument
+    def compute_mean_amps(self, name, time_windows = 'default', measures = ['mean'], polarity = 'positive', fraction = 0.5, local_width = 20):
         """
-        Compute mean amplitudes for specific time_windows
+        Compute mean amplitudes (and optionally peak and latency measures) for specific time_windows. Every measure is computed for all ppts, conditions and electrodes of a time window at once.
 
         Required arguments:
         name (str) -- the key under which this mean_amps DataFrame will be saved in the dict self.mean_amps
 
         Optional arguments:
         time_windows (str, list or dict) -- a str key for predefined time_windows in self.settings.time_windows OR a list of time windows (automatically will be named t1, t2, etc) OR a dict with time windows and custom labels. default: 'default'
+        measures (list of str) -- the measures computed, each saved as a column: 'mean' (Mean Amplitude), 'peak' (Peak Amplitude and Peak Latency: the largest sample of the window), 'fractional_area' (Fractional Area Latency: the time at which the area of the window reaches fraction of its total) and 'local_peak' (Local Peak Mean: the mean of +/- local_width ms around the local peak, i.e. the largest sample of the window that is larger than the mean of the local_width ms on each side of it, or the largest sample if there is none). default: ['mean']
+        polarity (str) -- 'positive' (e.g. P600) or 'negative' (e.g. N400). Peaks are the most positive or the most negative samples, and only the area of that polarity is used for the fractional area. default: 'positive'
+        fraction (float) -- fraction of the area for the Fractional Area Latency. default: 0.5
+        local_width (int or float) -- ms on each side of a sample used for the local peak and its mean. default: 20
+        """
+        valid_measures = ['mean', 'peak', 'fractional_area', 'local_peak']
+        if not isinstance(measures, list) or not measures or any(measure not in valid_measures for measure in measures):
+            raise ValueError("Provided measures: %s is invalid. Please provide a list of any/all of the following: %s" % (measures, ", ".join(valid_measures)))
+        if polarity not in ['positive', 'negative']:
+            raise ValueError("Provided polarity: %s is invalid. Please provide 'positive' or 'negative'." % polarity)
+        if not 0 < fraction <= 1:
+            raise ValueError("Provided fraction: %s must be between 0 and 1." % fraction)
+        
+        array, ppts, conditions, t, complete = self._as_array()
+        t = np.asarray(t)
+        labels, windows = self._time_windows(time_windows, t)
+        columns = self._window_measures(array, t, windows, measures, 1 if polarity == 'positive' else -1, fraction, local_width, complete)
+        #ppts missing a condition are NaN at every sample
+        self.mean_amps[name] = self._melt_windows(columns, ppts, conditions, labels, None if complete else np.isnan(array[:, :, 0, 0]))
+        profiling.set_rows(len(self.data.index))
+
+    def _time_windows(self, time_windows, t):
+        """
+        Returns the labels and the (start, stop) slices of t of time_windows (see compute_mean_amps). Time windows include their upper bound but not their lower bound.
         """
         if isinstance(time_windows, str):
             if time_windows in self.settings.time_windows:
@@ -359,20 +843,165 @@ class Project:
             
         if not all((type(time_window) == tuple) & (len(time_window) == 2) for time_window in time_windows):
             raise TypeError("Ensure that all provided time windows are tuples of 2 elements.")
-        
-        df = self.data
-        df['time_windows'] = pd.cut(df['t'], pd.IntervalIndex.from_tuples(time_windows))
-        d = dict(zip(pd.Categorical(df['time_windows']).categories,labels))
-        df['time_windows'].replace(d, inplace = True)
-        df = df.groupby(["PPT","Condition","time_windows"]).mean()
-        
-        mean = pd.melt(df.drop(columns=["t"]).reset_index(),
-                       id_vars=["PPT","Condition","time_windows"],
-                       var_name = "electrode",
-                       value_name = "Mean Amplitude")
-        mean["Label"] = mean["Condition"] + mean["electrode"] + mean["time_windows"]
-        
-        self.mean_amps[name] = mean
+
+        lower, upper = np.array([time_window[0] for time_window in time_windows]), np.array([time_window[1] for time_window in time_windows])
+        start, stop = self._time_slice(t, lower, upper)
+        if (start >= stop).any():
+            raise ValueError("One of the provided time windows contains no time points. Epochs are %sms to %sms" % (t.min(), t.max()))
+        return list(labels), list(zip(start, stop))
+
+    def _melt_windows(self, columns, ppts, conditions, labels, missing = None):
+        """
+        Returns the long mean_amps DataFrame of columns (dict of column name: array of ppt x condition x time window x electrode), with electrodes as the outer level. Rows of missing (a boolean array of ppt x condition) are dropped.
+        """
+        electrodes, conditions = self.data.columns, pd.Index(conditions)
+        n_ppts, n_conditions, n_windows, n_electrodes = len(ppts), len(conditions), len(labels), len(electrodes)
+        e = np.repeat(np.arange(n_electrodes), n_ppts * n_conditions * n_windows)
+        p = np.tile(np.repeat(np.arange(n_ppts), n_conditions * n_windows), n_electrodes)
+        c = np.tile(np.repeat(np.arange(n_conditions), n_windows), n_ppts * n_electrodes)
+        w = np.tile(np.arange(n_windows), n_ppts * n_conditions * n_electrodes)
+        keep = slice(None) if missing is None else ~missing[p, c]
+        e, p, c, w = e[keep], p[keep], c[keep], w[keep]
+
+        #labels are built once per condition x electrode x window and taken by position
+        label_names = pd.Index(["%s%s%s" % (condition, electrode, label) for condition in conditions for electrode in electrodes for label in labels])
+        mean = pd.DataFrame({"PPT":ppts[p],
+                             "Condition":conditions[c],
+                             "time_windows":pd.Categorical.from_codes(w, categories = labels),
+                             "electrode":electrodes[e]})
+        for column, values in columns.items():
+            mean[column] = values.transpose(3, 0, 1, 2).ravel()[keep]
+        mean["Label"] = label_names[(c * n_electrodes + e) * n_windows + w]
+        return mean
+
+    @profiling.instrument
+    def scan_mean_amps(self, name, width = 50, stride = 10, start = None, end = None):
+        """
+        Compute mean amplitudes of every window of width ms, every stride ms, across the epoch and save them to self.mean_amps[name] (labelled 'lower-upper'). All windows come from one cumulative sum along t, so the cost does not depend on the number of windows.
+
+        Required arguments:
+        name (str) -- the key under which this mean_amps DataFrame will be saved in the dict self.mean_amps
+
+        Optional arguments:
+        width (int or float) -- width of the windows in ms. Like time_windows, windows include their upper bound but not their lower bound. default: 50
+        stride (int or float) -- ms between the start of consecutive windows. default: 10
+        start (int, float or None) -- lower bound of the first window. default: None (the first time point)
+        end (int, float or None) -- no window goes past end. default: None (the last time point)
+
+        Returns the mean amplitudes as a pandas df indexed by PPT, Condition and t (the centre of each window) with electrodes as columns, like self.data, so it can be passed as data to the stats functions or, averaged across ppts, as the source of plot_EEG.
+        """
+        if width <= 0 or stride <= 0:
+            raise ValueError("Provided width: %s and stride: %s must be positive." % (width, stride))
+        array, ppts, conditions, t, complete = self._as_array()
+        t = np.asarray(t)
+        start = t[0] if start is None else start
+        end = t[-1] if end is None else end
+        lower = np.arange(start, end - width + stride * 1e-9, stride)
+        if len(lower) == 0:
+            raise ValueError("No window of width %sms fits between %sms and %sms." % (width, start, end))
+        upper = lower + width
+        first, stop = self._time_slice(t, lower, upper)
+
+        sums = np.concatenate([np.zeros(array[:, :, :1].shape, dtype = self.settings.accum_dtype), np.cumsum(array, axis = 2, dtype = self.settings.accum_dtype)], axis = 2)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            amplitudes = (sums[:, :, stop] - sums[:, :, first]) / (stop - first)[:,None]
+
+        labels = ["%g-%g" % (lower_bound, upper_bound) for lower_bound, upper_bound in zip(lower, upper)]
+        missing = None if complete else np.isnan(array[:, :, 0, 0])
+        self.mean_amps[name] = self._melt_windows({"Mean Amplitude":amplitudes}, ppts, conditions, labels, missing)
+        profiling.set_rows(len(self.data.index))
+        logger.info("Computed mean amplitudes of %s windows of %sms every %sms from %sms to %sms." % (len(labels), width, stride, lower[0], upper[-1]))
+
+        scan = self._from_array(amplitudes, ['PPT','Condition','t'], [ppts, conditions, pd.Index(lower + width / 2)])
+        return scan if complete else scan.dropna(how = 'all')
+
+    @profiling.instrument
+    def compute_jackknife_latencies(self, name, time_windows = 'default', measure = 'peak', polarity = 'positive', fraction = 0.5):
+        """
+        Compute latencies on the leave-one-out grands of self.jackknives[name] (see compute_grands with jackknife = True) and save them to self.mean_amps[name]. The latency of each leave-one-out grand is retrieved as an estimate for the ppt left out with the transformation of Smulders (2010): n * mean(J) - (n - 1) * J_i, where J_i is the latency without ppt i. These estimates have the variance of single-participant latencies, so they can be analysed with the usual t-tests and ANOVAs (no adjusted F or t values are needed).
+
+        Required arguments:
+        name (str) -- a key of self.jackknives. The latencies are saved under the same key in self.mean_amps
+
+        Optional arguments:
+        time_windows (str, list or dict) -- see compute_mean_amps. default: 'default'
+        measure (str) -- 'peak' (Peak Latency) or 'fractional_area' (Fractional Area Latency). See compute_mean_amps. default: 'peak'
+        polarity (str) -- 'positive' or 'negative'. default: 'positive'
+        fraction (float) -- fraction of the area for the Fractional Area Latency. default: 0.5
+        """
+        if name not in self.jackknives:
+            raise ValueError("No jackknife grands named %s. Run compute_grands(%s, jackknife = True) first." % (name, name))
+        if measure not in ['peak', 'fractional_area']:
+            raise ValueError("Provided measure: %s is invalid. Please provide 'peak' or 'fractional_area'." % measure)
+        if polarity not in ['positive', 'negative']:
+            raise ValueError("Provided polarity: %s is invalid. Please provide 'positive' or 'negative'." % polarity)
+
+        array, ppts, conditions, t, complete = self._as_array(self.jackknives[name])
+        t = np.asarray(t)
+        labels, windows = self._time_windows(time_windows, t)
+        column = {'peak':"Peak Latency", 'fractional_area':"Fractional Area Latency"}[measure]
+        jackknife = self._window_measures(array, t, windows, [measure], 1 if polarity == 'positive' else -1, fraction, 20, complete)[column]
+
+        #only ppts with the condition have a leave-one-out grand of their own
+        present = ~np.isnan(array[:, :, :1, :1])
+        n = present.sum(axis = 0)
+        mean = np.where(present, jackknife, 0).sum(axis = 0) / n
+        retrieved = n * mean - (n - 1) * jackknife
+
+        self.mean_amps[name] = self._melt_windows({"Jackknife %s" % column:jackknife, column:retrieved}, ppts, conditions, labels, ~present[:, :, 0, 0])
+        profiling.set_rows(array.shape[0] * array.shape[1] * array.shape[2])
+
+    def _window_measures(self, array, t, windows, measures, sign, fraction, local_width, complete):
+        """
+        Computes the measures of compute_mean_amps for every window (a (start, stop) slice of t) of array (ppt x condition x t x electrode). Returns a dict of column name: array (ppt x condition x window x electrode).
+        """
+        columns = {}
+        if 'mean' in measures:
+            columns["Mean Amplitude"] = np.stack([self._mean(array[:, :, start:stop], 2, complete) for start, stop in windows], axis = 2)
+        if measures == ['mean']:
+            return columns
+
+        #sign makes the peaks of either polarity maxima; missing data never wins an argmax
+        signed = sign * array.astype(self.settings.accum_dtype)
+        signed[np.isnan(signed)] = -np.inf
+        if 'local_peak' in measures:
+            k = max(1, int(round(local_width / (t[1] - t[0])))) if len(t) > 1 else 1
+            n_t = len(t)
+            #cumulative sums give the mean of any span of samples in one operation
+            sums = np.concatenate([np.zeros(signed[:, :, :1].shape), np.cumsum(np.where(np.isfinite(signed), signed, 0), axis = 2)], axis = 2)
+            i = np.arange(n_t)
+            before_start, after_stop = np.maximum(i - k, 0), np.minimum(i + k + 1, n_t)
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                before = (sums[:, :, i] - sums[:, :, before_start]) / (i - before_start)[:,None]
+                after = (sums[:, :, after_stop] - sums[:, :, i + 1]) / (after_stop - i - 1)[:,None]
+            local = (signed > before) & (signed > after)
+            del before, after
+
+        peaks, latencies, area_latencies, local_means = [], [], [], []
+        for start, stop in windows:
+            window = signed[:, :, start:stop]
+            peak = window.argmax(axis = 2)
+            if 'peak' in measures:
+                peaks.append(sign * np.take_along_axis(window, peak[:, :, None], 2)[:, :, 0])
+                latencies.append(t[start + peak])
+            if 'fractional_area' in measures:
+                area = np.cumsum(np.clip(np.where(np.isfinite(window), window, 0), 0, None), axis = 2)
+                reached = area >= fraction * area[:, :, -1:]
+                area_latencies.append(np.where(area[:, :, -1] > 0, t[start + reached.argmax(axis = 2)], np.nan))
+            if 'local_peak' in measures:
+                is_local = local[:, :, start:stop]
+                local_peak = np.where(is_local.any(axis = 2), np.where(is_local, window, -np.inf).argmax(axis = 2), peak) + start
+                lower, upper = np.maximum(local_peak - k, 0), np.minimum(local_peak + k + 1, n_t)
+                total = np.take_along_axis(sums, upper[:, :, None], 2) - np.take_along_axis(sums, lower[:, :, None], 2)
+                local_means.append(sign * total[:, :, 0] / (upper - lower))
+
+        if 'peak' in measures:
+            columns["Peak Amplitude"], columns["Peak Latency"] = np.stack(peaks, axis = 2), np.stack(latencies, axis = 2)
+        if 'fractional_area' in measures:
+            columns["Fractional Area Latency"] = np.stack(area_latencies, axis = 2)
+        if 'local_peak' in measures:
+            columns["Local Peak Mean"] = np.stack(local_means, axis = 2)
+        return {column:columns[column] for column in ["Mean Amplitude", "Peak Amplitude", "Peak Latency", "Fractional Area Latency", "Local Peak Mean"] if column in columns}
     
     def get_conditions(self, condition_id):
         """
@@ -405,12 +1034,13 @@ class Project:
         else:
             raise ValueError("Provided PPT ID: %s, is not in loaded data." % (ppt_id))
     
+    @profiling.instrument
     def plot_topomap(self, source, conditions, time, vrange = None, fig_title='placeholder_title', show_sensors=False, show_head=True, nlevels=10, contour = True, X = 5, Y = 5):
         """
         Plot a topomap of one or multiple conditions with either contourf or pcolor
         
         Required arguments:
-        source (pandas df) -- this is a source for the data, this can be any dataframe with conditions as the index, electrodes as columns and a 't' column. It will likely be a self.grands['NAME'] OR self.ppt(PPTID)
+        source (pandas df) -- this is a source for the data, this can be any dataframe indexed by condition and t with electrodes as columns. It will likely be a self.grands['NAME'] OR self.ppt(PPTID)
 		conditions (str or list) -- this can be a single string, a one dimensional or two dimensional list of strings. Ex: 'Condition1' OR ['Condition1','Condition2'] OR [['Condition1','Condition2'],['Condition3','Condition4']]
 		time (list, int or float) -- this should be a list of 2 values [lower, upper], or a single timepoint (int or float)
         
@@ -453,22 +1083,27 @@ class Project:
         z = {} #1D information
         Z = {} #interpolated data
 
-        idx = pd.IndexSlice
+        def _condition(condition):
+            data = source.loc[condition].loc[:,first_electrode:last_electrode]
+            if len(data) != len(self.settings.t):
+                raise ValueError('The source of condition %s does not have the %s time points of settings.t' % (condition, len(self.settings.t)))
+            return data
 
-        #parse time input and create appropriate z variables
+        #parse time input and create appropriate z variables (selected by sample position)
         if isinstance(time,list):
             if len(time) == 2:
                 if _in_range(time,self.settings.t):
-                    print(time)
+                    logger.debug(time)
                     lower, upper = time[0], time[1]
                     if lower < upper:
+                        start, stop = self._time_slice(self.settings.t, lower, upper, include_lower = True)
                         if r > 1:
                             for row in conditions:
                                 for condition in row:
-                                    z[condition] = source.loc[idx[condition, lower:upper],first_electrode:last_electrode].mean()
+                                    z[condition] = _condition(condition).iloc[start:stop].mean()
                         else:
                             for condition in conditions:
-                                z[condition] = source.loc[idx[condition, lower:upper],first_electrode:last_electrode].mean()
+                                z[condition] = _condition(condition).iloc[start:stop].mean()
                     else:
                         raise ValueError('Ensure that the range you provide is defined as [lower,upper]')
                 else:
@@ -477,17 +1112,17 @@ class Project:
                 raise ValueError('Provided time range: %s, should only have 2 elements' % time)
         elif isinstance(time,float) or isinstance(time,int):
             if _in_range(time,self.settings.t):
-                if time not in self.settings.t:
-                    time_adj = time - ((time - self.settings.epoch['start']) % self.settings.sampling_interval)
-                    print("Provided time: %s, was adjusted to: %s." % (time, time_adj))
-                    time = time_adj
+                position = self.settings.time_index(time, 'floor')
+                if self.settings.t[position] != time:
+                    logger.info("Provided time: %s, was adjusted to: %s." % (time, self.settings.t[position]))
+                    time = self.settings.t[position]
                 if r > 1:
                     for row in conditions:
                         for condition in row:
-                            z[condition] = source.loc[idx[condition, time],first_electrode:last_electrode]
+                            z[condition] = _condition(condition).iloc[position]
                 else:
                     for condition in conditions:
-                        z[condition] = source.loc[idx[condition, time],first_electrode:last_electrode]
+                        z[condition] = _condition(condition).iloc[position]
             else:
                 raise ValueError('Provided time: %s, is out of range' % time) 
         else:
@@ -502,7 +1137,7 @@ class Project:
             else:
                 raise ValueError('Provided vrange has %s elements. Should only have 2.' % (len(vrange)))
         elif vrange == None:
-            vmin, vmax = np.inf, np.NINF
+            vmin, vmax = np.inf, -np.inf
             for condition, data in z.items():
                 temp_vmin, temp_vmax = data.min(), data.max() 
                 if temp_vmax > vmax:
@@ -514,12 +1149,14 @@ class Project:
         else:
             raise TypeError('Provided vrange: %s of %s type is invalid. Enter a range [min,max] or None.' % (vrange,type(vrange)))
 
-        print('The range is %s to %s.' % (vmin,vmax))
+        logger.info('The range is %s to %s.' % (vmin,vmax))
 
-        triangles = tri.Triangulation(self.settings.x, self.settings.y)
-        for condition in z:
-            tri_interp = tri.CubicTriInterpolator(triangles, z[condition])
-            Z[condition] = tri_interp(self.settings.X, self.settings.Y)
+        with profiling.stage('EEG.Project.plot_topomap.interpolation') as record:
+            triangles = tri.Triangulation(self.settings.x, self.settings.y)
+            for condition in z:
+                tri_interp = tri.CubicTriInterpolator(triangles, np.array(z[condition], dtype = float))
+                Z[condition] = tri_interp(self.settings.X, self.settings.Y)
+            record['rows'] = len(z)
 
         def _plot_topomap(ax, contour, Z):
             global cm
@@ -591,14 +1228,15 @@ class Project:
             f.write(str(conditions))
 
         fig.patch.set_facecolor('white')
-        print('Plotted successfully! Navigate to %s to find %s' % (path, fig_title))
+        logger.info('Plotted successfully! Navigate to %s to find %s' % (path, fig_title))
     
+    @profiling.instrument
     def plot_EEG(self, source, conditions, electrodes='midlines', colours = None, linestyles = None, fig_title = 'placeholder_title', y_axis_range = None, see_log = True, axis_formatting = True, Y = 13, X = 7):
         """
         Plot ERP waveforms for any number of conditions (optimal viewing at 1-4 conditions) with any colours, linestyles and arrangement of electrodes. You must set a y_axis_range or each electrode plot will have its own y_axis_range
 
         Required arguments:
-        source (pandas df) -- this is a source for the data, this can be any dataframe with conditions as the index, electrodes as columns and a 't' column. It will likely be a self.grands['NAME'] OR self.ppt(PPTID)
+        source (pandas df) -- this is a source for the data, this can be any dataframe indexed by condition and t with electrodes as columns. It will likely be a self.grands['NAME'] OR self.ppt(PPTID)
         conditions (str or list) -- this can be a single string or a list of strings. Ex: 'Condition1' OR ['Condition1','Condition2']
 
         Optional arguments:
@@ -685,10 +1323,10 @@ class Project:
         if see_log:
             with open(os.path.join(path, fig_title + '.txt'), 'r') as f:
                 for line in f.read().splitlines():
-                    print(line)
+                    logger.info(line)
 
         fig.patch.set_facecolor('white')
-        print('\nPlotted successfully! Navigate to %s to find %s\n' % (path, fig_title))
+        logger.info('Plotted successfully! Navigate to %s to find %s' % (path, fig_title))
     
     def _save_fig(self, fig, path, fig_title):
         if not os.path.exists(path):
@@ -700,14 +1338,16 @@ class Project:
         else:
             raise TypeError("The provided filename is of type: %s. Please provide a string for the filename." % (type(filename)))
 
-        fig.savefig(os.path.join(path, fig_title),format='pdf',dpi=1200)
+        with profiling.stage('EEG.Project._save_fig'):
+            fig.savefig(os.path.join(path, fig_title),format='pdf',dpi=1200)
     
+    @profiling.instrument
     def plot_electrode(self, source, conditions, electrode, colours, linestyles, y_axis_range = None, ax = None, axis_formatting = True, xaxis=True, yaxis=True):
         """
         Plot ERP waveforms for any number of conditions (optimal viewing at 1-4 conditions) with any colours, linestyles for a single electrode. This is intended for use in a custom plotting layout. If you wish to plot a single electrode, use plot_EEG instead.
 
         Required arguments:
-        source (pandas df) -- this is a source for the data, this can be any dataframe with conditions as the index, electrodes as columns and a 't' column. It will likely be a self.grands['NAME'] OR self.ppt(PPTID)
+        source (pandas df) -- this is a source for the data, this can be any dataframe indexed by condition and t with electrodes as columns. It will likely be a self.grands['NAME'] OR self.ppt(PPTID)
         conditions (str or list) -- this can be a single string or a list of strings. Ex: 'Condition1' OR ['Condition1','Condition2']
 
         Optional arguments:
@@ -754,10 +1394,11 @@ class Project:
             ax.axis('off')
         else:
             for cond, col, linestyle in zip(conditions, colours, linestyles):
+                data = source.loc[cond][electrode]
                 if(linestyle == '--'):                        
-                    ax.plot(self.settings.t, source.loc[cond][electrode], color=col, linestyle=linestyle, dashes = (1,2))
+                    ax.plot(data.index, data, color=col, linestyle=linestyle, dashes = (1,2))
                 else:
-                    ax.plot(self.settings.t, source.loc[cond][electrode], color=col, linestyle=linestyle)
+                    ax.plot(data.index, data, color=col, linestyle=linestyle)
                     
             while isinstance(electrode,list):
                 electrode = electrode[0]
@@ -879,7 +1520,8 @@ class Project:
             raise ValueError("Ensure all provided ppts are in self.data")
 
         idx = pd.IndexSlice
-        self.data = self.data.loc[idx[input_ppts,:],:].reset_index().set_index(['PPT','Condition'])
+        self.data = self.data.loc[idx[input_ppts,:,:],:]
+        self.data.index = self.data.index.remove_unused_levels()
 
     @property
     def conditions(self):
@@ -903,7 +1545,8 @@ class Project:
             raise ValueError("Ensure all provided conditions are in self.data")
             
         idx = pd.IndexSlice
-        self.data = self.data.loc[idx[:,input_conditions],:].reset_index().set_index(['PPT','Condition'])
+        self.data = self.data.loc[idx[:,input_conditions,:],:]
+        self.data.index = self.data.index.remove_unused_levels()
 
     @property
     def N(self):
@@ -0,0 +1,297 @@
+"""
+Benchmarks for dlab.
+
+Synthetic EMSE workspaces and Eprime exports are generated in a temporary directory for each size tier, then the main
+EEG, BEH and io functions are timed and their peak memory is measured with tracemalloc. Results are appended to a
+JSON lines file so that runs of different versions can be compared with compare().
+
+Example:
+    from dlab import benchmarks
+    benchmarks.run(['small','medium'], output = 'benchmarks.jsonl', label = 'before')
+    ...
+    benchmarks.run(['small','medium'], output = 'benchmarks.jsonl', label = 'after')
+    benchmarks.compare('benchmarks.jsonl', 'before', 'after')
+"""
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import tempfile
+import contextlib
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from dlab import BEH, EEG, io
+
+logger = logging.getLogger(__name__)
+
+#ppts x conditions for the EMSE workspaces and ppts x trials for the Eprime exports
+tiers = {"small":{'ppts':4, 'conditions':2, 'trials':120},
+         "medium":{'ppts':20, 'conditions':4, 'trials':480},
+         "large":{'ppts':60, 'conditions':8, 'trials':960}
+        }
+
+benchmark_names = ['EEG.load', 'EEG.compute_grands', 'EEG.compute_mean_amps', 'EEG.plot_topomap', 'EEG.plot_EEG', 'io.import_from_eprime', 'BEH.get_RTdata']
+
+def make_emse_workspace(path, ppts = 20, conditions = 4, my_settings = None, seed = None):
+    """
+    Writes a synthetic EMSE workspace that can be loaded with EEG.Project.load: one float32 .bin file per ppt and condition named '<condition>_<ppt>.bin', with len(settings.t) samples x the electrodes in settings.electrodes (in volts).
+
+    Required Arguments:
+    path (str) -- folder the .bin files are written to. It is created if it does not exist.
+
+    Optional Arguments:
+    ppts (int) -- number of participants. Default = 20
+    conditions (int) -- number of conditions, named C1, C2, etc. Default = 4
+    my_settings (EEG.settings) -- settings defining the time points and electrodes. Default = None (EEG.settings())
+    seed (int) -- seed of the random noise. Default = None
+    """
+    if my_settings is None:
+        my_settings = EEG.settings()
+    os.makedirs(path, exist_ok = True)
+    rng = np.random.default_rng(seed)
+    t = my_settings.t
+    n_electrodes = len(my_settings.electrodes)
+    #an N1/P3 like waveform with a per electrode gain, in volts
+    erp = (-3 * np.exp(-((t - 100) / 30) ** 2) + 5 * np.exp(-((t - 400) / 100) ** 2)) * 1e-6
+    gain = rng.uniform(0.2, 1.0, n_electrodes)
+    for condition in range(1, conditions + 1):
+        for ppt in range(1, ppts + 1):
+            data = np.outer(erp * (1 + 0.1 * condition), gain) + rng.normal(0, 2e-6, (len(t), n_electrodes))
+            data.astype(np.float32).tofile(os.path.join(path, "C%s_%s.bin" % (condition, ppt)))
+
+def make_eprime_exports(path, ppts = 20, trials = 480, words = 11, conditions = ['AP','AS','CP','CS'], seed = None):
+    """
+    Writes synthetic Eprime Excel formatted data files (.txt, UTF-16) that can be imported with io.import_from_eprime, one per participant. Each trial is one word of a sentence with a reading time (Stimulus.RT) and a comprehension question (CompQ.ACC, CompQ.RT).
+
+    Required Arguments:
+    path (str) -- folder the .txt files are written to. It is created if it does not exist.
+
+    Optional Arguments:
+    ppts (int) -- number of participants. Default = 20
+    trials (int) -- number of words read by each participant. Default = 480
+    words (int) -- number of words in each sentence (WordPos starts at 1). Default = 11
+    conditions (list of str) -- condition names, rotated over the items. Default = ['AP','AS','CP','CS']
+    seed (int) -- seed of the random reading times. Default = None
+    """
+    os.makedirs(path, exist_ok = True)
+    rng = np.random.default_rng(seed)
+    header = ['ExperimentName','Subject','Session','RandomSeed','SessionDate','SessionTime','StudyListA','Trial','Condition','Item','WordPos','Stimulus.RT','CompQ.ACC','CompQ.RT']
+    for ppt in range(1, ppts + 1):
+        trial = np.arange(trials)
+        item = trial // words + 1
+        records = pd.DataFrame({'ExperimentName':'Benchmark',
+                                'Subject':ppt,
+                                'Session':1,
+                                'RandomSeed':rng.integers(-2**31, 2**31, trials),
+                                'SessionDate':'03-14-2019',
+                                'SessionTime':'10:00:00',
+                                'StudyListA':"List%s" % (ppt % len(conditions) + 1),
+                                'Trial':trial + 1,
+                                'Condition':np.array(conditions)[(item + ppt) % len(conditions)],
+                                'Item':item,
+                                'WordPos':trial % words + 1,
+                                'Stimulus.RT':np.round(rng.lognormal(6, 0.4, trials)).astype(int),
+                                'CompQ.ACC':rng.integers(0, 2, trials),
+                                'CompQ.RT':np.round(rng.normal(1500, 200, trials)).astype(int)
+                               }, columns = header)
+        with open(os.path.join(path, "Benchmark-%s-1.txt" % ppt), 'w', encoding = 'UTF-16', newline = '') as f:
+            f.write("C:\\Experiments\\Benchmark-%s-1.edat2\n" % ppt)
+            f.write("This file contains only the data from the experiment.\n")
+            records.to_csv(f, sep = '\t', index = False, lineterminator = '\n')
+
+@contextlib.contextmanager
+def _quiet():
+    """
+    Private function: hides the messages of dlab while a benchmark runs.
+    """
+    dlab_logger = logging.getLogger('dlab')
+    level = dlab_logger.level
+    dlab_logger.setLevel(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        dlab_logger.setLevel(level)
+
+def _measure(function, repeat = 1, memory = True):
+    """
+    Private function: calls function() repeat times and returns (best time in seconds, peak traced memory in MB or None, error message or None). Messages are hidden. Memory is measured in an extra traced call so that tracing does not inflate the timings.
+    """
+    seconds, peak = None, None
+    try:
+        with _quiet():
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function()
+                elapsed = time.perf_counter() - start
+                seconds = elapsed if seconds is None else min(seconds, elapsed)
+                plt.close('all')
+            if memory:
+                tracemalloc.start()
+                try:
+                    function()
+                    peak = tracemalloc.get_traced_memory()[1] / 2**20
+                finally:
+                    tracemalloc.stop()
+                    plt.close('all')
+    except Exception as e:
+        return seconds, peak, "%s: %s" % (type(e).__name__, e)
+    return seconds, peak, None
+
+def _run_tier(tier, sizes, benchmarks, repeat, memory, seed):
+    """
+    Private function: generates the data for one tier in a temporary working directory and runs the requested benchmarks. Returns a list of result dicts.
+    """
+    results = []
+    def record(name, function):
+        if name not in benchmarks:
+            return
+        seconds, peak, error = _measure(function, repeat, memory)
+        results.append({'tier':tier, 'benchmark':name, 'seconds':seconds, 'peak_mb':peak, 'error':error})
+        logger.info("%s\t%s\t%s s\t%s MB%s" % (tier, name,
+                                               "%.4f" % seconds if seconds is not None else "-",
+                                               "%.1f" % peak if peak is not None else "-",
+                                               "\t%s" % error if error else ""))
+
+    my_settings = EEG.settings()
+    with tempfile.TemporaryDirectory(prefix = "dlab_benchmark_") as tmp:
+        workspace, raw_dir, formatted_dir = [os.path.join(tmp, folder) for folder in ['workspace', 'raw', 'formatted']]
+        os.makedirs(formatted_dir)
+        make_emse_workspace(workspace, sizes['ppts'], sizes['conditions'], my_settings, seed)
+        make_eprime_exports(raw_dir, sizes['ppts'], sizes['trials'], seed = seed)
+
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            project = EEG.Project(my_settings)
+            record('EEG.load', lambda: project.load(workspace))
+            if len(project.data):
+                conditions = list(project.conditions)
+                record('EEG.compute_grands', lambda: project.compute_grands('all'))
+                record('EEG.compute_mean_amps', lambda: project.compute_mean_amps('all'))
+                if 'all' not in project.grands:
+                    with _quiet():
+                        project.compute_grands('all')
+                record('EEG.plot_topomap', lambda: project.plot_topomap(project.grands['all'], conditions[:2], [300, 500], fig_title = 'topomap'))
+                record('EEG.plot_EEG', lambda: project.plot_EEG(project.grands['all'], conditions[:2], fig_title = 'waveforms', see_log = False))
+
+            def import_eprime():
+                return io.import_from_eprime(raw_dir, formatted_dir, 'merged')
+            record('io.import_from_eprime', import_eprime)
+
+            if 'BEH.get_RTdata' in benchmarks:
+                with _quiet():
+                    data = import_eprime()
+                    beh = BEH.Project(data, PPT = 'Subject', Condition = 'Condition', Item = 'Item', WordPos = 'WordPos', RT = 'Stimulus_RT', CompQAcc = 'CompQ_ACC', CompQRT = 'CompQ_RT')
+                record('BEH.get_RTdata', lambda: beh.get_RTdata())
+        finally:
+            os.chdir(cwd)
+    return results
+
+def _version():
+    """
+    Private function: returns the installed version of dlab or 'unknown'.
+    """
+    try:
+        from importlib.metadata import version
+        return version('dlab')
+    except Exception:
+        return 'unknown'
+
+def run(tiers_to_run = ['small'], benchmarks = None, output = 'benchmarks.jsonl', label = None, repeat = 3, memory = True, seed = 0):
+    """
+    Runs the benchmarks for the provided size tiers and appends the results to a JSON lines file (one line per tier and benchmark). Plots are drawn with the Agg backend in a temporary folder.
+
+    Optional Arguments:
+    tiers_to_run (list of str) -- keys of benchmarks.tiers to run. Default = ['small']
+    benchmarks (list of str) -- names from benchmarks.benchmark_names to run. Default = None (all)
+    output (str or None) -- JSON lines file the results are appended to. If None, nothing is written. Default = 'benchmarks.jsonl'
+    label (str) -- label of this run used by compare (e.g. a version or a branch name). Default = None (the installed version of dlab)
+    repeat (int) -- number of timed calls, the best time is kept. Default = 3
+    memory (bool) -- if True, an extra call is traced with tracemalloc to measure the peak memory. Default = True
+    seed (int) -- seed of the synthetic data. Default = 0
+
+    Returns a pandas.DataFrame of the results.
+    """
+    if any(tier not in tiers for tier in tiers_to_run):
+        raise ValueError("Provided tiers: %s are not valid. Please provide any of: %s" % (", ".join(tiers_to_run), ", ".join(tiers)))
+    if benchmarks is None:
+        benchmarks = benchmark_names
+    elif any(name not in benchmark_names for name in benchmarks):
+        raise ValueError("Provided benchmarks: %s are not valid. Please provide any of: %s" % (", ".join(benchmarks), ", ".join(benchmark_names)))
+
+    version = _version()
+    info = {'label':label if label is not None else version,
+            'version':version,
+            'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python':platform.python_version(),
+            'numpy':np.__version__,
+            'pandas':pd.__version__,
+            'platform':platform.platform(),
+            'repeat':repeat}
+
+    backend = plt.get_backend()
+    plt.switch_backend('Agg')
+    results = []
+    try:
+        for tier in tiers_to_run:
+            results += [dict(info, **result) for result in _run_tier(tier, tiers[tier], benchmarks, repeat, memory, seed)]
+    finally:
+        try:
+            plt.switch_backend(backend)
+        except Exception:
+            pass
+
+    if output is not None:
+        with open(output, 'a') as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+        logger.info("Results of %s benchmark(s) were appended to %s" % (len(results), output))
+    return pd.DataFrame(results)
+
+def load_results(filename):
+    """
+    Loads the results written by run into a pandas.DataFrame.
+
+    Required Arguments:
+    filename (str) -- JSON lines file written by run
+    """
+    if not os.path.isfile(filename):
+        raise ValueError("File with name: %s could not be found." % filename)
+    return pd.read_json(filename, lines = True)
+
+def compare(filename, baseline, candidate, threshold = 0.1):
+    """
+    Compares the results of two labelled runs. If a label was run more than once, its latest results are used.
+
+    Required Arguments:
+    filename (str) -- JSON lines file written by run
+    baseline (str) -- label of the reference run
+    candidate (str) -- label of the run to compare with the reference
+
+    Optional Arguments:
+    threshold (float) -- relative increase in time or peak memory reported as a regression. Default = 0.1 (10%)
+
+    Returns a pandas.DataFrame indexed by tier and benchmark with the times, peak memory, their ratios (candidate / baseline) and a Regression column.
+    """
+    results = load_results(filename)
+    for label in [baseline, candidate]:
+        if label not in set(results['label'].astype(str)):
+            raise ValueError("Provided label: %s was not found in %s." % (label, filename))
+    results['label'] = results['label'].astype(str)
+    latest = results.sort_values('timestamp').groupby(['label', 'tier', 'benchmark']).last()
+
+    comparison = pd.concat([latest.loc[baseline, ['seconds', 'peak_mb']].add_suffix(' (%s)' % baseline),
+                            latest.loc[candidate, ['seconds', 'peak_mb']].add_suffix(' (%s)' % candidate)], axis = 1)
+    comparison['Time Ratio'] = comparison['seconds (%s)' % candidate] / comparison['seconds (%s)' % baseline]
+    comparison['Memory Ratio'] = comparison['peak_mb (%s)' % candidate] / comparison['peak_mb (%s)' % baseline]
+    comparison['Regression'] = (comparison['Time Ratio'] > 1 + threshold) | (comparison['Memory Ratio'] > 1 + threshold)
+    return comparison
+
+if __name__ == '__main__':
+    run(sys.argv[1:] or ['small'])
@@ -0,0 +1,356 @@
+"""
+Console entry points to run EEG and BEH pipelines without a notebook.
+
+    dlab-eeg pipeline.json [--jobs N] [--plot] [--force]
+    dlab-beh pipeline.json [--jobs N] [--plot] [--force]
+
+A pipeline file is a JSON object describing one study, or a list of them. Relative paths are relative to the pipeline
+file. The result of every stage is pickled in the study's cache folder; when the pipeline is run again, it resumes
+from the last stage whose configuration did not change (use --force to start over). The first stage is also rerun
+when the input files (the .bin files of the workspace or the raw E-Prime files) are added, removed or modified.
+
+EEG study:
+{
+    "name": "study1",
+    "workspace": "EMSE/Original",                   -- folder with the .bin files (see EEG.Project.load)
+    "settings": {"sampling_interval": 1.953125, "epoch": {"start": -200, "end": 1201}},
+    "ppts": [1, 2, 3],                              -- optional subset of participants
+    "subsets": {"group1": [1, 2], "group2": [3]},   -- optional, runs one study per subset (name_group1, ...) in its own output folder
+    "bads": {"3": ["T7"]},                          -- optional bad electrodes, for all ppts (list) or per ppt (see EEG.Project.interpolate_bads)
+    "baseline": [-200, 0],                          -- optional baseline interval (see EEG.Project.baseline_correct)
+    "reference": "mastoids",                        -- optional: "average", "mastoids" or a list of electrodes (see EEG.Project.rereference)
+    "diffs": [{"minuend": "A", "subtrahend": "B", "difference": "A-B"}],
+    "avgs": [{"inputs": ["A", "B"], "output": "AB"}],
+    "grands": {"all": []},                          -- name: ppts ([] for all)
+    "mean_amps": {"default": "default"},            -- name: time_windows (key, list of [lower, upper] or dict)
+                                                    -- or name: {"time_windows": ..., "measures": ["mean", "peak"], "polarity": "negative"}
+    "plots": [{"method": "plot_EEG", "source": "all", "conditions": ["A", "B"], "fig_title": "AB"}],
+    "exports": {"excel": "study1.xlsx", "spss": "study1.sav", "wide": true, "streaming": false}
+}
+
+BEH study:
+{
+    "name": "study1",
+    "raw_dir": "raw", "formatted_dir": "formatted", "merged_output_name": "merged",
+    "import": {"encoding": "UTF-16", "incremental": true},   -- optional arguments of io.import_from_eprime
+    "columns": {"PPT": "Subject", "Condition": "Condition", "Item": "Item", "WordPos": "WordPos", "RT": "Stimulus_RT"},
+    "ppts": [1, 2, 3],
+    "subsets": {"group1": [1, 2]},
+    "RTdata": {"critical_conditions": ["A", "B"]},  -- optional arguments of BEH.Project.get_RTdata
+    "CompQ": true,
+    "plots": [{"method": "plot_CompQAcc", "title": "Accuracy", "by": "PPT"}],
+    "exports": {"excel": "study1.xlsx", "spss": "study1.sav"}
+}
+
+Every study can also set "cache" (default: '.dlab_pipeline/<name>') and "output_dir" (default: the folder of the pipeline file) where plots and exports are written.
+"""
+import os
+import sys
+import json
+import pickle
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from dlab import profiling
+
+logger = logging.getLogger(__name__)
+
+_PATH_KEYS = ['workspace', 'raw_dir', 'formatted_dir', 'cache', 'output_dir']
+
+def load_pipeline(filename):
+    """
+    Loads a pipeline file and returns the list of studies to run. Relative paths are resolved against the folder of the pipeline file and subsets are expanded into separate studies.
+
+    Required Arguments:
+    filename (str) -- file name of the pipeline (.json)
+    """
+    if not os.path.isfile(filename):
+        raise ValueError("Pipeline file: %s could not be found." % filename)
+    with open(filename) as f:
+        pipeline = json.load(f)
+    studies = pipeline if isinstance(pipeline, list) else pipeline.get('studies', [pipeline])
+    if not studies or any(not isinstance(study, dict) for study in studies):
+        raise TypeError("A pipeline must be a JSON object describing a study or a list of studies.")
+
+    base = os.path.dirname(os.path.abspath(filename))
+    expanded = []
+    for i, study in enumerate(studies):
+        study = dict(study)
+        study.setdefault('name', "%s_%s" % (os.path.splitext(os.path.basename(filename))[0], i + 1))
+        study.setdefault('output_dir', base)
+        study.setdefault('cache', os.path.join('.dlab_pipeline', study['name']))
+        for key in _PATH_KEYS:
+            if key in study:
+                study[key] = os.path.join(base, study[key])
+        subsets = study.pop('subsets', None)
+        if subsets:
+            for subset, ppts in subsets.items():
+                expanded.append(dict(study, name = "%s_%s" % (study['name'], subset), ppts = ppts, cache = os.path.join(study['cache'], subset), output_dir = os.path.join(study['output_dir'], subset)))
+        else:
+            expanded.append(study)
+
+    names = [study['name'] for study in expanded]
+    if len(set(names)) != len(names):
+        raise ValueError("Study names in a pipeline must be unique. Found: %s" % ", ".join(names))
+    return expanded
+
+def _signature(*parts):
+    """
+    Private function: returns a short hash of the configuration of a stage and of all the stages before it.
+    """
+    return hashlib.sha1(json.dumps(parts, sort_keys = True, default = str).encode('utf-8')).hexdigest()[:12]
+
+def _run_stages(study, stages, force = False):
+    """
+    Private function: runs the cached stages of a study in order. stages is a list of (name, configuration, function) where function takes the result of the previous stage (None for the first one) and returns the project. After each stage, the project is pickled to '<cache>/<i>_<name>_<signature>.p', so the run resumes after the last stage whose signature (its configuration and the configuration of the stages before it) has not changed.
+    """
+    os.makedirs(study['cache'], exist_ok = True)
+    signatures, parts = [], []
+    for name, configuration, function in stages:
+        parts.append([name, configuration])
+        signatures.append(_signature(*parts))
+    files = [os.path.join(study['cache'], "%s_%s_%s.p" % (i, name, signature)) for i, ((name, configuration, function), signature) in enumerate(zip(stages, signatures))]
+
+    start, project = 0, None
+    if not force:
+        for i in reversed(range(len(stages))):
+            if os.path.isfile(files[i]):
+                with open(files[i], 'rb') as f:
+                    project = pickle.load(f)
+                start = i + 1
+                logger.info("[%s] Resuming after stage: %s" % (study['name'], stages[i][0]))
+                break
+
+    for i in range(start, len(stages)):
+        name, configuration, function = stages[i]
+        logger.info("[%s] Running stage: %s" % (study['name'], name))
+        project = function(project)
+        with open(files[i], 'wb') as f:
+            pickle.dump(project, f)
+        #stale results of this stage
+        for old in os.listdir(study['cache']):
+            if old.startswith("%s_%s_" % (i, name)) and os.path.join(study['cache'], old) != files[i]:
+                os.remove(os.path.join(study['cache'], old))
+    return project
+
+def _plot(study, project, sources):
+    """
+    Private function: runs the plots of a study. Each plot names a plotting method of the Project and its arguments. A 'source' argument can name a grands DataFrame.
+    """
+    for plot in study.get('plots', []):
+        plot = dict(plot)
+        method = plot.pop('method', '')
+        if not method.startswith('plot_') or not hasattr(project, method):
+            raise ValueError("[%s] Provided plot method: %s is not a plotting method of the Project." % (study['name'], method))
+        if isinstance(plot.get('source'), str):
+            if plot['source'] not in sources:
+                raise ValueError("[%s] Provided source: %s was not computed." % (study['name'], plot['source']))
+            plot['source'] = sources[plot['source']]
+        getattr(project, method)(**plot)
+
+def run_eeg(study, force = False, plot = False):
+    """
+    Runs an EEG study: workspace -> project store -> bad electrodes/reference/baseline -> derived conditions -> grands -> mean amps -> (plots) -> exports. See help(dlab.cli) for the format of a study.
+
+    Required Arguments:
+    study (dict) -- a study loaded with load_pipeline
+
+    Optional Arguments:
+    force (bool) -- if True, cached stages are ignored. Default = False
+    plot (bool) -- if True, the plots of the study are drawn. Default = False
+    """
+    from dlab import EEG, io
+    if 'workspace' not in study:
+        raise ValueError("[%s] An EEG study needs a 'workspace'." % study['name'])
+
+    def load(project):
+        project = EEG.Project(EEG.settings(**study.get('settings', {})))
+        project.load(study['workspace'])
+        if study.get('ppts'):
+            project.data = project.data.loc[study['ppts']]
+        return project
+
+    def preprocess(project):
+        if study.get('bads'):
+            bads = study['bads']
+            project.interpolate_bads({int(ppt):electrodes for ppt, electrodes in bads.items()} if isinstance(bads, dict) else bads)
+        if study.get('reference'):
+            project.rereference(study['reference'])
+        if study.get('baseline'):
+            project.baseline_correct(study['baseline'])
+        return project
+
+    def derive(project):
+        for diff in study.get('diffs', []):
+            project.compute_diffs(diff['minuend'], diff['subtrahend'], diff['difference'])
+        for avg in study.get('avgs', []):
+            project.compute_avgs(avg['inputs'], avg['output'])
+        return project
+
+    def grands(project):
+        for name, ppts in study.get('grands', {'all':[]}).items():
+            project.compute_grands(name, ppts)
+        return project
+
+    def mean_amps(project):
+        for name, time_windows in study.get('mean_amps', {}).items():
+            options = {}
+            if isinstance(time_windows, dict) and 'time_windows' in time_windows:
+                options = {key:value for key, value in time_windows.items() if key != 'time_windows'}
+                time_windows = time_windows['time_windows']
+            if isinstance(time_windows, list):
+                time_windows = [tuple(time_window) for time_window in time_windows]
+            elif isinstance(time_windows, dict):
+                time_windows = {label:tuple(time_window) for label, time_window in time_windows.items()}
+            project.compute_mean_amps(name, time_windows, **options)
+        return project
+
+    #the data is always reloaded when the .bin files of the workspace (read recursively by Project.load) change
+    bin_files = sorted((os.path.relpath(os.path.join(root, name), study['workspace']), os.path.getsize(os.path.join(root, name)), os.path.getmtime(os.path.join(root, name))) for root, dirs, files in os.walk(study['workspace']) for name in files if name.endswith(".bin"))
+    stages = [('load', [study['workspace'], bin_files, study.get('settings'), study.get('ppts')], load),
+              ('preprocessed', [study.get('bads'), study.get('baseline'), study.get('reference')], preprocess),
+              ('derived', [study.get('diffs'), study.get('avgs')], derive),
+              ('grands', study.get('grands'), grands),
+              ('mean_amps', study.get('mean_amps'), mean_amps)]
+    project = _run_stages(study, stages, force)
+
+    if plot:
+        _plot(study, project, project.grands)
+
+    exports = study.get('exports', {})
+    names = list(project.mean_amps)
+    if exports.get('excel') and names:
+        io.export_to_excel(exports['excel'], [project.mean_amps[name] for name in names], names, streaming = exports.get('streaming', False))
+    if exports.get('spss'):
+        for name in names:
+            filename = exports['spss'] if len(names) == 1 else "%s_%s.sav" % (os.path.splitext(exports['spss'])[0], name)
+            io.export_to_spss(filename, project.mean_amps[name], wide = exports.get('wide', False))
+    return project
+
+def run_beh(study, force = False, plot = False):
+    """
+    Runs a BEH study: E-Prime import -> RT filtering -> CompQ -> (plots) -> exports. See help(dlab.cli) for the format of a study.
+
+    Required Arguments:
+    study (dict) -- a study loaded with load_pipeline
+
+    Optional Arguments:
+    force (bool) -- if True, cached stages are ignored. Default = False
+    plot (bool) -- if True, the plots of the study are drawn. Default = False
+    """
+    from dlab import BEH, io
+    missing = [key for key in ['raw_dir', 'formatted_dir', 'columns'] if key not in study]
+    if missing:
+        raise ValueError("[%s] A BEH study needs: %s" % (study['name'], ", ".join(missing)))
+    merged_output_name = study.get('merged_output_name', study['name'])
+
+    def import_data(project):
+        os.makedirs(study['formatted_dir'], exist_ok = True)
+        data = io.import_from_eprime(study['raw_dir'], study['formatted_dir'], merged_output_name, **study.get('import', {}))
+        project = BEH.Project(data, load_configs = study.get('load_configs', ""), **study['columns'])
+        if study.get('ppts'):
+            project.data = project.data[project.data['PPT'].isin(study['ppts'])]
+        return project
+
+    def rt_data(project):
+        project.get_RTdata(**study.get('RTdata', {}))
+        return project
+
+    def compq_data(project):
+        if study.get('CompQ', True):
+            project.get_CompQdata()
+        return project
+
+    #the import is always rerun when the raw files change
+    raw_files = sorted((name, os.path.getsize(os.path.join(study['raw_dir'], name)), os.path.getmtime(os.path.join(study['raw_dir'], name))) for name in os.listdir(study['raw_dir']))
+    stages = [('import', [raw_files, study.get('import'), study['columns'], study.get('ppts')], import_data),
+              ('RTdata', study.get('RTdata'), rt_data),
+              ('CompQ', study.get('CompQ', True), compq_data)]
+    project = _run_stages(study, stages, force)
+
+    if plot:
+        _plot(study, project, {})
+
+    exports = study.get('exports', {})
+    outputs = [(name, df) for name, df in [('RTdata', project.RTdata), ('CompQdata', project.CompQdata)] if df is not None]
+    if exports.get('excel') and outputs:
+        io.export_to_excel(exports['excel'], [df for name, df in outputs], [name for name, df in outputs], streaming = exports.get('streaming', False))
+    if exports.get('spss') and project.RTdata is not None:
+        io.export_to_spss(exports['spss'], project.RTdata)
+    return project
+
+def _run_study(kind, study, force, plot, profile, verbosity = logging.INFO):
+    """
+    Private function: runs one study in the study's output folder and returns (name, error message or None, profile summary or None). Defined at module level so that studies can be run in a process pool.
+    """
+    #worker processes do not inherit the console handler when they are spawned
+    profiling.set_verbosity(verbosity)
+    import matplotlib
+    matplotlib.use('Agg')
+    cwd = os.getcwd()
+    table = profiling.enable()[0] if profile else None
+    try:
+        os.makedirs(study['output_dir'], exist_ok = True)
+        os.chdir(study['output_dir'])
+        (run_eeg if kind == 'eeg' else run_beh)(study, force, plot)
+    except Exception as e:
+        logger.error("[%s] Failed: %s: %s" % (study['name'], type(e).__name__, e))
+        return study['name'], "%s: %s" % (type(e).__name__, e), None
+    finally:
+        os.chdir(cwd)
+        if profile:
+            profiling.disable()
+    logger.info("[%s] Done." % study['name'])
+    return study['name'], None, table.summary() if profile else None
+
+def main(argv = None, kind = None):
+    """
+    Runs the studies of a pipeline file. Used by the dlab-eeg and dlab-beh console scripts.
+    """
+    parser = argparse.ArgumentParser(prog = "dlab-%s" % kind if kind else "dlab", description = "Run a dlab %s pipeline without a notebook." % (kind.upper() if kind else "EEG or BEH"))
+    if kind is None:
+        parser.add_argument('kind', choices = ['eeg', 'beh'], help = "type of pipeline")
+    parser.add_argument('pipeline', help = "pipeline file (.json)")
+    parser.add_argument('-j', '--jobs', type = int, default = 1, help = "number of studies run in parallel (default: 1)")
+    parser.add_argument('--plot', action = 'store_true', help = "draw the plots of the pipeline")
+    parser.add_argument('--force', action = 'store_true', help = "ignore cached stages and run every stage")
+    parser.add_argument('--only', nargs = '+', metavar = 'NAME', help = "only run these studies")
+    parser.add_argument('--profile', action = 'store_true', help = "print the time spent in each stage")
+    parser.add_argument('-q', '--quiet', action = 'store_true', help = "only print warnings and errors")
+    args = parser.parse_args(argv)
+    kind = kind or args.kind
+
+    verbosity = logging.WARNING if args.quiet else logging.INFO
+    profiling.set_verbosity(verbosity)
+    studies = load_pipeline(args.pipeline)
+    if args.only:
+        studies = [study for study in studies if study['name'] in args.only]
+        if not studies:
+            parser.error("None of the studies %s are in %s" % (", ".join(args.only), args.pipeline))
+
+    if args.jobs > 1 and len(studies) > 1:
+        with ProcessPoolExecutor(max_workers = args.jobs) as executor:
+            results = list(executor.map(_run_study, [kind] * len(studies), studies, [args.force] * len(studies), [args.plot] * len(studies), [args.profile] * len(studies), [verbosity] * len(studies)))
+    else:
+        results = [_run_study(kind, study, args.force, args.plot, args.profile, verbosity) for study in studies]
+
+    failed = [name for name, error, summary in results if error]
+    for name, error, summary in results:
+        if summary is not None:
+            logger.info("Profile of %s:\n%s" % (name, summary.to_string()))
+    logger.info("%s of %s stud%s completed." % (len(results) - len(failed), len(results), "y" if len(results) == 1 else "ies"))
+    if failed:
+        logger.error("Failed: %s" % ", ".join(failed))
+        return 1
+    return 0
+
+def eeg_main():
+    sys.exit(main(kind = 'eeg'))
+
+def beh_main():
+    sys.exit(main(kind = 'beh'))
+
+if __name__ == '__main__':
+    sys.exit(main())
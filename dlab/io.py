@@ -1,26 +1,159 @@
 import os
+import re
+import time
+import glob
+import fnmatch
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from savReaderWriter import * 
 
-def import_from_excel(filename, sheetname):
+from dlab import profiling
+
+logger = logging.getLogger(__name__)
+
+#parsed Excel sheets, most recently used last
+_excel_cache = OrderedDict()
+_EXCEL_CACHE_SIZE = 32
+_EXCEL_CACHE_DIR = ".dlab_cache"
+
+def _excel_sidecar(path, sheetname, usecols, dtype):
+    """
+    Private function: returns the path of the pickle sidecar holding a parsed sheet. It is stored in a '.dlab_cache' folder next to the workbook.
+    """
+    name = hashlib.sha1(repr((path, sheetname, usecols, dtype)).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(os.path.dirname(path), _EXCEL_CACHE_DIR, "%s_%s.pkl" % (os.path.basename(path), name))
+
+def clear_excel_cache(filename = None):
+    """
+    Clears the sheets cached in memory by import_from_excel. If a filename is given, only its sheets are cleared and its sidecar files are deleted as well.
+
+    Optional Arguments:
+    filename (str) -- only clear the sheets of this .xlsx file. Default = None (all sheets cached in memory)
+    """
+    path = os.path.abspath(filename) if filename is not None else None
+    for key in list(_excel_cache):
+        if path is None or key[0] == path:
+            del _excel_cache[key]
+    if path is not None:
+        pattern = os.path.join(glob.escape(os.path.dirname(path)), _EXCEL_CACHE_DIR, glob.escape(os.path.basename(path)) + "_*.pkl")
+        for sidecar in glob.glob(pattern):
+            os.remove(sidecar)
+
+@profiling.instrument
+def import_from_excel(filename, sheetname, usecols = None, dtype = None, cache = True):
     """
     Imports data from an Excel FIle (.xlsx) into a pandas.DataFrame called 'xl'. 
 
+    Parsed sheets are cached in memory and in a sidecar file (in a '.dlab_cache' folder next to the workbook), so importing an unchanged workbook again does not parse it. The cache is keyed by the file's path, modification time and size, so edits to the workbook are picked up automatically.
+
     Required Arguments:
     filename (str) -- file name of .xlsx file to be imported as pandas.DataFrame.
     sheetname (str) -- name of the worksheet in the .xlsx file to be imported as pandas.DataFrame.
+
+    Optional Arguments:
+    usecols (list of str) -- only import these columns. Default = None (all columns)
+    dtype (dict) -- data types of the columns, e.g. {'PPT':str}. Default = None (inferred)
+    cache (bool) -- If False, the sheet is always parsed from the workbook and not cached. Default = True
     """
-    if os.path.isfile(filename):
-        xl = pd.ExcelFile(filename)
-    else:
+    if not os.path.isfile(filename):
         raise ValueError('Provided file "%s" cannot be found' % filename)
-    
-    if sheetname in xl.sheet_names:
-        return xl.parse(sheetname)
-    else:
-        raise ValueError('Provided sheet "%s" cannot be found' % sheetname)
 
-def export_to_excel(filename, dfs, output_sheet_names):
+    path = os.path.abspath(filename)
+    usecols = tuple(usecols) if isinstance(usecols, (list, tuple)) else usecols
+    dtype = tuple(sorted(dtype.items(), key = lambda item: str(item[0]))) if isinstance(dtype, dict) else dtype
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size, sheetname, usecols, dtype)
+
+    if cache:
+        if key in _excel_cache:
+            _excel_cache.move_to_end(key)
+            return _excel_cache[key].copy()
+        sidecar = _excel_sidecar(path, sheetname, usecols, dtype)
+        if os.path.isfile(sidecar):
+            try:
+                cached_key, df = pd.read_pickle(sidecar)
+            except Exception:
+                cached_key = None
+            if cached_key == key:
+                _excel_cache[key] = df
+                _excel_cache.move_to_end(key)
+                while len(_excel_cache) > _EXCEL_CACHE_SIZE:
+                    _excel_cache.popitem(last = False)
+                return df.copy()
+
+    with pd.ExcelFile(path) as xl:
+        if sheetname not in xl.sheet_names:
+            raise ValueError('Provided sheet "%s" cannot be found' % sheetname)
+        df = xl.parse(sheetname, usecols = list(usecols) if isinstance(usecols, tuple) else usecols, dtype = dict(dtype) if isinstance(dtype, tuple) else dtype)
+
+    if cache:
+        _excel_cache[key] = df
+        while len(_excel_cache) > _EXCEL_CACHE_SIZE:
+            _excel_cache.popitem(last = False)
+        try:
+            os.makedirs(os.path.dirname(sidecar), exist_ok = True)
+            pd.to_pickle((key, df), sidecar)
+        except OSError:
+            logger.warning("Could not write the cache file for sheet %s of %s. The sheet is only cached in memory." % (sheetname, filename))
+        return df.copy()
+    return df
+
+def _excel_locked(filename):
+    """
+    Private function: checks if an Excel file is open (locked) without writing to it. Excel keeps a '~$' owner file next to open workbooks and Windows refuses to open locked files for writing.
+    """
+    owner_file = os.path.join(os.path.dirname(filename), '~$' + os.path.basename(filename))
+    if os.path.exists(owner_file):
+        return True
+    if os.path.exists(filename):
+        try:
+            open(filename, 'r+b').close()
+        except PermissionError:
+            return True
+    return False
+
+def _write_sheet_streaming(workbook, df, sheet_name, chunksize = 10000):
+    """
+    Private function: writes a pandas object to a new sheet of an xlsxwriter.Workbook opened in constant_memory mode. Rows are written in order, chunksize rows at a time, so only the current row is kept in memory by the writer. The index is written in the first columns and each level of the column labels gets its own header row.
+    """
+    if isinstance(df, pd.Series):
+        df = df.to_frame()
+    worksheet = workbook.add_worksheet(sheet_name)
+    index_names = [name if name is not None else "" for name in df.index.names]
+    n_levels = df.columns.nlevels
+
+    for level in range(n_levels):
+        labels = df.columns.get_level_values(level)
+        worksheet.write_row(level, 0, (index_names if level == n_levels - 1 else [""] * len(index_names)) + [str(label) for label in labels])
+
+    row = n_levels
+    for start in range(0, len(df.index), chunksize):
+        chunk = df.iloc[start:start + chunksize].reset_index()
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        for values in chunk.itertuples(index = False, name = None):
+            worksheet.write_row(row, 0, values)
+            row += 1
+
+def _export_to_excel_streaming(filename, dfs, output_sheet_names):
+    """
+    Private function: writes all sheets to one workbook using the row streaming (constant_memory) mode of xlsxwriter. Defined at module level so that it can be run in a process pool.
+    """
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+    try:
+        for df, sheet_name in zip(dfs, output_sheet_names):
+            _write_sheet_streaming(workbook, df, sheet_name)
+    finally:
+        workbook.close()
+    return filename
+
+@profiling.instrument
+def export_to_excel(filename, dfs, output_sheet_names, streaming = False, n_jobs = 1):
     """
     Exports and saves the supplied pandas.DataFrame(s) to separate sheets in a single excel file (.xlsx).  This should be run at the end of a notebook.
     
@@ -28,8 +161,12 @@ def export_to_excel(filename, dfs, output_sheet_names):
     filename (str) -- file name of exported excel file. Must end with '.xlsx'
     dfs (list of pandas.DataFrame) -- pandas.DataFrame(s) to be exported to Excel provided as a [list]. To write multiple sheets in one Excel File, provide each DataFrame in the [list]. 
     output_sheet_names (list of str) -- Name of the sheet in the exported Excel file. For each DataFrame provided in 'dfs', a sheet name must also be supplied as a [list].
+
+    Optional Arguments:
+    streaming (bool) -- If True, rows are streamed to the file with the constant memory mode of xlsxwriter instead of building the whole workbook in memory. Recommended for large tables such as mean_amps. Default = False
+    n_jobs (int) -- Only used with streaming. If greater than 1, each sheet is written in parallel to its own file named '<filename>_<sheet name>.xlsx'. Default = 1
     """
-    print("If you are suppling a '.groupby' pandas object as a 'dfs', it is recommended that you use '.unstack' method on the object for this function.\n")
+    logger.info("If you are suppling a '.groupby' pandas object as a 'dfs', it is recommended that you use '.unstack' method on the object for this function.")
     if not filename.endswith('.xlsx'):
         raise ValueError("Provided filename (%s) does not contain an Excel extenstion (.xlsx)." % (filename))
     if type(dfs) != list or type(output_sheet_names) != list:
@@ -44,170 +181,522 @@ def export_to_excel(filename, dfs, output_sheet_names):
             raise ValueError("Invalid Output at position %s (starting count at 0). dfs must be a pandas object with the property 'to_excel'." % (i))
         else:
             continue
-    
+
     try:
-        try:
-            writer = pd.ExcelWriter(filename, engine = 'xlsxwriter')
-        except ModuleNotFoundError:
-            print("You need to install module xlsxwriter to be able to write excel files.")
-        writer.save()
-    except PermissionError:
-        print("ERROR: Can't save the file while it is open. Please CLOSE the file and run again.")
+        import xlsxwriter
+    except ModuleNotFoundError:
+        logger.error("You need to install module xlsxwriter to be able to write excel files.")
+        return
+
+    if streaming and n_jobs > 1 and len(dfs) > 1:
+        filenames = ["%s_%s.xlsx" % (filename[:-5], sheet_name) for sheet_name in output_sheet_names]
     else:
-        writer = pd.ExcelWriter(filename, engine = 'xlsxwriter')
-        for i in range(len(dfs)):
-            dfs[i].to_excel(writer,sheet_name=output_sheet_names[i])
-            print("Writing DataFrame for Sheet: %s" % (output_sheet_names[i]))
-        writer.save()
-        print('Successfully wrote DataFrames to Excel file called: %s' % (filename))
-    finally:
-        writer.close()
+        filenames = [filename]
+    if any(_excel_locked(f) for f in filenames):
+        logger.error("ERROR: Can't save the file while it is open. Please CLOSE the file and run again.")
+        return
+
+    if streaming and len(filenames) > 1:
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            for f in executor.map(_export_to_excel_streaming, filenames, [[df] for df in dfs], [[sheet_name] for sheet_name in output_sheet_names]):
+                logger.info("Successfully wrote DataFrame to Excel file called: %s" % (f))
+    elif streaming:
+        _export_to_excel_streaming(filename, dfs, output_sheet_names)
+        logger.info('Successfully wrote DataFrames to Excel file called: %s' % (filename))
+    else:
+        with pd.ExcelWriter(filename, engine = 'xlsxwriter') as writer:
+            for i in range(len(dfs)):
+                dfs[i].to_excel(writer,sheet_name=output_sheet_names[i])
+                logger.info("Writing DataFrame for Sheet: %s" % (output_sheet_names[i]))
+        logger.info('Successfully wrote DataFrames to Excel file called: %s' % (filename))
+
+#keywords that SPSS does not accept as variable names
+_SPSS_RESERVED = ['ALL', 'AND', 'BY', 'EQ', 'GE', 'GT', 'LE', 'LT', 'NE', 'NOT', 'OR', 'TO', 'WITH']
+
+def _spss_name(name):
+    """
+    Private function: converts a column label to a valid SPSS variable name (starts with a letter, only letters, digits and '_', at most 64 characters).
+    """
+    if isinstance(name, tuple):
+        name = "_".join(str(part) for part in name)
+    name = re.sub(r'\W', '_', str(name))
+    if not name[:1].isalpha():
+        name = 'v' + name
+    if name.upper() in _SPSS_RESERVED:
+        name += '_'
+    return name[:64]
+
+def _spss_names(columns):
+    """
+    Private function: converts the column labels to unique SPSS variable names (see _spss_name). SPSS names are not case sensitive, so labels that only differ by case or by the characters replaced with '_' (e.g. 'Fz-Cz' and 'Fz_Cz'), or that share their first 64 characters, would get the same name: a numeric suffix is added to the later ones (e.g. 'Fz_Cz_2').
+    """
+    names, used = [], set()
+    for column in columns:
+        name = base = _spss_name(column)
+        suffix = 1
+        while name.upper() in used:
+            suffix += 1
+            name = base[:64 - len(str(suffix)) - 1] + '_%s' % suffix
+        if name != base:
+            logger.warning("Column %s was renamed to %s in the SPSS file to keep variable names unique." % (column, name))
+        names.append(name)
+        used.add(name.upper())
+    if len(used) != len(names):
+        raise ValueError("Could not make the SPSS variable names unique: %s" % ", ".join(names))
+    return names
+
+def _spss_types(df):
+    """
+    Private function: infers the SPSS type of every column of df. Numeric (and bool) columns are 0, any other column is a string whose width is the longest value in bytes (utf-8).
+    """
+    varTypes = []
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(df[column]) or pd.api.types.is_bool_dtype(df[column]):
+            varTypes.append(0)
+        else:
+            widths = df[column].dropna().astype(str).str.encode('utf-8').str.len()
+            varTypes.append(max(int(widths.max()) if len(widths) else 1, 1))
+    return varTypes
 
-def export_to_spss(filename, df, reset_index = False, DataType = 0, measure = 'scale', column_width = 8, align = 'right'):
+@profiling.instrument
+def export_to_spss(filename, df, reset_index = False, DataType = None, measure = 'scale', column_width = 8, align = 'right', chunksize = 10000, wide = False, values = 'Mean Amplitude'):
     """
     Exports and saves the supplied pandas.DataFrame to a single SPSS data file (.sav).  This should be run at the end of a notebook.
 
+    Rows are written in blocks of 'chunksize' rows, so only one block is converted at a time.
+
     Required Arguments:
     filename (str)  -- file name of exported SPSS file. Must end with '.sav'
     df (pandas.DataFrame) -- pandas.DataFrame to be loaded into SPSS
 
     Optional Arguments:
     reset_index (bool) -- resets the index and adds it to the SPSS data file as a column. Useful in PPT is an index.  default = False (bool)
-    DataType (int) -- Type of data (defined in Variable view of SPSS), default = 0 (Numerical)
-    measure (str) -- Sets measure of data (defined in Variable view of SPSS), default = 'scale'
+    DataType (int) -- Type of data (defined in Variable view of SPSS) used for every column. If None, the type is inferred per column: 0 (Numerical) for numeric columns and a string of the longest value's width otherwise. default = None
+    measure (str) -- Sets measure of the numeric data (defined in Variable view of SPSS), string columns are always 'nominal'. default = 'scale'
     column_width (int) -- Sets width of data column (defined in Variable view of SPSS), default = 8
     align (str) -- Sets cell alignment for data column (defined in Variable view of SPSS), default = 'right'
+    chunksize (int) -- Number of rows written at a time. default = 10000
+    wide (bool) -- If True, df is expected to be EEG.Project.mean_amps and is pivoted to one row per PPT and one column per Label (the usual layout for repeated measures in SPSS). default = False
+    values (str) -- Column holding the values of the wide table. Only used when wide = True. default = 'Mean Amplitude'
     """
-    print("If you are suppling a '.groupby' pandas object as an 'dfs', it is recommended that you use '.unstack' method on the object for this function.\n")
+    logger.info("If you are suppling a '.groupby' pandas object as an 'dfs', it is recommended that you use '.unstack' method on the object for this function.")
     if not filename.endswith(".sav"):
         filename += ".sav"
-        print("'filename' argument did not contain *.sav extension. 'filename' has been modified to: %s \n" % (filename))
+        logger.info("'filename' argument did not contain *.sav extension. 'filename' has been modified to: %s" % (filename))
+    if wide:
+        if "PPT" not in df.columns:
+            df = df.reset_index()
+        missing = [column for column in ["PPT", "Label", values] if column not in df.columns]
+        if missing:
+            raise ValueError("Cannot pivot df to the wide format. Column(s) %s not found." % (", ".join(missing)))
+        df = df.pivot_table(index = "PPT", columns = "Label", values = values, sort = False)
+        df.columns.name = None
+        reset_index = True
+        logger.info("Pivoted df to wide format: %s PPTs x %s Labels." % (df.shape[0], df.shape[1]))
     if reset_index:
         df = df.reset_index()
-        print("Adding index as column to df.")
+        logger.info("Adding index as column to df.")
     else:
-        print("reset_index set to False. Index column will not be included in output.")
+        logger.info("reset_index set to False. Index column will not be included in output.")
     
-    varNames = list(df.columns)
+    varNames = _spss_names(df.columns)
+    if DataType is None:
+        types = _spss_types(df)
+    else:
+        types = [DataType] * len(varNames)
     varTypes = {}
     measureLevels = {}
     columnWidths = {}
     alignments = {}
-    for var in varNames:
-        varTypes.update({var:DataType})
-        measureLevels.update({var:measure})
+    for var, varType in zip(varNames, types):
+        varTypes.update({var:varType})
+        measureLevels.update({var:measure if varType == 0 else 'nominal'})
         columnWidths.update({var:column_width})
         alignments.update({var:align})
+    numeric = [varType == 0 for varType in types]
 
+    start_time = time.perf_counter()
     try:
-        with SavWriter(filename, varNames, varTypes, ioUtf8 = True, measureLevels = measureLevels) as writer:
-            writer.writerows(df)
-    except:
-        raise ValueError("ERROR: Something went wrong. Check if the file is open.")
+        with SavWriter(filename, varNames, varTypes, ioUtf8 = True, measureLevels = measureLevels, columnWidths = columnWidths, alignments = alignments) as writer:
+            for start in range(0, len(df.index), chunksize):
+                chunk = df.iloc[start:start + chunksize]
+                block = []
+                for column, is_numeric in zip(chunk.columns, numeric):
+                    if is_numeric:
+                        #SPSS system missing values are written as None
+                        column_values = chunk[column].to_numpy(dtype = 'float64', na_value = float('nan'))
+                        column_values = column_values.astype(object)
+                        column_values[column_values != column_values] = None
+                    else:
+                        column_values = chunk[column].astype(object).where(chunk[column].notna(), "").astype(str).to_numpy(dtype = object)
+                    block.append(column_values)
+                writer.writerows(np.column_stack(block).tolist())
+    except Exception as error:
+        raise ValueError("ERROR: Something went wrong. Check if the file is open.") from error
     else:
-        print('\nSuccessfully wrote DataFrame to SPSS file called: %s' % (filename))
+        elapsed = time.perf_counter() - start_time
+        profiling.set_rows(len(df.index))
+        logger.info('Successfully wrote DataFrame to SPSS file called: %s (%s rows in %.2f s, %.0f rows/s)' % (filename, len(df.index), elapsed, len(df.index) / max(elapsed, 1e-9)))
 
-def import_from_eprime(raw_dir, formatted_dir, merged_output_name="", encoding = "UTF-16"):
+#lines starting with a drive letter hold the path of the .edat file at the top of Eprime exports
+_EPRIME_DRIVES = tuple(drive + ":" for drive in ['C','D','E','F','G','H'])
+#removes '[' and ']' and replaces '.' with '_' in Eprime headers
+_EPRIME_HEADER_TRANSLATION = str.maketrans({'[':None, ']':None, '.':'_'})
+
+def _load_eprime(raw_dir, filename, encoding = "UTF-16"):
     """
-    Imports data from all behavioural Eprime Excel formatted data files (.txt) in a specific directory. The data is then merged into one file (.txt) that can be imported into Project.data.
-    
+    Private function: loads and cleans a single Eprime Excel formatted data file (.txt). Defined at module level so that it can be run in a process pool by import_from_eprime.
+
+    Returns the cleaned pandas.DataFrame and a dict of diagnostics for the file.
+    """
+    raw_file = raw_dir + os.sep + filename
+    diagnostics = {'File':filename, 'Status':'ok', 'Skipped Lines':0, 'Records':0, 'Columns':0, 'Dropped Columns':'', 'Study List Column':'', 'Session Date':'', 'Message':''}
+
+    #read the preamble and the header from the top of the stream, then hand the rest of the same stream to pandas
+    with open(raw_file, 'r', encoding = encoding) as tsv:
+        line = tsv.readline()
+        skip = 0
+        if line.startswith(_EPRIME_DRIVES):
+            line = tsv.readline()
+            skip = 1
+            if line.startswith("This file"):
+                line = tsv.readline()
+                skip = 2
+        diagnostics['Skipped Lines'] = skip
+
+        header = line.rstrip('\n').translate(_EPRIME_HEADER_TRANSLATION).split("\t")
+        df = pd.read_csv(tsv, delimiter = '\t', names = header, header = None)
+
+    #Clean up: Random Seed, Session Time UTC, resolving study list issue and session date issue
+    if 'RandomSeed' not in df.columns:
+        diagnostics['Message'] = "No RandomSeed columnn found. Check file to make sure there are no errors."
+    dropped = [column for column in ['RandomSeed', 'SessionTimeUtc', 'SessionTime'] if column in df.columns]
+    diagnostics['Dropped Columns'] = ", ".join(dropped)
+        
+    df['SourceFile'] = filename
+    for studylist in ['A','B','C','D','E','F']:
+        studylist = "StudyList" + studylist
+        if studylist in df.columns:
+            df['StudyList'] = df[studylist]
+            dropped.append(studylist)
+            diagnostics['Study List Column'] = studylist
+            break
+        else:
+            continue
+
+    if 'SessionDate' in df.columns:
+        #split each distinct date once and broadcast the parts back to the records
+        codes, dates = pd.factorize(df['SessionDate'].astype(str))
+        date = pd.Series(dates).str.split(r'[-/]', n = 2, expand = True).reindex(columns = [0, 1, 2])
+        df['Month'], df['Day'], df['Year'] = [date[part].take(codes).set_axis(df.index) for part in [0, 1, 2]]
+        diagnostics['Session Date'] = dates[0] if len(dates) else ''
+        dropped.append('SessionDate')
+
+    df = df.drop(columns = dropped)
+    diagnostics['Records'], diagnostics['Columns'] = len(df.index), len(df.columns)
+    return df, diagnostics
+
+def _try_load_eprime(raw_dir, filename, encoding = "UTF-16"):
+    """
+    Private function: runs _load_eprime and records any error in the diagnostics instead of raising it, so one bad file does not stop a parallel import.
+    """
+    try:
+        return _load_eprime(raw_dir, filename, encoding)
+    except Exception as e:
+        return None, {'File':filename, 'Status':'failed', 'Message':"%s: %s" % (type(e).__name__, e)}
+
+def _eprime_filenames(raw_dir, include = None, exclude = None, skip_recovery = True):
+    """
+    Private function: lists the Eprime data files (.txt) in raw_dir in sorted order, applying the file name filters of iter_eprime.
+    """
+    include = [include] if isinstance(include, str) else include
+    exclude = [exclude] if isinstance(exclude, str) else (exclude or [])
+    filenames = []
+    recovered = []
+    for raw_file in sorted(os.fsdecode(raw_file) for raw_file in os.listdir(raw_dir)):
+        if not raw_file.endswith(".txt"):
+            continue
+        if skip_recovery and "recover" in raw_file.lower():
+            recovered.append(raw_file)
+            continue
+        if include is not None and not any(fnmatch.fnmatch(raw_file, pattern) for pattern in include):
+            continue
+        if any(fnmatch.fnmatch(raw_file, pattern) for pattern in exclude):
+            continue
+        filenames.append(raw_file)
+    if recovered:
+        logger.info("Skipping E-Recovery file(s): %s" % ", ".join(recovered))
+    return filenames
+
+def iter_eprime(raw_dir, encoding = "UTF-16", include = None, exclude = None, skip_recovery = True, filenames = None):
+    """
+    Loads the behavioural Eprime Excel formatted data files (.txt) in a specific directory one at a time. For each file, yields a tuple of (file name, cleaned pandas.DataFrame, diagnostics dict). Only one file is held in memory at a time, so per participant steps (e.g. filtering or validation) can be chained on the generator. Nothing is written to disk.
+
+    If a file cannot be loaded, the DataFrame is None and the error is in diagnostics['Message'].
+
     Required Arguments:
-    raw_dir (str) -- File path of the folder with the Eprime (.txt) files to be imported as pandas.DataFrame.
-    formatted_dir (str) -- File path of the folder to put the formatted files output the formatted.
-    merged_output_name (str) -- Name of the output merged file (.txt).
-    
+    raw_dir (str) -- File path of the folder with the Eprime (.txt) files.
+
     Optional Arguments:
     encoding (str) -- Encoding to use when python opens the Eprime files (.txt). Default encoding for Eprime 2.0 is UTF-16. Default = 'UTF-16'
+    include (str or list of str) -- only load files whose name matches one of these patterns (e.g. 'PPT1*.txt'). Default = None (all files)
+    exclude (str or list of str) -- skip files whose name matches one of these patterns. Default = None
+    skip_recovery (bool) -- skip files recovered with E-Recovery (file name contains 'recover'). Default = True
+    filenames (list of str) -- load these files of raw_dir instead of listing the directory. The filters are not applied. Default = None
+    """
+    if not os.path.exists(raw_dir):
+        raise ValueError("Provided raw directory: '%s' does not exist." % raw_dir)
+    if filenames is None:
+        filenames = _eprime_filenames(raw_dir, include, exclude, skip_recovery)
+    for filename in filenames:
+        with profiling.stage('io.iter_eprime.file') as record:
+            df, diagnostics = _try_load_eprime(raw_dir, filename, encoding)
+            record['rows'] = diagnostics.get('Records')
+        yield filename, df, diagnostics
+
+def _file_hash(path, block_size = 1 << 20):
     """
-    def __load_eprime(filename):
-        def check(line):
-            for drive in ['C','D','E','F','G','H']:
-                drive += ":"
-                if line.startswith(drive):
-                    return True
+    Private function: returns the sha1 hash of a file's contents.
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def _eprime_changes(raw_dir, filenames, manifest):
+    """
+    Private function: compares the files in raw_dir to the manifest of a previous import. Files with a new size or modification time are hashed to check whether their contents changed.
+
+    Returns the updated manifest (without parsed record counts for new/changed files), and lists of new, changed and removed files.
+    """
+    previous = manifest.set_index('File') if manifest is not None else pd.DataFrame(columns = ['Size', 'Mtime', 'Hash', 'Records'])
+    rows, new, changed = [], [], []
+    for filename in filenames:
+        stat = os.stat(raw_dir + os.sep + filename)
+        row = {'File':filename, 'Size':stat.st_size, 'Mtime':stat.st_mtime, 'Hash':None, 'Records':None}
+        if filename in previous.index:
+            old = previous.loc[filename]
+            if old['Size'] == row['Size'] and old['Mtime'] == row['Mtime']:
+                row['Hash'], row['Records'] = old['Hash'], old['Records']
             else:
-                return False
-            
-        raw_file = raw_dir + os.sep + filename
-        print("\nLoading %s..." % filename)
-        
-        #find where header starts
-        with open(raw_file, 'r', encoding = encoding) as tsv:
-            for line in tsv:
-                if check(line):
-                    if next(tsv).startswith("This file"):
-                        print("Removing top two lines.")
-                        skip = 2
-                        break
-                    else:
-                        skip = 1
-                        print("Removing top line.")
-                        break
-                else:
-                    print("Not removing any lines.")
-                    skip = 0
-                    break
-                
-        #need to reopen or loop will start where we left off before
-        #obtain header as an array for pandas
-        with open(raw_file, 'r', encoding = encoding) as tsv:
-            i = 0
-            for line in tsv:
-                if i == skip:
-                    header = line.replace('[',"").replace(']',"").replace('.','_').replace('\n',"").split("\t")
-                    print("Removed '[', ']' , '.', and '\\n' from Headers.")
-                    break
+                row['Hash'] = _file_hash(raw_dir + os.sep + filename)
+                if row['Hash'] == old['Hash']:
+                    row['Records'] = old['Records']
                 else:
-                    i += 1
+                    changed.append(filename)
+        else:
+            row['Hash'] = _file_hash(raw_dir + os.sep + filename)
+            new.append(filename)
+        rows.append(row)
+    removed = [filename for filename in previous.index if filename not in filenames]
+    return pd.DataFrame(rows, columns = ['File', 'Size', 'Mtime', 'Hash', 'Records']), new, changed, removed
 
-        #load in pandas
-        df = pd.read_csv(raw_file, delimiter='\t',encoding=encoding,skiprows=skip + 1, names = header)
+#columns that _load_eprime keeps as text (the parts of the session date, e.g. '03')
+_EPRIME_TEXT_COLUMNS = ['Month', 'Day', 'Year']
 
-        #Clean up: Random Seed, Session Time UTC, resolving study list issue and session date issue
-        if 'RandomSeed' in df.columns:
-            df = df.drop(columns = "RandomSeed")
-            print("Found and dropped RandomSeed column.")
-                
+def _read_merged_eprime(merged_file):
+    """
+    Private function: reads the merged output (.txt) of import_from_eprime with the same types as _load_eprime, so that the records read back match the records of a new import.
+    """
+    return pd.read_csv(merged_file, sep = '\t', dtype = dict.fromkeys(_EPRIME_TEXT_COLUMNS, str))
+
+#column types used for the columnar (parquet) output of import_from_eprime. Keys are column names or patterns: Eprime names RT columns after their procedure (e.g. Stimulus.RT, read as Stimulus_RT). Columns not listed keep the types inferred by pandas
+eprime_schema = {'Condition':'category',
+                 'Item':'category',
+                 'StudyList':'category',
+                 'SourceFile':'category',
+                 'RT':'Int64',
+                 '*_RT':'Int64',
+                 'WordPos':'Int64',
+                 'Month':'Int16',
+                 'Day':'Int16',
+                 'Year':'Int16'}
+
+def _apply_schema(df, schema):
+    """
+    Private function: casts the columns of df found in schema to their types. A column takes the type of its name if it is a key of schema, otherwise the type of the first key it matches as a pattern (e.g. '*_RT'). Columns cast to integer types are parsed as numbers first; values that cannot be parsed become missing (<NA>).
+    """
+    for column in df.columns:
+        dtype = schema.get(column)
+        if dtype is None:
+            dtype = next((dtype for pattern, dtype in schema.items() if fnmatch.fnmatchcase(column, pattern)), None)
+        if dtype is None:
+            continue
+        if dtype == 'category':
+            df[column] = df[column].astype('category')
         else:
-            print("No RandomSeed columnn found. Check file to make sure there are no errors.")
+            values = pd.to_numeric(df[column], errors = 'coerce')
+            try:
+                df[column] = values.astype(dtype)
+            except (TypeError, ValueError):
+                logger.warning("Column %s of %s could not be cast to %s and was kept as %s." % (column, df['SourceFile'].iloc[0] if 'SourceFile' in df.columns and len(df.index) else 'file', dtype, values.dtype))
+                df[column] = values
+    return df
 
-        if 'SessionTimeUtc' in df.columns:
-            df = df.drop(columns = "SessionTimeUtc")
-            print("Found and dropped SessionTimeUtc column.")
-        
-        if 'SessionTime' in df.columns:
-            df = df.drop(columns = "SessionTime")
-            print("Found and dropped SessionTime column.")            
-            
-        df['SourceFile'] = filename
-        for studylist in ['A','B','C','D','E','F']:
-            studylist = "StudyList" + studylist
-            if studylist in df.columns:
-                df['StudyList'] = df[studylist]
-                df= df.drop(columns = studylist)
-                print('Found study list column: %s. Passed this column to "StudyList" and dropped.' % studylist)
-                break
-            else:
+def _check_pyarrow():
+    try:
+        import pyarrow
+    except ModuleNotFoundError:
+        raise ModuleNotFoundError("You need to install module pyarrow to be able to read and write parquet files.")
+
+def _session_dates(df):
+    """
+    Private function: parses the session date of each record from the Month, Day and Year columns. Dates that cannot be parsed are missing (NaT).
+    """
+    parts = df[['Year', 'Month', 'Day']].apply(pd.to_numeric, errors = 'coerce').astype('float64')
+    return pd.to_datetime(parts.rename(columns = str.lower), errors = 'coerce')
+
+def _parquet_parts(dataset, stem = None):
+    """
+    Private function: lists the part files of a parquet dataset written by _write_eprime_parquet. If stem is given, only the part files of that source file are listed.
+    """
+    return glob.glob(os.path.join(glob.escape(dataset), '*=*', '*.parquet' if stem is None else glob.escape(stem) + '.parquet'))
+
+def _write_dataset_schema(dataset):
+    """
+    Private function: writes the schema shared by all part files of a parquet dataset to dataset/_common_metadata. Part files are written one source file at a time, so they do not all have the same columns: the shared schema holds the union of their columns (and the partition column) and is used by import_from_parquet so that columns found in only some files are not dropped. Columns with incompatible types in different files are read as text.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    fields, columns = OrderedDict(), OrderedDict()
+    for part in sorted(_parquet_parts(dataset)):
+        part_schema = pq.read_schema(part)
+        for field in part_schema:
+            if field.name not in fields:
+                fields[field.name] = field
                 continue
-        else:
-            print('Did not find a study list column.')
-
-        if 'SessionDate' in df.columns:
-            date = df['SessionDate'].unique()[0]
-            if '-' in date:
-                delimiter = '-'
-            elif '/' in date:
-                delimiter = '/'
-                
-            date = date.split(delimiter)
-            df['Month'] = date[0]
-            df['Day'] = date[1]
-            df['Year'] = date[2]
-            df = df.drop(columns = 'SessionDate')
-            print("Found and dropped SessionDate column. Split into 'Month', 'Day', and 'Year' columns.")
+            try:
+                fields[field.name] = pa.unify_schemas([pa.schema([fields[field.name]]), pa.schema([field])], promote_options = 'permissive').field(0)
+            except (pa.ArrowTypeError, pa.ArrowInvalid):
+                logger.warning("Column %s has incompatible types (%s and %s) in %s. It will be read as text." % (field.name, fields[field.name].type, field.type, dataset))
+                fields[field.name] = pa.field(field.name, pa.large_string())
+        #keep the pandas metadata (e.g. nullable integer types) of every column
+        if part_schema.metadata and b'pandas' in part_schema.metadata:
+            metadata = json.loads(part_schema.metadata[b'pandas'])
+            for column in metadata['columns']:
+                columns.setdefault(column['name'], column)
+
+    common_metadata = os.path.join(dataset, '_common_metadata')
+    if not fields:
+        if os.path.isfile(common_metadata):
+            os.remove(common_metadata)
+        return
+    for field in ds.dataset(dataset, format = 'parquet', partitioning = 'hive').partitioning.schema:
+        fields.setdefault(field.name, field)
+    schema = pa.schema(list(fields.values()))
+    if columns:
+        metadata['columns'] = list(columns.values())
+        schema = schema.with_metadata({b'pandas':json.dumps(metadata).encode()})
+    pq.write_metadata(schema, common_metadata)
 
+def _write_eprime_parquet(dataset, dfs, ppt_column, schema, replace = None):
+    """
+    Private function: writes each imported file to dataset/<ppt_column>=<ppt>/<file name>.parquet and updates the shared schema of the dataset. Part files of the files in replace are deleted first. If replace is None, all existing part files are deleted.
+    """
+    old_parts = _parquet_parts(dataset) if replace is None else [part for filename in replace for part in _parquet_parts(dataset, os.path.splitext(filename)[0])]
+    for part in old_parts:
+        os.remove(part)
+
+    for df in dfs:
+        if ppt_column not in df.columns:
+            raise ValueError("Provided ppt_column: %s was not found in %s" % (ppt_column, df['SourceFile'].iloc[0]))
+        stem = os.path.splitext(df['SourceFile'].iloc[0])[0]
+        df = _apply_schema(df, schema)
+        if all(column in df.columns for column in ['Year', 'Month', 'Day']):
+            df['SessionDate'] = _session_dates(df)
+        for ppt, records in df.groupby(ppt_column, sort = False):
+            path = os.path.join(dataset, "%s=%s" % (ppt_column, ppt))
+            if not os.path.exists(path):
+                os.makedirs(path)
+            records.drop(columns = ppt_column).to_parquet(os.path.join(path, stem + '.parquet'), index = False, compression = 'zstd')
+    _write_dataset_schema(dataset)
+
+@profiling.instrument
+def import_from_parquet(path, columns = None, ppts = None):
+    """
+    Imports the columnar (parquet) output of import_from_eprime(..., output_format = 'parquet') into a pandas.DataFrame. Only the requested columns and participants are read from disk.
+
+    Required Arguments:
+    path (str) -- path of the '.parquet' folder written by import_from_eprime.
+
+    Optional Arguments:
+    columns (list of str or None) -- columns to be read. If None, all columns are read. Default = None
+    ppts (list or None) -- participants to be read (values of the ppt_column used when importing). If None, all participants are read. Default = None
+    """
+    _check_pyarrow()
+    if not os.path.isdir(path):
+        raise ValueError('Provided folder "%s" cannot be found' % path)
+
+    partitions = [name for name in os.listdir(path) if "=" in name]
+    if not partitions:
+        return pd.DataFrame(columns = columns)
+    ppt_column = partitions[0].split("=")[0]
+
+    filters = None
+    if ppts is not None:
+        if not isinstance(ppts, list):
+            raise TypeError("Provided ppts of type: %s is invalid. Provide a list of participants." % type(ppts))
+        filters = [(ppt_column, 'in', ppts)]
+    if columns is not None and ppt_column not in columns:
+        columns = list(columns) + [ppt_column]
+    #shared schema of the part files, see _write_dataset_schema
+    schema = None
+    if os.path.isfile(os.path.join(path, '_common_metadata')):
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(os.path.join(path, '_common_metadata'))
+    df = pd.read_parquet(path, columns = columns, filters = filters, schema = schema)
+    return _restore_types(df, schema)
+
+def _restore_types(df, schema):
+    """
+    Private function: casts the columns of a DataFrame read from a parquet dataset back to the types they were written with, as recorded in the pandas metadata of schema (see _write_dataset_schema). Parquet only keeps categories of text, and nullable integers of columns missing from some files are read as floats, so category and nullable types are restored here.
+    """
+    if schema is None or not schema.metadata or b'pandas' not in schema.metadata:
         return df
+    for column in json.loads(schema.metadata[b'pandas'])['columns']:
+        name = column['name']
+        if name not in df.columns:
+            continue
+        if column['pandas_type'] == 'categorical':
+            dtype = 'category'
+        elif str(column['numpy_type']).startswith(('Int', 'UInt', 'Float', 'boolean')):
+            dtype = column['numpy_type']
+        else:
+            continue
+        if df[name].dtype != dtype:
+            try:
+                df[name] = df[name].astype(dtype)
+            except (TypeError, ValueError):
+                #e.g. a column read as text because its types differ between files
+                logger.warning("Column %s could not be restored to %s and was kept as %s." % (name, dtype, df[name].dtype))
+    return df
+
+@profiling.instrument
+def import_from_eprime(raw_dir, formatted_dir, merged_output_name="", encoding = "UTF-16", n_jobs = 1, return_diagnostics = False, incremental = False, output_format = 'txt', ppt_column = 'Subject', schema = None, include = None, exclude = None, skip_recovery = True, return_merged = True):
+    """
+    Imports data from all behavioural Eprime Excel formatted data files (.txt) in a specific directory. The data is then merged into one file (.txt) that can be imported into Project.data.
+    
+    Required Arguments:
+    raw_dir (str) -- File path of the folder with the Eprime (.txt) files to be imported as pandas.DataFrame.
+    formatted_dir (str) -- File path of the folder to put the formatted files output the formatted.
+    merged_output_name (str) -- Name of the output merged file (.txt).
     
+    Optional Arguments:
+    encoding (str) -- Encoding to use when python opens the Eprime files (.txt). Default encoding for Eprime 2.0 is UTF-16. Default = 'UTF-16'
+    n_jobs (int) -- Number of processes used to parse the files in parallel. Default = 1
+    return_diagnostics (bool) -- If True, returns (merged pandas.DataFrame, diagnostics) where diagnostics is a pandas.DataFrame with one row per file (skipped lines, records, columns, dropped columns, study list column, session date, status and messages). Default = False
+    incremental (bool) -- If True, a manifest of imported files (name, size, modification time, hash) is kept next to the merged output as '<merged_output_name>_manifest.csv'. Only new or changed files are parsed: records of new files are appended to the merged output and records of changed or deleted files are replaced. Records of changed files that cannot be parsed are kept and the files are retried on the next import. Default = False
+    output_format (str, either: 'txt' or 'parquet') -- 'txt' writes a merged tab separated file (.txt). 'parquet' writes a compressed columnar dataset to the folder '<merged_output_name>.parquet' with one partition per participant, typed columns (see schema) and a SessionDate column (datetime) parsed from Month, Day and Year. It can be loaded quickly with io.import_from_parquet; columns found in only some of the files are kept (missing in the other files). Requires pyarrow. Default = 'txt'
+    ppt_column (str) -- column identifying participants, used to partition the parquet output. Default = 'Subject'
+    schema (dict or None) -- column name or pattern (e.g. '*_RT'): type for the parquet output. If None, io.eprime_schema is used (categories for Condition, Item, StudyList and SourceFile, integers for RT and *_RT columns, WordPos, Month, Day and Year). The types are restored by io.import_from_parquet. Default = None
+    include (str or list of str) -- only import files whose name matches one of these patterns (e.g. 'PPT1*.txt'). Default = None (all files)
+    exclude (str or list of str) -- skip files whose name matches one of these patterns. Default = None
+    skip_recovery (bool) -- skip files recovered with E-Recovery (file name contains 'recover'). Default = True
+    return_merged (bool) -- only used with incremental = True. If True, the returned DataFrame is read back from the merged output. If False, only the records of the files parsed in this import are returned, which avoids reading the whole merged output on every import. Default = True
+    """
     #Check if raw_dir exists
     if not os.path.exists(raw_dir):
         raise ValueError("Provided raw directory: '%s' does not exist." % raw_dir)
@@ -216,13 +705,87 @@ def import_from_eprime(raw_dir, formatted_dir, merged_output_name="", encoding =
     if not os.path.exists(formatted_dir):
         raise ValueError("Provided formatted directory: '%s' does not exist." % formatted_dir)
 
-    print("MAKE SURE E-RECOVERY FILES ARE NOT INCLUDED IN RAW PPT FILES DIRECTORY!!!!!!!!!\n")
+    if output_format not in ['txt', 'parquet']:
+        raise ValueError("Provided output_format: %s is invalid. Please provide 'txt' or 'parquet'" % output_format)
+    if output_format == 'parquet':
+        _check_pyarrow()
+        if schema is None:
+            schema = eprime_schema
+        elif not isinstance(schema, dict):
+            raise TypeError("Provided schema of type: %s is invalid. Provide a dict of column name: type." % type(schema))
+
+    filenames = _eprime_filenames(raw_dir, include, exclude, skip_recovery)
+    merged_file = formatted_dir + os.sep + merged_output_name + ('.txt' if output_format == 'txt' else '.parquet')
+    manifest_file = formatted_dir + os.sep + merged_output_name + '_manifest.csv'
+
+    manifest, previous_manifest, new, changed, removed = None, None, filenames, [], []
+    previous = incremental and os.path.isfile(manifest_file) and os.path.exists(merged_file)
+    if incremental:
+        if previous:
+            previous_manifest = pd.read_csv(manifest_file, dtype = {'File':str, 'Hash':str})
+        else:
+            logger.info("No previous import found in %s. Importing all files." % formatted_dir)
+        manifest, new, changed, removed = _eprime_changes(raw_dir, filenames, previous_manifest)
+        logger.info("%s new, %s changed, %s removed and %s unchanged file(s)." % (len(new), len(changed), len(removed), len(filenames) - len(new) - len(changed)))
+
+    to_load = new + changed
+    if n_jobs > 1 and len(to_load) > 1:
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            results = list(executor.map(_try_load_eprime, [raw_dir] * len(to_load), to_load, [encoding] * len(to_load)))
+    else:
+        results = [(df, diagnostics) for filename, df, diagnostics in iter_eprime(raw_dir, encoding, filenames = to_load)]
+
+    dfs = [df for df, diagnostics in results if df is not None]
+    diagnostics = [diagnostics for df, diagnostics in results]
+    if incremental:
+        diagnostics += [{'File':filename, 'Status':'unchanged'} for filename in filenames if filename not in to_load]
+    diagnostics = pd.DataFrame(diagnostics, columns = ['File', 'Status', 'Skipped Lines', 'Records', 'Columns', 'Dropped Columns', 'Study List Column', 'Session Date', 'Message'])
+    df = pd.concat(dfs, ignore_index = True, sort = False) if dfs else pd.DataFrame()
+
+    logger.info("Successfully loaded %s of %s file(s) with %s records." % (len(dfs), len(to_load), len(df.index)))
+    failed = diagnostics[diagnostics['Status'] == 'failed']
+    if len(failed.index):
+        logger.warning("The following file(s) could not be loaded: %s. See the diagnostics for details." % ", ".join(failed['File']))
+
+    if incremental:
+        loaded = manifest['File'].isin(diagnostics.loc[diagnostics['Status'] == 'ok', 'File'])
+        manifest.loc[loaded, 'Records'] = manifest.loc[loaded, 'File'].map(diagnostics.set_index('File')['Records'])
+
+    #records of changed files that failed to load are kept until the file can be parsed
+    replace = [filename for filename in changed if filename not in failed['File'].values] + removed
+    read_back = not incremental or return_merged
+    if output_format == 'parquet':
+        _write_eprime_parquet(merged_file, dfs, ppt_column, schema, replace = replace if previous else None)
+        if read_back:
+            df = import_from_parquet(merged_file)
+    elif not previous:
+        df.to_csv(merged_file, sep='\t',index=False)
+    else:
+        header = pd.read_csv(merged_file, sep = '\t', nrows = 0).columns
+        if not replace and len(header) and all(column in header for column in df.columns):
+            #only new files: append their records in the column order of the merged output
+            if len(df.index):
+                df.reindex(columns = header).to_csv(merged_file, sep = '\t', index = False, mode = 'a', header = False)
+            if read_back:
+                df = _read_merged_eprime(merged_file)
+        else:
+            merged = _read_merged_eprime(merged_file) if len(header) else pd.DataFrame()
+            if replace and 'SourceFile' in merged.columns:
+                merged = merged[~merged['SourceFile'].isin(replace)]
+            merged = pd.concat([merged, df], ignore_index = True, sort = False)
+            merged.to_csv(merged_file, sep='\t',index=False)
+            if read_back:
+                df = merged
+    if incremental:
+        #failed files are retried on the next import: new files are left out of the manifest and changed files keep their previous entry
+        retry = manifest['File'].isin(failed['File'])
+        if previous_manifest is not None:
+            manifest = pd.concat([manifest[~retry], previous_manifest[previous_manifest['File'].isin(failed['File'])]], ignore_index = True)
+        else:
+            manifest = manifest[~retry]
+        manifest.astype({'Records':'Int64'}).to_csv(manifest_file, index = False)
 
-    df = pd.DataFrame()
-    for raw_file in os.listdir(raw_dir):
-        filename = os.fsdecode(raw_file)
-        if filename.endswith(".txt"):
-            df = df.append(__load_eprime(filename), ignore_index = True)
-            print("Successfully appended!")
-    df.to_csv(formatted_dir + os.sep + merged_output_name + '.txt', sep='\t',index=False)
+    profiling.set_rows(len(df.index))
+    if return_diagnostics:
+        return df, diagnostics
     return df
@@ -0,0 +1,248 @@
+"""
+Instrumentation for dlab.
+
+Public methods of EEG.Project and BEH.Project, the io functions and their internal stages (per file loading, trimming
+passes, topomap interpolation, etc.) are instrumented. While profiling is enabled, a record with the wall time, CPU
+time, peak memory (tracemalloc) and rows processed is sent to every sink for each call. While it is disabled, the
+instrumented code only checks a flag.
+
+Example:
+    from dlab import profiling
+    with profiling.profile() as table:
+        project.load(path)
+        project.compute_grands('all')
+    table.summary()
+
+Messages of dlab are sent to the 'dlab' logger, which propagates to the handlers configured by the application (e.g.
+logging.basicConfig). Use set_verbosity to print them to stdout, as in a notebook:
+    profiling.set_verbosity('INFO')
+"""
+import sys
+import json
+import time
+import logging
+import functools
+import contextlib
+import tracemalloc
+
+import pandas as pd
+
+#as a library, dlab does not configure logging: messages go to the application's handlers (see set_verbosity)
+_logger = logging.getLogger('dlab')
+_logger.addHandler(logging.NullHandler())
+_console = None
+
+_enabled = False
+_memory = False
+_started_tracemalloc = False
+_sinks = []
+_stack = []
+
+def set_verbosity(level):
+    """
+    Prints the messages of dlab to stdout from the given level on. The first call adds a handler printing the messages to the 'dlab' logger; later calls only change the level.
+
+    Required Arguments:
+    level (int or str) -- a logging level, e.g. 'INFO' to print every message like the notebooks do, or logging.WARNING or 'WARNING' to only print warnings and errors. 'DEBUG' also prints the records of enabled profiling through LoggingSink.
+    """
+    global _console
+    if _console is None:
+        _console = logging.StreamHandler(sys.stdout)
+        _console.setFormatter(logging.Formatter('%(message)s'))
+        _logger.addHandler(_console)
+    _logger.setLevel(level)
+
+class ProfileTable:
+    """
+    An in-memory sink that keeps every record.
+
+    Public Methods:
+    to_frame -- returns the records as a pandas.DataFrame (one row per call)
+    summary -- returns the total and mean time, peak memory and rows per stage as a pandas.DataFrame
+    clear -- removes all records
+    """
+    def __init__(self):
+        self.records = []
+
+    def __call__(self, record):
+        self.records.append(record)
+
+    def to_frame(self):
+        return pd.DataFrame(self.records, columns = ['name', 'parent', 'depth', 'start', 'wall', 'cpu', 'peak_mb', 'rows'])
+
+    def summary(self):
+        df = self.to_frame()
+        summary = df.groupby('name', sort = False).agg(calls = ('wall', 'size'),
+                                                         wall = ('wall', 'sum'),
+                                                         mean_wall = ('wall', 'mean'),
+                                                         cpu = ('cpu', 'sum'),
+                                                         peak_mb = ('peak_mb', 'max'),
+                                                         rows = ('rows', 'sum'))
+        return summary.sort_values('wall', ascending = False)
+
+    def clear(self):
+        self.records = []
+
+class LoggingSink:
+    """
+    A sink that sends every record to the 'dlab.profiling' logger.
+
+    Optional Arguments:
+    level (int) -- logging level of the records. Default = logging.DEBUG
+    """
+    def __init__(self, level = logging.DEBUG):
+        self.level = level
+        self.logger = logging.getLogger('dlab.profiling')
+
+    def __call__(self, record):
+        self.logger.log(self.level, "%s%s: %.4f s wall, %.4f s cpu%s%s" % ("  " * record['depth'], record['name'], record['wall'], record['cpu'],
+                                                                           ", %.2f MB peak" % record['peak_mb'] if record['peak_mb'] is not None else "",
+                                                                           ", %s rows" % record['rows'] if record['rows'] is not None else ""))
+
+class JSONLinesSink:
+    """
+    A sink that appends every record as a line of JSON to a file.
+
+    Required Arguments:
+    filename (str) -- the file the records are appended to
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def __call__(self, record):
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(record, default = str) + "\n")
+
+def enable(sinks = None, memory = True):
+    """
+    Turns profiling on for the whole session.
+
+    Optional Arguments:
+    sinks (list of callables) -- every record (a dict) is passed to each sink. Default = None (a new ProfileTable)
+    memory (bool) -- if True, peak memory is measured with tracemalloc. Tracing memory makes python code noticeably slower, so use False to only measure time. Default = True
+
+    Returns the list of sinks.
+    """
+    global _enabled, _memory, _started_tracemalloc, _sinks
+    _sinks = list(sinks) if sinks is not None else [ProfileTable()]
+    _memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracemalloc = True
+    _enabled = True
+    return _sinks
+
+def disable():
+    """
+    Turns profiling off. Records are no longer sent to the sinks.
+    """
+    global _enabled, _memory, _started_tracemalloc
+    _enabled = False
+    if _started_tracemalloc:
+        tracemalloc.stop()
+        _started_tracemalloc = False
+    _memory = False
+    del _stack[:]
+
+def is_enabled():
+    return _enabled
+
+@contextlib.contextmanager
+def profile(sinks = None, memory = True):
+    """
+    Context manager that enables profiling inside the with block and yields the first sink (a ProfileTable by default). See enable.
+    """
+    sinks = enable(sinks, memory)
+    try:
+        yield sinks[0] if sinks else None
+    finally:
+        disable()
+
+class _Stage:
+    """
+    Private class: measures one call of an instrumented function or stage.
+    """
+    __slots__ = ['record', 'wall', 'cpu', 'memory', 'peak']
+
+    def __init__(self, name):
+        self.record = {'name':name, 'parent':_stack[-1].record['name'] if _stack else None, 'depth':len(_stack),
+                       'start':time.time(), 'wall':None, 'cpu':None, 'peak_mb':None, 'rows':None}
+
+    def __enter__(self):
+        if _memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if _stack:
+                _stack[-1].peak = max(_stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.memory, self.peak = current, current
+        _stack.append(self)
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exc):
+        self.record['wall'] = time.perf_counter() - self.wall
+        self.record['cpu'] = time.process_time() - self.cpu
+        if _stack and _stack[-1] is self:
+            _stack.pop()
+        if _memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            self.record['peak_mb'] = (self.peak - self.memory) / 2**20
+            tracemalloc.reset_peak()
+            if _stack:
+                _stack[-1].peak = max(_stack[-1].peak, self.peak)
+        for sink in _sinks:
+            sink(self.record)
+        return False
+
+class _Disabled:
+    """
+    Private class: returned by stage while profiling is disabled.
+    """
+    __slots__ = []
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, *exc):
+        return False
+
+_disabled = _Disabled()
+
+def stage(name):
+    """
+    Measures the code in a with block as a stage. The with statement returns the record, so the rows processed can be added with record['rows'] = n.
+
+    Required Arguments:
+    name (str) -- name of the stage, e.g. 'EEG.Project.load.file'
+    """
+    if not _enabled:
+        return _disabled
+    return _Stage(name)
+
+def set_rows(rows):
+    """
+    Sets the rows processed by the innermost running stage or instrumented call. Does nothing if profiling is disabled.
+    """
+    if _enabled and _stack:
+        _stack[-1].record['rows'] = rows
+
+def instrument(function = None, name = None):
+    """
+    Decorator that measures every call of a function as a stage named '<module>.<qualified name>' (e.g. 'EEG.Project.load').
+
+    Optional Arguments:
+    name (str) -- name of the stage. Default = None (the module and qualified name of the function)
+    """
+    if function is None:
+        return functools.partial(instrument, name = name)
+    if name is None:
+        name = "%s.%s" % (function.__module__.split('.')[-1], function.__qualname__)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+        with _Stage(name):
+            return function(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,250 @@
+"""
+Mass-univariate statistics for EEG.Project data.
+
+paired_t computes paired t-tests between two conditions at every electrode x sample at once. cluster_test corrects
+them for multiple comparisons with a cluster-based permutation test (Maris & Oostenveld, 2007): samples above a t
+threshold are grouped into clusters of neighbouring electrodes (see adjacency) and adjacent samples, and the mass (sum
+of t) of every cluster is compared with the largest cluster mass found when the signs of the paired differences are
+flipped at random.
+
+Example:
+    from dlab import stats
+    clusters, labels = stats.cluster_test(project, ['Violation', 'Control'], time_window = [0, 1000], n_jobs = 4)
+"""
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy import stats as st
+from scipy.sparse.csgraph import connected_components
+
+from dlab import profiling
+
+logger = logging.getLogger(__name__)
+
+def adjacency(my_settings, electrodes = None, distance = None):
+    """
+    Returns the electrode neighbours of the montage (the neighbour graph of settings.spatial_index, derived from the 3D positions in coordinates.xyz) as a boolean sparse matrix (electrodes x electrodes). Electrodes without a position (e.g. EOG channels) have no neighbours.
+
+    Required Arguments:
+    my_settings (EEG.settings) -- settings of the project
+
+    Optional Arguments:
+    electrodes (list of str or None) -- electrodes included, in order. Default = None (all electrodes of the montage)
+    distance (float or None) -- electrodes closer than distance are neighbours (in the units of coordinates.xyz). Default = None (1.5 times the median distance between an electrode and its nearest electrode)
+    """
+    index = my_settings.spatial_index(distance)
+    if electrodes is None:
+        return index.adjacency
+    if any(electrode not in index.electrodes for electrode in electrodes):
+        raise ValueError("One of the provided electrodes is not in the montage.")
+    positions = [index.electrodes.index(electrode) for electrode in electrodes]
+    return index.adjacency[positions][:, positions]
+
+def _differences(project, conditions, ppts = [], time_window = None, electrodes = None, data = None):
+    """
+    Private function: returns the paired differences of two conditions of data (default: project.data) as an array (ppt x t x electrode) of settings.accum_dtype with its labels: (differences, ppts, t, electrodes). PPTs missing one of the conditions are dropped.
+    """
+    if data is None:
+        data = project.data
+    if not isinstance(conditions, list) or len(conditions) != 2:
+        raise TypeError("Provide conditions as a list of two conditions: [condition1, condition2].")
+    if any(condition not in data.index.get_level_values('Condition') for condition in conditions):
+        raise ValueError("One of the provided conditions is not in loaded data.")
+
+    array, all_ppts, all_conditions, t, complete = project._as_array(data)
+    if ppts:
+        if any(ppt not in all_ppts for ppt in ppts):
+            raise ValueError("Ensure all provided ppts are in self.data")
+        array, all_ppts = array[all_ppts.get_indexer(ppts)], all_ppts[all_ppts.get_indexer(ppts)]
+
+    samples = slice(None)
+    if time_window is not None:
+        if len(time_window) != 2 or time_window[0] >= time_window[1]:
+            raise ValueError("Provided time_window: %s should be provided as [lower, upper]" % time_window)
+        samples = slice(*project._time_slice(t, time_window[0], time_window[1], include_lower = True))
+        if samples.start >= samples.stop:
+            raise ValueError("Provided time_window: %s contains no time points." % time_window)
+
+    columns = data.columns
+    if electrodes is not None:
+        if any(electrode not in columns for electrode in electrodes):
+            raise ValueError("One of the provided electrodes is not in loaded data.")
+        columns = pd.Index(electrodes)
+
+    first, second = all_conditions.get_indexer(conditions)
+    electrode_positions = data.columns.get_indexer(columns)
+    differences = array[:, first, samples][:, :, electrode_positions].astype(project.settings.accum_dtype) - array[:, second, samples][:, :, electrode_positions]
+
+    if not complete:
+        valid = ~np.isnan(differences).any(axis = (1, 2))
+        if not valid.all():
+            logger.info("Dropped %s PPT(s) missing data in one of the conditions." % (~valid).sum())
+        differences, all_ppts = differences[valid], all_ppts[valid]
+    if len(differences) < 2:
+        raise ValueError("At least 2 PPTs with both conditions are needed.")
+    return differences, all_ppts, t[samples], columns
+
+def _paired_t(values, signs):
+    """
+    Private function: computes paired t values of values (ppt x samples) for every row of a sign flip matrix (permutations x ppt) with one matrix product. The sum of squares does not change with sign flips, so only the means are recomputed.
+    """
+    n = values.shape[0]
+    mean = signs @ values / n
+    var = ((values ** 2).sum(axis = 0) - n * mean ** 2) / (n - 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return mean / np.sqrt(var / n)
+
+@profiling.instrument
+def paired_t(project, conditions, ppts = [], time_window = None, electrodes = None, data = None):
+    """
+    Paired t-tests of condition1 - condition2 at every electrode x sample, computed in one vectorized operation across ppts. p values are two-tailed and uncorrected (see cluster_test).
+
+    Required Arguments:
+    project (EEG.Project) -- a project with loaded data
+    conditions (list of str) -- the two conditions being compared as [condition1, condition2]
+
+    Optional Arguments:
+    ppts (list of int) -- the ppts included. Default = [] (all ppts with both conditions)
+    time_window (list or None) -- [lower, upper] in ms (inclusive) to restrict the samples tested. Default = None (the whole epoch)
+    electrodes (list of str or None) -- electrodes tested. Default = None (all electrodes)
+    data (pd.DataFrame or None) -- data indexed by PPT, Condition and t with electrodes as columns, e.g. the output of project.scan_mean_amps. Default = None (project.data)
+
+    Returns a pd.DataFrame indexed by Statistic ('Mean Difference', 't' and 'p') and t with electrodes as columns, so the whole epoch can be used as the source of plot_EEG.
+    """
+    differences, ppts, t, columns = _differences(project, conditions, ppts, time_window, electrodes, data)
+    n, n_samples, n_electrodes = differences.shape
+    values = differences.reshape(n, -1)
+    t_values = _paired_t(values, np.ones((1, n)))[0]
+    p_values = 2 * st.t.sf(np.abs(t_values), n - 1)
+    profiling.set_rows(values.size)
+    logger.info("Paired t-tests of %s - %s with %s PPTs at %s electrodes x %s samples." % (conditions[0], conditions[1], n, n_electrodes, n_samples))
+
+    index = pd.MultiIndex.from_product([['Mean Difference', 't', 'p'], t], names = ['Statistic', 't'])
+    return pd.DataFrame(np.concatenate([values.mean(axis = 0), t_values, p_values]).reshape(-1, n_electrodes), index = index, columns = columns)
+
+def _edges(neighbours, n_samples):
+    """
+    Private function: returns the edges (rows, cols) of the graph of electrode x sample nodes (node = sample * electrodes + electrode) in which a node is connected to its neighbouring electrodes at the same sample and to the same electrode at the next sample.
+    """
+    n_electrodes = neighbours.shape[0]
+    spatial = sparse.triu(neighbours, k = 1).tocoo()
+    offsets = (np.arange(n_samples) * n_electrodes)[:,None]
+    rows = [(offsets + spatial.row).ravel(), np.arange((n_samples - 1) * n_electrodes)]
+    cols = [(offsets + spatial.col).ravel(), np.arange(n_electrodes, n_samples * n_electrodes)]
+    return np.concatenate(rows), np.concatenate(cols)
+
+def _clusters(t_values, mask, rows, cols):
+    """
+    Private function: labels the connected nodes of mask (0 outside of clusters, 1..n inside) and returns (labels, masses) where masses are the sums of t_values of every cluster.
+    """
+    keep = mask[rows] & mask[cols]
+    graph = sparse.coo_matrix((np.ones(keep.sum(), dtype = bool), (rows[keep], cols[keep])), shape = (len(mask), len(mask)))
+    _, components = connected_components(graph, directed = False)
+    labels = np.zeros(len(mask), dtype = int)
+    _, labels[mask] = np.unique(components[mask], return_inverse = True)
+    labels[mask] += 1
+    return labels, np.bincount(labels, weights = t_values, minlength = 1)[1:]
+
+def _cluster_masses(t_values, threshold, tail, rows, cols):
+    """
+    Private function: returns the clusters of t_values above threshold as a list of (sign, labels, masses) for the tails tested.
+    """
+    out = []
+    if tail >= 0:
+        out.append((1,) + _clusters(t_values, t_values > threshold, rows, cols))
+    if tail <= 0:
+        out.append((-1,) + _clusters(t_values, t_values < -threshold, rows, cols))
+    return out
+
+def _cluster_chunk(values, n_permutations, seed, threshold, tail, rows, cols):
+    """
+    Private function: flips the signs of the ppt differences at random as one matrix (n_permutations x ppt) and returns the largest cluster mass (absolute) of every permutation.
+    """
+    rng = np.random.default_rng(seed)
+    signs = rng.choice([-1.0, 1.0], size = (n_permutations, values.shape[0]))
+    t_values = _paired_t(values, signs)
+    max_mass = np.zeros(n_permutations)
+    for i in range(n_permutations):
+        for sign, labels, masses in _cluster_masses(t_values[i], threshold, tail, rows, cols):
+            if len(masses):
+                max_mass[i] = max(max_mass[i], np.abs(masses).max())
+    return max_mass
+
+@profiling.instrument
+def cluster_test(project, conditions, ppts = [], time_window = None, electrodes = None, data = None, threshold = None, tail = 0, distance = None, n_permutations = 1000, seed = None, chunk_size = 100, n_jobs = 1):
+    """
+    Cluster-based permutation test of condition1 - condition2 over electrodes x samples. Clusters are formed by samples whose paired t exceeds threshold at neighbouring electrodes (see adjacency) or adjacent samples, and are tested by their mass (sum of t) against the distribution of the largest cluster mass under random sign flips of the paired differences, which controls the family-wise error rate across all electrodes and samples.
+
+    Sign flips are generated chunk_size at a time as a matrix and all t values of a chunk are computed with one matrix product. Every chunk has its own seed derived from seed, so results are the same for any n_jobs.
+
+    Required Arguments:
+    project (EEG.Project) -- a project with loaded data
+    conditions (list of str) -- the two conditions being compared as [condition1, condition2]
+
+    Optional Arguments:
+    ppts (list of int) -- the ppts included. Default = [] (all ppts with both conditions)
+    time_window (list or None) -- [lower, upper] in ms (inclusive) to restrict the samples tested. Default = None (the whole epoch)
+    electrodes (list of str or None) -- electrodes tested. Default = None (all electrodes with a position in the montage)
+    data (pd.DataFrame or None) -- data indexed by PPT, Condition and t with electrodes as columns, e.g. the output of project.scan_mean_amps (consecutive windows are adjacent). Default = None (project.data)
+    threshold (float or None) -- |t| a sample must exceed to be part of a cluster. Default = None (the critical t for p < .05, two-tailed if tail = 0)
+    tail (int) -- 0 tests positive and negative clusters, 1 only positive clusters and -1 only negative clusters. Default = 0
+    distance (float or None) -- neighbour distance of the electrodes. See adjacency. Default = None
+    n_permutations (int) -- number of permutations. Default = 1000
+    seed (int or None) -- seed for the random number generator. Default = None
+    chunk_size (int) -- number of permutations computed at once. Default = 100
+    n_jobs (int) -- number of processes the chunks are spread across. Default = 1
+
+    Returns (clusters, labels):
+    clusters (pd.DataFrame) -- one row per cluster, sorted by p, with its sign, mass, number of samples, first and last time point (ms), electrodes and p value
+    labels (pd.DataFrame) -- indexed by t with electrodes as columns, giving the cluster number of every sample (0 if it is not in a cluster)
+    """
+    if tail not in [-1, 0, 1]:
+        raise ValueError("Provided tail: %s is invalid. Please provide -1, 0 or 1." % tail)
+    if not isinstance(n_permutations, int) or n_permutations < 1:
+        raise ValueError("Provided n_permutations: %s must be a positive int." % n_permutations)
+    if electrodes is None:
+        electrodes = project._scalp_electrodes((project.data if data is None else data).columns)
+
+    differences, ppts, t, columns = _differences(project, conditions, ppts, time_window, electrodes, data)
+    n, n_samples, n_electrodes = differences.shape
+    values = differences.reshape(n, -1)
+    if threshold is None:
+        threshold = st.t.ppf(1 - (0.025 if tail == 0 else 0.05), n - 1)
+
+    rows, cols = _edges(adjacency(project.settings, list(columns), distance), n_samples)
+    t_obs = _paired_t(values, np.ones((1, n)))[0]
+
+    with profiling.stage('stats.cluster_test.permutations') as record:
+        sizes = [min(chunk_size, n_permutations - start) for start in range(0, n_permutations, chunk_size)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        args = ([values] * len(sizes), sizes, seeds, [threshold] * len(sizes), [tail] * len(sizes), [rows] * len(sizes), [cols] * len(sizes))
+        if n_jobs > 1 and len(sizes) > 1:
+            with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+                max_mass = np.concatenate(list(executor.map(_cluster_chunk, *args)))
+        else:
+            max_mass = np.concatenate([_cluster_chunk(*chunk_args) for chunk_args in zip(*args)])
+        record['rows'] = n_permutations
+
+    labels = np.zeros(n_samples * n_electrodes, dtype = int)
+    clusters = []
+    for sign, cluster_labels, masses in _cluster_masses(t_obs, threshold, tail, rows, cols):
+        for i, mass in enumerate(masses):
+            nodes = np.flatnonzero(cluster_labels == i + 1)
+            labels[nodes] = len(clusters) + 1
+            samples, cluster_electrodes = np.unique(nodes // n_electrodes), np.unique(nodes % n_electrodes)
+            clusters.append({"Cluster":len(clusters) + 1,
+                             "Sign":"positive" if sign > 0 else "negative",
+                             "Mass":mass,
+                             "Size":len(nodes),
+                             "Start":t[samples[0]],
+                             "End":t[samples[-1]],
+                             "Electrodes":", ".join(columns[cluster_electrodes]),
+                             "p":((max_mass >= abs(mass)).sum() + 1) / (n_permutations + 1)})
+    clusters = pd.DataFrame(clusters, columns = ["Cluster", "Sign", "Mass", "Size", "Start", "End", "Electrodes", "p"])
+    clusters = clusters.sort_values("p", kind = "stable").reset_index(drop = True)
+    profiling.set_rows(values.size)
+
+    logger.info("Cluster permutation test (%s permutations) of %s - %s with %s PPTs at %s electrodes x %s samples: %s cluster(s), %s with p < .05." % (n_permutations, conditions[0], conditions[1], n, n_electrodes, n_samples, len(clusters), (clusters["p"] < .05).sum()))
+    return clusters, pd.DataFrame(labels.reshape(n_samples, n_electrodes), index = pd.Index(t, name = 't'), columns = columns)
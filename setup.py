@@ -14,8 +14,18 @@ setup(
         'savReaderWriter',
         'matplotlib',
         'numpy',
-        'xlrd'
+        'xlrd',
+        'scipy'
     ],
+    extras_require={
+        'parquet': ['pyarrow']
+    },
+    entry_points={
+        'console_scripts': [
+            'dlab-eeg = dlab.cli:eeg_main',
+            'dlab-beh = dlab.cli:beh_main'
+        ]
+    },
     include_package_data=True,
     zip_safe=False
 )